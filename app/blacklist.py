@@ -0,0 +1,84 @@
+"""
+Transaction blacklist: black_list.txt loaded once into a frozenset, reloaded when the file changes or on SIGHUP.
+"""
+import logging
+import os
+import signal
+import time
+
+from app.config import config
+
+BLACKLIST_PATH = getattr(config, "BLACKLIST_PATH", "black_list.txt")
+# 检查文件修改时间的最短间隔（秒）, 两次检查之间的查询只做集合查找
+BLACKLIST_CHECK_INTERVAL = getattr(config, "BLACKLIST_CHECK_INTERVAL", 5)
+
+
+class Blacklist:
+    """
+    黑名单交易集合, 每行一个 txid（忽略空行、# 注释和两侧引号）
+    """
+    def __init__(self, path=BLACKLIST_PATH, check_interval=BLACKLIST_CHECK_INTERVAL):
+        self.path = path
+        self.check_interval = check_interval
+        self._txids = frozenset()
+        self._mtime = None
+        self._checked_at = None
+        self._reload_requested = False
+
+    def __len__(self):
+        self._maybe_refresh()
+        return len(self._txids)
+
+    def __contains__(self, txid):
+        self._maybe_refresh()
+        return txid in self._txids
+
+    def _maybe_refresh(self):
+        if self._reload_requested:
+            self.refresh(force=True)
+        elif self._checked_at is None or time.monotonic() - self._checked_at >= self.check_interval:
+            self.refresh()
+
+    def refresh(self, force=False):
+        """
+        文件修改时间变化（或 force）时重新加载; 文件不存在时黑名单为空
+        """
+        self._checked_at = time.monotonic()
+        self._reload_requested = False
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            if self._txids:
+                logging.info("黑名单文件 %s 已删除, 清空黑名单", self.path)
+            self._txids, self._mtime = frozenset(), None
+            return
+        if not force and mtime == self._mtime:
+            return
+
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                txids = frozenset(
+                    line.strip().strip('"\'') for line in file
+                    if line.strip() and not line.lstrip().startswith("#")
+                )
+        except OSError as e:
+            logging.error("读取黑名单文件 %s 失败: %s", self.path, str(e))
+            return
+        self._txids, self._mtime = txids, mtime
+        logging.info("已加载黑名单 %s: %s 笔交易", self.path, len(txids))
+
+    def request_reload(self, *_):
+        """
+        请求在下一次查询时重新加载（SIGHUP 处理函数, 只设置标志）
+        """
+        self._reload_requested = True
+
+    def install_sighup_handler(self):
+        """
+        收到 SIGHUP 时重新加载黑名单（不支持 SIGHUP 的平台忽略）
+        """
+        if hasattr(signal, "SIGHUP"):
+            signal.signal(signal.SIGHUP, self.request_reload)
+
+
+blacklist = Blacklist()
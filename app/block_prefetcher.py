@@ -0,0 +1,208 @@
+"""
+Block prefetcher: fetch upcoming blocks while the current one is being indexed.
+"""
+import asyncio
+import logging
+
+from app.config import config
+from app.dependencies import syclic_call_rpc, syclic_call_rpc_batch
+from app.notify import chain_notifier
+from app.tx_parser import parse_block
+
+BLOCK_PREFETCH_DEPTH = getattr(config, "BLOCK_PREFETCH_DEPTH", 4)
+BLOCK_PREFETCH_MAX_BYTES = getattr(config, "BLOCK_PREFETCH_MAX_BYTES", 256 * 1024 * 1024)
+# 追上最新区块后未订阅节点通知时的最短轮询间隔（空闲时按 chain_notifier 的系数增长）, 以及出错后的重试间隔
+BLOCK_PREFETCH_POLL_INTERVAL = getattr(config, "BLOCK_PREFETCH_POLL_INTERVAL", 1)
+# "verbose": getblockbyheight verbosity 2 一次获取区块及全部解码交易; "per_tx": verbosity 1 后逐笔批量 getrawtransaction;
+# "raw": 获取原始区块并在本地解析为 app.tx_parser.Transaction (交易历史索引使用)
+BLOCK_FETCH_MODE = getattr(config, "BLOCK_FETCH_MODE", "verbose")
+BLOCK_FETCH_TIMEOUT = getattr(config, "BLOCK_FETCH_TIMEOUT", 120)
+
+# 解码后的 JSON 交易在内存中相对原始区块大小的估算膨胀系数
+DECODED_SIZE_FACTOR = 4
+# 原始区块解析记录 (字节切片 + __slots__ 对象) 的估算膨胀系数
+PARSED_SIZE_FACTOR = 2
+
+
+class PrefetchedBlock:
+    """
+    预取的区块: 区块信息 (block["tx"] 为 txid 列表) 与按 block["tx"] 顺序排列的解码交易
+    (raw 模式下为 app.tx_parser.Transaction)
+    """
+    __slots__ = ("height", "block", "decode_txs", "size")
+
+    def __init__(self, height, block, decode_txs, size):
+        self.height = height
+        self.block = block
+        self.decode_txs = decode_txs
+        self.size = size
+
+    def decoded_by_txid(self):
+        """
+        返回 txid -> 解码交易 的字典
+        """
+        return {tx: decode_tx for tx, decode_tx in zip(self.block["tx"], self.decode_txs)}
+
+
+class BlockPrefetcher:
+    """
+    有界的区块预取队列, 按深度和估算内存占用进行背压
+    """
+    def __init__(self, depth=BLOCK_PREFETCH_DEPTH, max_bytes=BLOCK_PREFETCH_MAX_BYTES, poll_interval=BLOCK_PREFETCH_POLL_INTERVAL, fetch_mode=BLOCK_FETCH_MODE):
+        self.depth = depth
+        self.max_bytes = max_bytes
+        self.poll_interval = poll_interval
+        self.fetch_mode = fetch_mode
+        self._queue = None
+        self._task = None
+        self._next_height = None
+        self._expected_height = None
+        self._queued_bytes = 0
+        self._space = None
+        self._wake = None
+        chain_notifier.add_block_listener(self._on_block)
+
+    async def start(self, height):
+        """
+        从指定高度开始预取
+        """
+        await self.stop()
+        self._queue = asyncio.Queue(maxsize=self.depth)
+        self._space = asyncio.Condition()
+        self._wake = asyncio.Event()
+        self._queued_bytes = 0
+        self._next_height = height
+        self._expected_height = height
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        停止预取并丢弃队列中的区块
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+        self._queue = None
+
+    async def get(self, height):
+        """
+        获取指定高度的预取区块, 请求的高度不连续时（如重启或回滚）从该高度重新预取
+
+        Returns:
+            PrefetchedBlock: 预取的区块
+        """
+        if self._task is None or height != self._expected_height:
+            await self.start(height)
+
+        if self._queue.empty():
+            # 索引程序已确认该区块存在, 唤醒在最新区块处等待的预取任务
+            self._wake.set()
+        prefetched = await self._queue.get()
+        self._expected_height = height + 1
+        await self._release_space(prefetched.size)
+        return prefetched
+
+    def _on_block(self):
+        if self._wake is not None:
+            self._wake.set()
+
+    async def _wait_for_block(self, idle_rounds):
+        """
+        已追上最新区块时等待新区块: 已订阅时等待 hashblock 通知, 否则按自适应间隔轮询; get 请求新区块时立即唤醒
+
+        Returns:
+            int: 下一轮的 idle_rounds
+        """
+        if chain_notifier.subscribed:
+            timeout = chain_notifier.idle_timeout
+        else:
+            timeout, idle_rounds = chain_notifier.poll_timeout(self.poll_interval, idle_rounds)
+        try:
+            await asyncio.wait_for(self._wake.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._wake.clear()
+        return idle_rounds
+
+    async def _release_space(self, size):
+        async with self._space:
+            self._queued_bytes -= size
+            self._space.notify_all()
+
+    async def _wait_for_space(self, size):
+        # 队列为空时总是允许放入, 避免超大区块永远无法预取
+        async with self._space:
+            await self._space.wait_for(lambda: self._queued_bytes == 0 or self._queued_bytes + size <= self.max_bytes)
+            self._queued_bytes += size
+
+    async def _fetch_verbose(self, height):
+        block = await syclic_call_rpc(method="getblockbyheight", params=[height, 2], timeout=BLOCK_FETCH_TIMEOUT)
+        if not block or not all(isinstance(tx, dict) for tx in block.get("tx", [])):
+            return None, None
+
+        # 与 verbosity 1 的格式保持一致: block["tx"] 为 txid 列表
+        decode_txs = block["tx"]
+        block["tx"] = [decode_tx["txid"] for decode_tx in decode_txs]
+        return block, decode_txs
+
+    async def _fetch_per_tx(self, height):
+        block = await syclic_call_rpc(method="getblockbyheight", params=[height, 1])
+        decode_txs = await syclic_call_rpc_batch([("getrawtransaction", [tx, 1]) for tx in block["tx"]])
+        return block, decode_txs
+
+    async def _fetch_raw(self, height):
+        block = await syclic_call_rpc(method="getblockbyheight", params=[height, 1])
+        block_hex = await syclic_call_rpc(method="getblock", params=[block["hash"], 0], timeout=BLOCK_FETCH_TIMEOUT)
+        return block, parse_block(bytes.fromhex(block_hex), block["tx"])
+
+    async def fetch_block(self, height):
+        """
+        获取区块及其全部解码交易, 优先使用 verbosity 2 一次性获取, 节点不支持时回退为逐笔批量获取
+
+        Returns:
+            tuple: (区块信息, 按 block["tx"] 顺序排列的解码交易)
+        """
+        if self.fetch_mode == "raw":
+            return await self._fetch_raw(height)
+        if self.fetch_mode == "verbose":
+            block, decode_txs = await self._fetch_verbose(height)
+            if block is not None:
+                return block, decode_txs
+            logging.warning("节点不支持 getblockbyheight verbosity 2, 回退为逐笔获取交易")
+            self.fetch_mode = "per_tx"
+        return await self._fetch_per_tx(height)
+
+    async def _run(self):
+        block_count = -1
+        idle_rounds = 0
+        while True:
+            try:
+                if self._next_height > block_count:
+                    block_count = await syclic_call_rpc(method="getblockcount", params=[])
+                    if self._next_height > block_count:
+                        idle_rounds = await self._wait_for_block(idle_rounds)
+                        continue
+                idle_rounds = 0
+
+                block, decode_txs = await self.fetch_block(self._next_height)
+                size_factor = PARSED_SIZE_FACTOR if self.fetch_mode == "raw" else DECODED_SIZE_FACTOR
+                prefetched = PrefetchedBlock(self._next_height, block, decode_txs, block.get("size", 0) * size_factor)
+                await self._wait_for_space(prefetched.size)
+                try:
+                    await self._queue.put(prefetched)
+                except BaseException:
+                    await self._release_space(prefetched.size)
+                    raise
+                self._next_height += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error("预取区块 %s 出错: %s", self._next_height, str(e))
+                await asyncio.sleep(self.poll_interval)
+
+
+block_prefetcher = BlockPrefetcher()
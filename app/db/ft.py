@@ -1,12 +1,286 @@
 import logging
-from app.dependencies import DBManager
+from collections import defaultdict
+from app.dependencies import DBManager, WriteBuffer
+from app.script_classifier import classify_output
+from app.db.undo_journal import undo_journal
+from app.state import state
 
+# ft_txo_set 写缓存, 由区块处理结束时统一刷新
+ft_txo_set_buffer = WriteBuffer(
+    "ft_txo_set",
+    ("utxo_txid", "utxo_vout", "ft_holder_combine_script", "ft_contract_id", "utxo_balance", "ft_balance", "if_spend"),
+    key_columns=("utxo_txid", "utxo_vout"),
+    update_columns=("ft_holder_combine_script", "ft_contract_id", "utxo_balance", "ft_balance", "if_spend")
+)
 
-async def process_ft_tokens(decode_tx, output_index, timestamp):
+
+class FTBalanceAggregator:
+    """
+    在区块内累积 (持有者组合脚本, 合约ID) 的净余额变化, 区块结束时一次性写入 ft_balance 和 ft_holders_count
+    """
+    def __init__(self, chunk_size=500):
+        self.chunk_size = chunk_size
+        self._deltas = defaultdict(int)
+        self._balance_buffer = WriteBuffer(
+            "ft_balance",
+            ("ft_holder_combine_script", "ft_contract_id", "ft_balance"),
+            key_columns=("ft_holder_combine_script", "ft_contract_id"),
+            update_columns=("ft_balance",),
+            flush_size=chunk_size
+        )
+
+    def __len__(self):
+        return len(self._deltas)
+
+    def add(self, holder_combine_script, ft_contract_id, amount):
+        """
+        累加余额变化, 输出为正数, 花费为负数
+        """
+        self._deltas[(holder_combine_script, ft_contract_id)] += amount
+
+    def discard(self):
+        """
+        丢弃尚未写入的余额变化（区块回滚时使用）
+        """
+        self._deltas = defaultdict(int)
+        self._balance_buffer.take()
+
+    async def _query_balances(self, conn, keys):
+        # 内存状态可用时直接读取, 不查询 ft_balance
+        if state.loaded:
+            balances = {}
+            for key in keys:
+                ft_balance = state.ft_balances.get(*key)
+                if ft_balance is not None:
+                    balances[key] = ft_balance
+            return balances
+
+        balances = {}
+        for start in range(0, len(keys), self.chunk_size):
+            chunk = keys[start:start + self.chunk_size]
+            query = f"""
+            SELECT ft_holder_combine_script, ft_contract_id, ft_balance
+            FROM ft_balance
+            WHERE (ft_holder_combine_script, ft_contract_id) IN ({", ".join(["(%s, %s)"] * len(chunk))})
+            """
+            rows = await DBManager.execute_query_with_conn(conn, query, [value for key in chunk for value in key])
+            for holder_combine_script, ft_contract_id, ft_balance in rows:
+                balances[(holder_combine_script, ft_contract_id)] = ft_balance
+        return balances
+
+    async def flush(self, conn):
+        """
+        在指定连接上写入累积的余额变化（不提交）
+        """
+        deltas = {key: amount for key, amount in self._deltas.items() if amount != 0}
+        self._deltas = defaultdict(int)
+        if not deltas:
+            return
+
+        keys = list(deltas.keys())
+        balances = await self._query_balances(conn, keys)
+
+        removed_keys = []
+        holders_changes = defaultdict(int)
+        for key, amount in deltas.items():
+            old_balance = balances.get(key)
+            new_balance = (old_balance or 0) + amount
+            if state.loaded:
+                state.ft_balances.set(key[0], key[1], new_balance if new_balance > 0 else None)
+            if new_balance > 0:
+                self._balance_buffer.add((key[0], key[1], new_balance))
+                if old_balance is None:
+                    holders_changes[key[1]] += 1
+                    undo_journal.record_insert("ft_balance", key)
+                else:
+                    undo_journal.record_update("ft_balance", key, {"ft_balance": old_balance})
+            else:
+                if new_balance < 0:
+                    logging.warning("Negative FT balance %s for holder %s of %s", new_balance, key[0], key[1])
+                if old_balance is not None:
+                    removed_keys.append(key)
+                    holders_changes[key[1]] -= 1
+                    undo_journal.record_delete("ft_balance", {"ft_holder_combine_script": key[0], "ft_contract_id": key[1], "ft_balance": old_balance})
+
+        # 余额大于零的记录一次性 upsert
+        await self._balance_buffer.flush(conn)
+
+        # 余额归零的记录批量删除
+        for start in range(0, len(removed_keys), self.chunk_size):
+            chunk = removed_keys[start:start + self.chunk_size]
+            query = f"""
+            DELETE FROM ft_balance
+            WHERE (ft_holder_combine_script, ft_contract_id) IN ({", ".join(["(%s, %s)"] * len(chunk))})
+            """
+            await DBManager.execute_update_nocommit(conn, query, [value for key in chunk for value in key])
+
+        # 按合约汇总持有者数量变化
+        holders_params = [(change, ft_contract_id) for ft_contract_id, change in holders_changes.items() if change != 0]
+        if holders_params:
+            ft_tokens_update = """
+            UPDATE ft_tokens
+            SET ft_holders_count = ft_holders_count + %s
+            WHERE ft_contract_id = %s
+            """
+            await DBManager.execute_many_nocommit(conn, ft_tokens_update, holders_params)
+            for change, ft_contract_id in holders_params:
+                undo_journal.record_increment("ft_tokens", (ft_contract_id,), "ft_holders_count", change)
+
+
+ft_balance_aggregator = FTBalanceAggregator()
+
+
+class FTContractCache:
+    """
+    ft_origin_utxo -> ft_contract_id 的内存缓存, FT 转移时不再查询 ft_tokens
+
+    首次使用时从 ft_tokens 全量加载（代币数量少且只在铸造时增加）; 铸造时写入当前区块的暂存,
+    区块提交后 commit 并入缓存, 事务回滚时 discard; 链重组回滚后 invalidate, 下次使用时重新加载
+    """
+    def __init__(self):
+        self._contracts = None
+        self._staged = {}
+
+    def __len__(self):
+        return len(self._contracts or ()) + len(self._staged)
+
+    async def load(self):
+        """
+        从 ft_tokens 加载已提交的全部代币（使用独立连接, 不包含当前区块事务中尚未提交的铸造）
+        """
+        rows = await DBManager.execute_query("SELECT ft_origin_utxo, ft_contract_id FROM ft_tokens")
+        contracts = {}
+        for ft_origin_utxo, ft_contract_id in rows:
+            contracts.setdefault(ft_origin_utxo, ft_contract_id)
+        self._contracts = contracts
+        logging.info("已加载 FT 合约缓存: %s 个代币", len(contracts))
+
+    async def get(self, ft_origin_utxo):
+        """
+        查询 origin UTXO 对应的合约ID, 不存在时返回 None（首次铸造）
+        """
+        ft_contract_id = self._staged.get(ft_origin_utxo)
+        if ft_contract_id is not None:
+            return ft_contract_id
+        if self._contracts is None:
+            await self.load()
+        return self._contracts.get(ft_origin_utxo)
+
+    def add(self, ft_origin_utxo, ft_contract_id):
+        """
+        记录当前区块中铸造的代币
+        """
+        self._staged.setdefault(ft_origin_utxo, ft_contract_id)
+
+    def commit(self):
+        """
+        区块事务提交后将暂存的铸造并入缓存
+        """
+        staged, self._staged = self._staged, {}
+        if self._contracts is not None:
+            for ft_origin_utxo, ft_contract_id in staged.items():
+                self._contracts.setdefault(ft_origin_utxo, ft_contract_id)
+
+    def discard(self):
+        """
+        丢弃当前区块暂存的铸造（区块事务回滚时使用）
+        """
+        self._staged = {}
+
+    def invalidate(self):
+        """
+        清空缓存, 下次使用时重新加载（链重组回滚 ft_tokens 后使用）
+        """
+        self._contracts = None
+        self._staged = {}
+
+
+ft_contract_cache = FTContractCache()
+
+
+class FTUnspentIndex:
+    """
+    FT 输入的花费处理: 内存状态 (app.state) 可用时从未花费 FT 输出中查找, 不是 FT 输出的输入不访问数据库;
+    内存状态停用时逐个输入查询 ft_txo_set。花费在区块结束时以一条 UPDATE 批量标记
+    """
+    def __init__(self, chunk_size=500):
+        self.chunk_size = chunk_size
+        self._staged_spent = {}
+
+    def add(self, utxo_txid, utxo_vout, ft_contract_id, holder_combine_script, ft_balance):
+        """
+        记录当前区块中新增的 FT 输出
+        """
+        if state.loaded:
+            state.ft_unspent.add(utxo_txid, utxo_vout, ft_contract_id, holder_combine_script, ft_balance)
+
+    def spend_buffered(self, utxo_txid, utxo_vout):
+        """
+        花费仍在 ft_txo_set 写缓存中的输出（由写缓存直接标记为已花费, 不需要 UPDATE）
+        """
+        if state.loaded:
+            state.ft_unspent.spend(utxo_txid, utxo_vout)
+
+    async def spend(self, conn, utxo_txid, utxo_vout):
+        """
+        标记输入花费的 FT 输出, 在区块结束时 flush 写入
+
+        Returns:
+            tuple: 被花费输出的 (合约ID, 持有者组合脚本, 代币余额), 不是未花费的 FT 输出时返回 None
+        """
+        key = (utxo_txid, utxo_vout)
+        if key in self._staged_spent:
+            return None
+
+        if state.loaded:
+            spent_utxo_info = state.ft_unspent.spend(utxo_txid, utxo_vout)
+        else:
+            ft_txo_query = """
+            SELECT ft_contract_id, ft_holder_combine_script, ft_balance
+            FROM ft_txo_set
+            WHERE utxo_txid = %s AND utxo_vout = %s
+            """
+            ft_txo_query_res = await DBManager.execute_query_with_conn(conn, ft_txo_query, key)
+            spent_utxo_info = tuple(ft_txo_query_res[0]) if ft_txo_query_res else None
+        if spent_utxo_info is None:
+            return None
+        self._staged_spent[key] = None
+        return spent_utxo_info
+
+    async def flush(self, conn):
+        """
+        在指定连接上以批量 UPDATE 标记当前区块花费的输出（不提交）
+        """
+        spent_keys, self._staged_spent = list(self._staged_spent), {}
+        for start in range(0, len(spent_keys), self.chunk_size):
+            chunk = spent_keys[start:start + self.chunk_size]
+            query = f"""
+            UPDATE ft_txo_set
+            SET if_spend = 1
+            WHERE (utxo_txid, utxo_vout) IN ({", ".join(["(%s, %s)"] * len(chunk))})
+            """
+            await DBManager.execute_update_nocommit(conn, query, [value for key in chunk for value in key])
+        for key in spent_keys:
+            undo_journal.record_update("ft_txo_set", key, {"if_spend": 0})
+
+    def discard(self):
+        """
+        丢弃当前区块暂存的花费（区块事务回滚时使用）
+        """
+        self._staged_spent = {}
+
+
+ft_unspent_index = FTUnspentIndex()
+
+
+async def process_ft_tokens(conn, decode_tx, output_index, timestamp, script_infos=None):
     """处理同质化代币信息并更新ft_tokens表"""
     decode_txid = decode_tx["txid"]
+    if script_infos is None:
+        script_infos = [classify_output(output) for output in decode_tx["vout"]]
+    ft_code_info = script_infos[output_index]
     
-    if not decode_tx["vout"][output_index]["scriptPubKey"]["asm"].startswith("9 OP_PICK OP_TOALTSTACK"):
+    if ft_code_info.template not in ("ft", "pool"):
         return output_index, None, None, None, False
     
     if len(decode_tx["vout"]) - output_index <= 1:
@@ -14,36 +288,26 @@ async def process_ft_tokens(decode_tx, output_index, timestamp):
         return output_index, None, None, None, True
 
     # 排除错误版本的 TBC20
-    if decode_tx["vout"][output_index]["scriptPubKey"]["asm"][-32:-11] == "OP_CHECKSIG OP_RETURN":
+    if ft_code_info.legacy_ft:
         return output_index, None, None, None, True
     
-    vout_combine_script = decode_tx["vout"][output_index]["scriptPubKey"]["hex"][-54:-12]
+    ft_tape_script_info = script_infos[output_index + 1]
+    vout_combine_script = ft_code_info.combine_script
     ft_balance = 0
-    ft_balance_tape = decode_tx["vout"][output_index + 1]["scriptPubKey"]["asm"][12:108]
+    ft_balance_tape = ft_tape_script_info.asm_slice(12, 108)
     for i in range(0, len(ft_balance_tape), 16):
         segment = ft_balance_tape[i:i+16]
         segment = ''.join([segment[i:i+2] for i in range(0, len(segment), 2)][::-1])
         ft_balance += int(segment, 16)
-    vout_utxo_balance = round(decode_tx["vout"][output_index]["value"] * 1_000_000)
     
-    # 确定是否为首次铸造
-    ft_origin_utxo = decode_tx["vout"][output_index]["scriptPubKey"]["asm"][2384:2456]
-    # 处理新版本代币协议
-    if ft_origin_utxo == "P OP_EQUAL OP_IF OP_FROMALTSTACK OP_DROP OP_TOALTSTACK OP_TOALTSTACK OP_":
-        ft_origin_utxo = ft_origin_utxo = decode_tx["vout"][output_index]["scriptPubKey"]["asm"][2477:2549]
-    # 处理 LP 输出
-    if ft_origin_utxo == "UALVERIFY OP_ENDIF OP_DUP 2 OP_EQUAL OP_IF OP_DROP 2 OP_PICK 2 OP_PICK O":
-        ft_origin_utxo = "LP"
+    # 确定是否为首次铸造（origin UTXO 由分类器按协议版本提取, LP 输出为 "LP"）
+    ft_origin_utxo = ft_code_info.origin_utxo
     
-    ft_tokens_query = """
-    SELECT ft_contract_id FROM ft_tokens WHERE ft_origin_utxo = %s
-    """
-    ft_tokens_query_res = await DBManager.execute_query(ft_tokens_query, (ft_origin_utxo,))
+    ft_contract_id = await ft_contract_cache.get(ft_origin_utxo)
     
     # 转移 FT
-    if ft_tokens_query_res:
+    if ft_contract_id is not None:
         logging.info("FT Transfer:            %s", decode_txid)
-        ft_contract_id = ft_tokens_query_res[0][0]
     # 铸造 FT
     else:
         logging.info("FT Mint:                %s", decode_txid)
@@ -63,13 +327,13 @@ async def process_ft_tokens(decode_tx, output_index, timestamp):
         ft_token_price = 0.0
 
         try:
-            tape_parts = decode_tx["vout"][output_index + 1]["scriptPubKey"]["asm"].split(" ")
-            ft_decimal = int(tape_parts[3])
-            ft_tape_info = decode_tx["vout"][output_index + 1]["scriptPubKey"]["hex"][106:-12]
-            ft_name_len = int(ft_tape_info[0:2], 16)
-            ft_name = bytes.fromhex(ft_tape_info[2:2+ft_name_len*2]).decode('utf-8')
-            ft_symbol_len = int(ft_tape_info[2+ft_name_len*2:4+ft_name_len*2], 16)
-            ft_symbol = bytes.fromhex(ft_tape_info[4+ft_name_len*2:4+ft_name_len*2+ft_symbol_len*2]).decode('utf-8')
+            ft_decimal = int(ft_tape_script_info.asm_element(3))
+            # 对应 tape hex[106:-12]
+            ft_tape_info = bytes(ft_tape_script_info.script[53:-6])
+            ft_name_len = ft_tape_info[0]
+            ft_name = ft_tape_info[1:1+ft_name_len].decode('utf-8')
+            ft_symbol_len = ft_tape_info[1+ft_name_len]
+            ft_symbol = ft_tape_info[2+ft_name_len:2+ft_name_len+ft_symbol_len].decode('utf-8')
         except Exception as e:
             logging.error("Error parsing FT token info %s: %s", decode_txid, e)
             return output_index, None, None, None, True
@@ -94,15 +358,17 @@ async def process_ft_tokens(decode_tx, output_index, timestamp):
             ft_token_price = new.ft_token_price
         """
         try:
-            await DBManager.execute_update(ft_token_insert_query, (ft_contract_id, ft_code_script, ft_tape_script, ft_supply, ft_decimal, ft_name, ft_symbol, ft_description, ft_origin_utxo, ft_creator_combine_script, ft_holders_count, ft_icon_url, ft_create_timestamp, ft_token_price))
+            await DBManager.execute_update_nocommit(conn, ft_token_insert_query, (ft_contract_id, ft_code_script, ft_tape_script, ft_supply, ft_decimal, ft_name, ft_symbol, ft_description, ft_origin_utxo, ft_creator_combine_script, ft_holders_count, ft_icon_url, ft_create_timestamp, ft_token_price))
         except Exception as e:
             logging.error("Error inserting FT token %s: %s", decode_txid, e)
             return output_index, None, None, None, True
+        undo_journal.record_insert("ft_tokens", (ft_contract_id,))
+        ft_contract_cache.add(ft_origin_utxo, ft_contract_id)
         
     return output_index + 2, ft_contract_id, vout_combine_script, ft_balance, False
 
 
-async def process_ft_txo_set(decode_tx, output_index, ft_contract_id, vout_combine_script, ft_balance):
+async def process_ft_txo_set(conn, decode_tx, output_index, ft_contract_id, vout_combine_script, ft_balance):
     """处理同质化代币UTXO并更新ft_txo_set表（仅处理当前输出）"""
     decode_txid = decode_tx["txid"]
     
@@ -112,103 +378,54 @@ async def process_ft_txo_set(decode_tx, output_index, ft_contract_id, vout_combi
     vout_utxo_balance = round(decode_tx["vout"][output_index - 2]["value"] * 1_000_000)
     if_spend = 0
     
-    # 插入记录到 ft_txo_set 表
-    ft_utxo_set_insert_query = """
-    INSERT INTO ft_txo_set (utxo_txid, utxo_vout, ft_holder_combine_script, ft_contract_id, utxo_balance, ft_balance, if_spend)
-    VALUES (%s, %s, %s, %s, %s, %s, %s) AS new
-    ON DUPLICATE KEY UPDATE
-        ft_holder_combine_script = new.ft_holder_combine_script,
-        ft_contract_id = new.ft_contract_id,
-        utxo_balance = new.utxo_balance,
-        ft_balance = new.ft_balance,
-        if_spend = new.if_spend
-    """
-    try:
-        await DBManager.execute_update(ft_utxo_set_insert_query, (decode_txid, output_index - 2, vout_combine_script, ft_contract_id, vout_utxo_balance, ft_balance, if_spend))
-    except Exception as e:
-        logging.error("Error inserting FT TXO set %s: %s", decode_txid, e)
-        return True
+    # 写入 ft_txo_set 缓存, 由 process_transactions 在达到阈值和区块结束时批量写入
+    ft_txo_set_buffer.add((decode_txid, output_index - 2, vout_combine_script, ft_contract_id, vout_utxo_balance, ft_balance, if_spend))
+    undo_journal.record_insert("ft_txo_set", (decode_txid, output_index - 2))
+    ft_unspent_index.add(decode_txid, output_index - 2, ft_contract_id, vout_combine_script, ft_balance)
     
     return False
 
 
-async def process_ft_balance(ft_contract_id, vout_combine_script, ft_balance):
-    """处理同质化代币余额并更新ft_balance表（仅处理输出余额增加）"""
+async def process_ft_balance(conn, ft_contract_id, vout_combine_script, ft_balance):
+    """处理同质化代币余额（仅处理输出余额增加），累积到 ft_balance_aggregator 中在区块结束时写入"""
     if ft_contract_id is None:
         return False
     
-    # 如果 ft_balance 记录不存在，插入记录到 ft_balance 表
-    ft_balance_query = """
-    SELECT ft_balance FROM ft_balance WHERE ft_contract_id = %s and ft_holder_combine_script = %s
-    """
-    try:
-        ft_balance_query_res = await DBManager.execute_query(ft_balance_query, (ft_contract_id, vout_combine_script))
-        
-        if not ft_balance_query_res:
-            ft_balance_insert_query = """
-            INSERT INTO ft_balance (ft_holder_combine_script, ft_contract_id, ft_balance)
-            VALUES (%s, %s, %s)
-            """
-            await DBManager.execute_update(ft_balance_insert_query, (vout_combine_script, ft_contract_id, ft_balance))
-
-            # ft_holders_count 增加
-            ft_tokens_update = """
-            UPDATE ft_tokens
-            SET ft_holders_count = ft_holders_count + 1
-            WHERE ft_contract_id = %s
-            """
-            await DBManager.execute_update(ft_tokens_update, (ft_contract_id,))
-        else:
-            ft_balance_update_query = """
-            UPDATE ft_balance
-            SET ft_balance = ft_balance + %s
-            WHERE ft_holder_combine_script = %s and ft_contract_id = %s
-            """
-            await DBManager.execute_update(ft_balance_update_query, (ft_balance, vout_combine_script, ft_contract_id))
-    except Exception as e:
-        logging.error("Error updating FT balance %s: %s", ft_contract_id, e)
-        return True
-    
+    ft_balance_aggregator.add(vout_combine_script, ft_contract_id, ft_balance)
     return False
 
 
-async def process_ft_inputs(decode_tx):
-    """处理交易的所有FT输入，更新已花费的UTXO并返回已花费的UTXO信息"""
+async def process_ft_inputs(conn, decode_tx):
+    """处理交易的所有FT输入，标记已花费的UTXO（区块结束时批量写入）并返回已花费的UTXO信息"""
     spent_utxo_info_list = []
     
     # 更新已花费的 UTXO
     for vin in decode_tx["vin"]:
         if "scriptSig" in vin and vin["scriptSig"]["asm"].startswith("1 "):
-            ft_txo_query = """
-            SELECT ft_contract_id, ft_holder_combine_script, ft_balance
-            FROM ft_txo_set
-            WHERE utxo_txid = %s AND utxo_vout = %s
-            """
+            # 同一区块内创建的 UTXO 仍在写缓存中, 直接在缓存中标记为已花费
+            buffered_row = ft_txo_set_buffer.get((vin["txid"], vin["vout"]))
+            if buffered_row is not None:
+                ft_txo_set_buffer.update((vin["txid"], vin["vout"]), if_spend=1)
+                ft_unspent_index.spend_buffered(vin["txid"], vin["vout"])
+                spent_utxo_info_list.append((buffered_row[3], buffered_row[2], buffered_row[5]))
+                continue
+
+            # 在未花费 FT UTXO 索引中查找, 不是 FT 输出时不访问数据库
             try:
-                ft_txo_query_res = await DBManager.execute_query(ft_txo_query, (vin["txid"], vin["vout"]))
-                if ft_txo_query_res and len(ft_txo_query_res) > 0 and len(ft_txo_query_res[0]) == 3:
-                    # 更新 ft_txo_set
-                    ft_utxo_update_query = """
-                    UPDATE ft_txo_set
-                    SET if_spend = 1
-                    WHERE utxo_txid = %s AND utxo_vout = %s
-                    """
-                    await DBManager.execute_update(ft_utxo_update_query, (vin["txid"], vin["vout"]))
-                    
-                    # 添加到已花费UTXO列表
-                    spent_utxo_info_list.append(ft_txo_query_res[0])
-                elif ft_txo_query_res:
-                    logging.warning("Invalid ft_txo_query_res format for %s: %s", vin["txid"], ft_txo_query_res)
+                spent_utxo_info = await ft_unspent_index.spend(conn, vin["txid"], vin["vout"])
             except Exception as e:
                 logging.error("Error updating spent UTXO %s: %s", vin["txid"], e)
                 return []
+            if spent_utxo_info is not None:
+                # 添加到已花费UTXO列表
+                spent_utxo_info_list.append(spent_utxo_info)
     
     return spent_utxo_info_list
 
 
 
-async def process_spent_ft_balances(spent_utxo_info_list):
-    """处理已花费的FT UTXO对应的余额更新"""
+async def process_spent_ft_balances(conn, spent_utxo_info_list):
+    """处理已花费的FT UTXO对应的余额更新，累积到 ft_balance_aggregator 中在区块结束时写入"""
     if not spent_utxo_info_list or not isinstance(spent_utxo_info_list, list) or len(spent_utxo_info_list) == 0:
         return False
         
@@ -218,42 +435,6 @@ async def process_spent_ft_balances(spent_utxo_info_list):
             continue
             
         spent_ft_contract_id, spent_holder_script, spent_ft_balance = spent_utxo_info
-        
-        ft_balance_query = """
-        SELECT ft_balance
-        FROM ft_balance
-        WHERE ft_contract_id = %s AND ft_holder_combine_script = %s
-        """
-        try:
-            ft_balance_query_res = await DBManager.execute_query(ft_balance_query, (spent_ft_contract_id, spent_holder_script))
-            
-            if ft_balance_query_res:
-                ft_balance_balance = ft_balance_query_res[0][0]
-                # 如果 ft_balance.ft_balance 等于 ft_balance，删除记录并且 ft_tokens.ft_holders_count - 1
-                if ft_balance_balance == spent_ft_balance:
-                    ft_balance_delete_query = """
-                    DELETE FROM ft_balance 
-                    WHERE ft_holder_combine_script = %s 
-                    AND ft_contract_id = %s 
-                    """
-                    await DBManager.execute_update(ft_balance_delete_query, (spent_holder_script, spent_ft_contract_id))
-                    
-                    ft_tokens_update = """
-                    UPDATE ft_tokens
-                    SET ft_holders_count = ft_holders_count - 1
-                    WHERE ft_contract_id = %s
-                    """
-                    await DBManager.execute_update(ft_tokens_update, (spent_ft_contract_id,))
-                elif ft_balance_balance > spent_ft_balance:
-                    ft_balance_update_query = """
-                    UPDATE ft_balance
-                    SET ft_balance = ft_balance - %s
-                    WHERE ft_holder_combine_script = %s 
-                    AND ft_contract_id = %s 
-                    """                            
-                    await DBManager.execute_update(ft_balance_update_query, (spent_ft_balance, spent_holder_script, spent_ft_contract_id))
-        except Exception as e:
-            logging.error("Error updating spent FT balance %s: %s", spent_ft_contract_id, e)
-            return True
+        ft_balance_aggregator.add(spent_holder_script, spent_ft_contract_id, -spent_ft_balance)
     
     return False
@@ -0,0 +1,122 @@
+import json
+import logging
+from app.config import config
+from app.dependencies import DBManager, syclic_call_rpc
+
+# 保留区块哈希和撤销日志的区块数, 即可自动回滚的最大分叉深度
+REORG_UNDO_DEPTH = getattr(config, "REORG_UNDO_DEPTH", 100)
+
+
+def status_names(prefix=""):
+    """
+    返回 t_index_build_status 中的状态名称, 不同索引程序使用不同前缀区分
+    """
+    return prefix + "index_height", prefix + "mempool", prefix + "last_mempool"
+
+
+async def load_index_status(prefix=""):
+    """
+    读取索引检查点
+
+    Args:
+        prefix: 状态名称前缀
+
+    Returns:
+        tuple: (index_height, mempool, last_mempool), 从未写入过检查点时 index_height 为 None
+    """
+    height_name, mempool_name, last_mempool_name = status_names(prefix)
+    query = "SELECT name, value FROM t_index_build_status WHERE name IN (%s, %s, %s)"
+    rows = await DBManager.execute_query(query, (height_name, mempool_name, last_mempool_name))
+    values = {name: value for name, value in rows}
+
+    index_height = int(values.get(height_name) or 0) or None
+    try:
+        mempool = json.loads(values.get(mempool_name) or "[]")
+        last_mempool = json.loads(values.get(last_mempool_name) or "[]")
+    except ValueError:
+        logging.warning("索引检查点中的内存池数据无效, 将重新处理内存池")
+        mempool, last_mempool = [], []
+    return index_height, mempool, last_mempool
+
+
+async def save_index_status_nocommit(conn, index_height, mempool, last_mempool, prefix=""):
+    """
+    在当前事务中写入索引检查点（不提交）, 与区块数据一同提交
+
+    Args:
+        conn: 当前区块事务使用的数据库连接
+        index_height: 下一个待处理的区块高度
+        mempool: 已处理的内存池交易
+        last_mempool: 上一个区块已处理的交易
+        prefix: 状态名称前缀
+    """
+    height_name, mempool_name, last_mempool_name = status_names(prefix)
+    query = """
+    INSERT INTO t_index_build_status (name, value)
+    VALUES (%s, %s), (%s, %s), (%s, %s) AS new
+    ON DUPLICATE KEY UPDATE value = new.value
+    """
+    await DBManager.execute_update_nocommit(conn, query, (
+        height_name, str(index_height),
+        mempool_name, json.dumps(mempool),
+        last_mempool_name, json.dumps(last_mempool)
+    ))
+
+
+async def save_block_hash_nocommit(conn, height, block_hash, prefix=""):
+    """
+    在当前事务中记录已索引区块的哈希（不提交）, 并删除超出保留深度的旧记录
+
+    Args:
+        conn: 当前区块事务使用的数据库连接
+        height: 区块高度
+        block_hash: 区块哈希
+        prefix: 索引程序的状态名称前缀
+    """
+    query = """
+    INSERT INTO t_index_block_hash (indexer, height, block_hash)
+    VALUES (%s, %s, %s) AS new
+    ON DUPLICATE KEY UPDATE block_hash = new.block_hash
+    """
+    await DBManager.execute_update_nocommit(conn, query, (prefix, height, block_hash))
+    prune_query = "DELETE FROM t_index_block_hash WHERE indexer = %s AND height <= %s"
+    await DBManager.execute_update_nocommit(conn, prune_query, (prefix, height - REORG_UNDO_DEPTH))
+
+
+async def delete_block_hashes_nocommit(conn, fork_height, prefix=""):
+    """
+    删除分叉点之后的区块哈希（不提交）
+    """
+    query = "DELETE FROM t_index_block_hash WHERE indexer = %s AND height > %s"
+    await DBManager.execute_update_nocommit(conn, query, (prefix, fork_height))
+
+
+async def find_fork_height(height, previous_block_hash, prefix=""):
+    """
+    检查待处理区块是否接在已索引的链上
+
+    Args:
+        height: 待处理区块的高度
+        previous_block_hash: 待处理区块的 previousblockhash
+        prefix: 索引程序的状态名称前缀
+
+    Returns:
+        int: 发生重组时返回分叉点高度（新旧链共同的最高区块）, 否则返回 None
+    """
+    query = """
+    SELECT height, block_hash FROM t_index_block_hash
+    WHERE indexer = %s AND height < %s
+    ORDER BY height DESC
+    """
+    rows = await DBManager.execute_query(query, (prefix, height))
+    # 未记录上一个区块（首次运行或刚升级）时无法判断, 视为连续
+    if not rows or rows[0][0] != height - 1 or rows[0][1] == previous_block_hash:
+        return None
+
+    logging.warning("检测到链重组: 区块 %s 的 previousblockhash %s 与已索引的 %s 不一致",
+                    height, previous_block_hash, rows[0][1])
+    for stored_height, stored_hash in rows:
+        node_hash = await syclic_call_rpc(method="getblockhash", params=[stored_height])
+        if node_hash == stored_hash:
+            return stored_height
+    raise RuntimeError(f"重组深度超过保留的 {len(rows)} 个区块哈希, 请使用 --rebuild 重建索引")
@@ -1,14 +1,18 @@
 import logging
 from app.dependencies import DBManager
 from app.utils import convert_str_to_sha256, hex_to_json
-from app.s3 import upload_base64_image_to_s3
+from app.icon_upload import icon_upload_queue
+from app.script_classifier import classify_output
+from app.db.undo_journal import undo_journal
 
-async def process_nft_collections(decode_tx, output_index, timestamp):
+async def process_nft_collections(conn, decode_tx, output_index, timestamp, script_infos=None):
     """处理NFT集合信息并更新nft_collections表"""
     decode_txid = decode_tx["txid"]
+    if script_infos is None:
+        script_infos = [classify_output(output) for output in decode_tx["vout"]]
+    collection_info = script_infos[output_index]
     
-    if not (decode_tx["vout"][output_index]["scriptPubKey"]["asm"].startswith("0 OP_RETURN") or 
-            decode_tx["vout"][output_index]["scriptPubKey"]["asm"].startswith("OP_RETURN")):
+    if collection_info.template != "nulldata":
         return output_index, None, False
         
     logging.info("TBC721 Collection:      %s", decode_txid)
@@ -16,7 +20,7 @@ async def process_nft_collections(decode_tx, output_index, timestamp):
     if len(decode_tx["vout"]) - output_index <= 1:
         logging.error("Error Collection Protocal: %s", decode_txid)
         return output_index, None, True
-    if decode_tx["vout"][output_index + 1]["scriptPubKey"]["type"] != "pubkeyhash":
+    if script_infos[output_index + 1].template != "pubkeyhash":
         logging.error("Error Collection Protocal: %s", decode_txid)
         return output_index, None, True
 
@@ -26,10 +30,7 @@ async def process_nft_collections(decode_tx, output_index, timestamp):
     collection_creator_script_hash = convert_str_to_sha256(decode_tx["vout"][output_index]["scriptPubKey"]["hex"])
     collection_create_timestamp = timestamp
     
-    if decode_tx["vout"][output_index]["scriptPubKey"]["asm"].startswith("0 OP_RETURN"):
-        collection_tape_hex = decode_tx["vout"][output_index]["scriptPubKey"]["asm"][12:-11]
-    else:
-        collection_tape_hex = decode_tx["vout"][output_index]["scriptPubKey"]["asm"][10:-10]
+    collection_tape_hex = collection_info.tape_hex
     
     try:
         collection_tape_json = hex_to_json(collection_tape_hex)
@@ -47,19 +48,10 @@ async def process_nft_collections(decode_tx, output_index, timestamp):
         logging.error("Wrong Collection supply input: %s", decode_txid)
         return output_index, None, True
     
-    # 处理集合图标 - 上传到S3
+    # 处理集合图标 - 在区块提交后异步上传到S3, 先写入占位值
     collection_icon = collection_tape_json.get("file", "")
     if collection_icon and not collection_icon.startswith('http'):
-        try:
-            # 上传到S3
-            object_name = f"collections/{collection_id}.jpg"
-            success, collection_icon = upload_base64_image_to_s3(
-                image_data=collection_icon,
-                object_name=object_name
-            )
-        except Exception as e:
-            logging.error("Error uploading collection icon to S3: %s", str(e))
-            # 如果上传失败，保留原始数据
+        collection_icon = icon_upload_queue.submit(collection_icon, ("nft_collections", "collection_id", collection_id, "collection_icon"))
 
     # 插入记录到 nft_collections 表
     nft_collection_insert_query = """
@@ -77,7 +69,8 @@ async def process_nft_collections(decode_tx, output_index, timestamp):
     """
     
     try:
-        await DBManager.execute_update(nft_collection_insert_query, (collection_id, collection_name, collection_creator_address, collection_creator_script_hash, collection_symbol, collection_attributes, collection_description, collection_supply, collection_create_timestamp, collection_icon))
+        await DBManager.execute_update_nocommit(conn, nft_collection_insert_query, (collection_id, collection_name, collection_creator_address, collection_creator_script_hash, collection_symbol, collection_attributes, collection_description, collection_supply, collection_create_timestamp, collection_icon))
+        undo_journal.record_insert("nft_collections", (collection_id,))
         return output_index + collection_supply, collection_id, False
     except Exception as e:
         logging.error("Error inserting collection %s: %s", decode_txid, e)
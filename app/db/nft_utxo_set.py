@@ -1,21 +1,29 @@
 import logging
 from app.dependencies import DBManager
 from app.utils import convert_str_to_sha256, hex_to_json
-from app.s3 import upload_base64_image_to_s3
+from app.icon_upload import icon_upload_queue
+from app.script_classifier import classify_output
+from app.db.undo_journal import undo_journal
+from app.state import state, NFTOwner
 
+# 转移时被更新的列, 更新前读取旧值写入撤销日志
+NFT_TRANSFER_COLUMNS = NFTOwner.__slots__
 
 
-async def process_nft_utxo_set(decode_tx, output_index, timestamp):
+
+async def process_nft_utxo_set(conn, decode_tx, output_index, timestamp, script_infos=None):
     """处理NFT信息并更新nft_utxo_set表"""
     decode_txid = decode_tx["txid"]
+    if script_infos is None:
+        script_infos = [classify_output(output) for output in decode_tx["vout"]]
+    nft_code_info = script_infos[output_index]
     
-    if not (decode_tx["vout"][output_index]["scriptPubKey"]["asm"].startswith("1 OP_PICK 3 OP_SPLIT") or 
-            decode_tx["vout"][output_index]["scriptPubKey"]["asm"].startswith("4 OP_PICK OP_BIN2NUM OP_TOALTSTACK 1 OP_PICK 3 OP_SPLIT")):
+    if nft_code_info.template != "nft":
         return output_index, None, False
     
     nft_tape_json = {}
     
-    if decode_tx["vout"][output_index]["scriptPubKey"]["asm"].startswith("1 OP_PICK 3 OP_SPLIT 20"):
+    if nft_code_info.nft_kind == "nft":
         logging.info("TBC721 NFT:             %s", decode_txid)
 
         if len(decode_tx["vout"]) - output_index <= 2:
@@ -23,11 +31,8 @@ async def process_nft_utxo_set(decode_tx, output_index, timestamp):
             return output_index, None, True
 
         # 解码 tape json
-        if decode_tx['vout'][output_index + 2]['scriptPubKey']['asm'].startswith("0 OP_RETURN"):
-            nft_tape_hex = decode_tx['vout'][output_index + 2]['scriptPubKey']['asm'][12:-11]
-        elif decode_tx['vout'][output_index + 2]['scriptPubKey']['asm'].startswith("OP_RETURN"):
-            nft_tape_hex = decode_tx['vout'][output_index + 2]['scriptPubKey']['asm'][10:-10]
-        else:
+        nft_tape_hex = script_infos[output_index + 2].tape_hex
+        if nft_tape_hex is None:
             logging.error("Error decoding nft scriptPubKey asm %s", decode_txid)
             return output_index, None, True
         
@@ -39,7 +44,7 @@ async def process_nft_utxo_set(decode_tx, output_index, timestamp):
             
         nft_offset = 3
             
-    elif decode_tx["vout"][output_index]["scriptPubKey"]["asm"].startswith("1 OP_PICK 3 OP_SPLIT OP_NIP") or decode_tx["vout"][output_index]["scriptPubKey"]["asm"].startswith("4 OP_PICK OP_BIN2NUM OP_TOALTSTACK 1 OP_PICK 3 OP_SPLIT"):
+    elif nft_code_info.nft_kind == "pool_nft":
         logging.info("Pool NFT:               %s", decode_txid)
         
         if len(decode_tx["vout"]) - output_index <= 1:
@@ -47,8 +52,7 @@ async def process_nft_utxo_set(decode_tx, output_index, timestamp):
             return output_index, None, True
             
         nft_tape_hex = "POOLNFT"
-        pool_tape_list = decode_tx["vout"][output_index + 1]["scriptPubKey"]["asm"].split(" ")
-        token_pair_a_id = pool_tape_list[4]
+        token_pair_a_id = script_infos[output_index + 1].asm_element(4)
         nft_tape_json = {"file": token_pair_a_id}
         nft_offset = 2
         
@@ -68,15 +72,17 @@ async def process_nft_utxo_set(decode_tx, output_index, timestamp):
 
         if nft_tape_hex == "POOLNFT":
             first_vin_txid = decode_tx["vin"][0]["txid"]
-            nft_contract_id_query = """
-            SELECT nft_contract_id
-            FROM nft_utxo_set
-            WHERE nft_utxo_id = %s
-            """
-            nft_contract_id_res = await DBManager.execute_query(nft_contract_id_query, (first_vin_txid,))
-            if nft_contract_id_res:
-                nft_contract_id = nft_contract_id_res[0][0]
+            if state.loaded:
+                nft_contract_id = state.nft_owners.find_by_utxo(first_vin_txid)
             else:
+                nft_contract_id_query = """
+                SELECT nft_contract_id
+                FROM nft_utxo_set
+                WHERE nft_utxo_id = %s
+                """
+                nft_contract_id_res = await DBManager.execute_query_with_conn(conn, nft_contract_id_query, (first_vin_txid,))
+                nft_contract_id = nft_contract_id_res[0][0] if nft_contract_id_res else None
+            if nft_contract_id is None:
                 logging.error("Can not find which NFT the first input belong %s", decode_txid)
                 return output_index, None, True
         else:
@@ -86,13 +92,32 @@ async def process_nft_utxo_set(decode_tx, output_index, timestamp):
                 return output_index, None, True
             nft_contract_id = nft_file[:64]
 
+        nft_previous_query = f"""
+        SELECT {", ".join(NFT_TRANSFER_COLUMNS)}
+        FROM nft_utxo_set
+        WHERE nft_contract_id = %s
+        """
         nft_update_query = """
         UPDATE nft_utxo_set
         SET nft_utxo_id = %s, nft_code_balance = %s, nft_p2pkh_balance = %s, nft_holder_address = %s, nft_holder_script_hash = %s, nft_last_transfer_timestamp = %s, nft_transfer_time_count = nft_transfer_time_count + 1
         WHERE nft_contract_id = %s
         """
         try:
-            await DBManager.execute_update(nft_update_query, (decode_txid, nft_code_balance, nft_p2pkh_balance, nft_holder_address, nft_holder_script_hash, timestamp, nft_contract_id))
+            # 内存状态可用时从中读取旧值, 不查询 nft_utxo_set
+            if state.loaded:
+                nft_previous = state.nft_owners.get(nft_contract_id)
+            else:
+                nft_previous_res = await DBManager.execute_query_with_conn(conn, nft_previous_query, (nft_contract_id,))
+                nft_previous = dict(zip(NFT_TRANSFER_COLUMNS, nft_previous_res[0])) if nft_previous_res else None
+            await DBManager.execute_update_nocommit(conn, nft_update_query, (decode_txid, nft_code_balance, nft_p2pkh_balance, nft_holder_address, nft_holder_script_hash, timestamp, nft_contract_id))
+            if nft_previous:
+                undo_journal.record_update("nft_utxo_set", (nft_contract_id,), nft_previous)
+                if state.loaded:
+                    state.nft_owners.set(nft_contract_id, {
+                        "nft_utxo_id": decode_txid, "nft_code_balance": nft_code_balance, "nft_p2pkh_balance": nft_p2pkh_balance,
+                        "nft_holder_address": nft_holder_address, "nft_holder_script_hash": nft_holder_script_hash,
+                        "nft_last_transfer_timestamp": timestamp, "nft_transfer_time_count": None if nft_previous["nft_transfer_time_count"] is None else nft_previous["nft_transfer_time_count"] + 1,
+                    }, create=False)
         except Exception as e:
             logging.error("Error updating NFT transfer %s: %s", decode_txid, e)
             return output_index, None, True
@@ -110,7 +135,7 @@ async def process_nft_utxo_set(decode_tx, output_index, timestamp):
             collection_query = """
             SELECT collection_id, collection_supply, collection_name, collection_icon FROM nft_collections WHERE collection_id = %s
             """
-            collection_query_res = await DBManager.execute_query(collection_query, (vin_txid,))
+            collection_query_res = await DBManager.execute_query_with_conn(conn, collection_query, (vin_txid,))
             if collection_query_res:
                 (record_collection_id, record_collection_supply, record_collection_name, record_collection_icon) = collection_query_res[0]
                 if vin_vout <= record_collection_supply:
@@ -134,21 +159,13 @@ async def process_nft_utxo_set(decode_tx, output_index, timestamp):
         # 处理NFT图标 - 上传到S3
         nft_icon = nft_tape_json.get("file", "")
         if nft_icon and not nft_icon.startswith('http'):
-            # 如果file是64+8长度的格式，保留原值
+            icon_target = ("nft_utxo_set", "nft_contract_id", nft_contract_id, "nft_icon")
+            # 如果file是64+8长度的格式，使用集合图标（集合图标仍在上传时, 完成后一并回填）
             if len(nft_icon) == 72:
-                nft_icon = collection_icon
-            # 否则尝试作为图片数据处理并上传到S3
+                nft_icon = icon_upload_queue.attach(collection_icon, icon_target)
+            # 否则作为图片数据在区块提交后异步上传到S3, 先写入占位值
             elif not nft_icon.startswith('http'):
-                try:
-                    # 上传到S3
-                    object_name = f"nfts/{nft_contract_id}.jpg"
-                    success, nft_icon = upload_base64_image_to_s3(
-                        image_data=nft_icon,
-                        object_name=object_name
-                    )
-                except Exception as e:
-                    logging.error("Error uploading NFT icon to S3: %s", str(e))
-                    # 如果上传失败，保留原始数据
+                nft_icon = icon_upload_queue.submit(nft_icon, icon_target)
         
         nft_utxo_set_insert_query = """
         INSERT INTO nft_utxo_set (nft_contract_id, collection_id, collection_index, collection_name, nft_utxo_id, nft_code_balance, nft_p2pkh_balance, nft_name, nft_symbol, nft_attributes, nft_description, nft_transfer_time_count, nft_holder_address, nft_holder_script_hash, nft_create_timestamp, nft_last_transfer_timestamp, nft_icon)
@@ -172,7 +189,12 @@ async def process_nft_utxo_set(decode_tx, output_index, timestamp):
             nft_icon = new.nft_icon
         """
         try:
-            await DBManager.execute_update(nft_utxo_set_insert_query, (nft_contract_id, collection_id, collection_index, collection_name, nft_utxo_id, nft_code_balance, nft_p2pkh_balance, nft_name, nft_symbol, nft_attributes, nft_description, nft_transfer_time_count, nft_holder_address, nft_holder_script_hash, nft_create_timestamp, nft_last_transfer_timestamp, nft_icon))
+            await DBManager.execute_update_nocommit(conn, nft_utxo_set_insert_query, (nft_contract_id, collection_id, collection_index, collection_name, nft_utxo_id, nft_code_balance, nft_p2pkh_balance, nft_name, nft_symbol, nft_attributes, nft_description, nft_transfer_time_count, nft_holder_address, nft_holder_script_hash, nft_create_timestamp, nft_last_transfer_timestamp, nft_icon))
+            undo_journal.record_insert("nft_utxo_set", (nft_contract_id,))
+            if state.loaded:
+                state.nft_owners.set(nft_contract_id, dict(zip(NFT_TRANSFER_COLUMNS, (
+                    nft_utxo_id, nft_code_balance, nft_p2pkh_balance, nft_holder_address, nft_holder_script_hash,
+                    nft_last_transfer_timestamp, nft_transfer_time_count))))
         except Exception as e:
             logging.error("Error inserting NFT %s: %s", decode_txid, e)
             return output_index, None, True
@@ -1,20 +1,41 @@
 import logging
 from datetime import datetime, timezone
-from app.dependencies import DBManager
-from app.utils import convert_p2ms_script_to_ms_address
-from app.dependencies import syclic_call_rpc
+from app.dependencies import DBManager, WriteBuffer, ReplaceWriteBuffer, WriteBufferGroup
+from app.prevout_cache import prevout_cache
 
-async def process_transaction_record(decode_tx, block_height, timestamp, tx_type=None):
+# 交易历史写缓存, 按外键依赖顺序刷新
+transactions_buffer = WriteBuffer(
+    "transactions",
+    ("tx_hash", "fee", "time_stamp", "transaction_utc_time", "tx_type", "block_height"),
+    key_columns=("tx_hash",),
+    update_columns=("fee", "time_stamp", "transaction_utc_time", "tx_type", "block_height"),
+    update_extra="updated_at = CURRENT_TIMESTAMP"
+)
+address_transactions_buffer = WriteBuffer(
+    "address_transactions",
+    ("address", "tx_hash", "is_sender", "is_recipient", "balance_change"),
+    key_columns=("address", "tx_hash"),
+    update_columns=("is_sender", "is_recipient", "balance_change"),
+    update_extra="updated_at = CURRENT_TIMESTAMP"
+)
+transaction_participants_buffer = ReplaceWriteBuffer(
+    "transaction_participants",
+    ("tx_hash", "address", "role"),
+    replace_column="tx_hash"
+)
+history_writer = WriteBufferGroup(transactions_buffer, address_transactions_buffer, transaction_participants_buffer)
+
+async def process_transaction_record(tx, block_height, timestamp, tx_type=None):
     """
     处理交易历史记录并更新相关表
     
     Args:
-        decode_tx: 解码后的交易数据
+        tx: 解析后的交易 (app.tx_parser.Transaction)
         block_height: 区块高度
         timestamp: 时间戳
         tx_type: 交易类型，如果为None则自动确定
     """
-    decode_txid = decode_tx["txid"]
+    decode_txid = tx.txid
     logging.info("处理交易历史: %s, 区块高度: %s, 时间戳: %s", decode_txid, block_height, timestamp)
     
     # 分析交易并提取数据
@@ -32,86 +53,62 @@ async def process_transaction_record(decode_tx, block_height, timestamp, tx_type
         if_type_detected = True
     
     # 处理输出，获取接收方和总接收金额
-    for output in decode_tx['vout']:
-        value_get = round(float(output.get('value', 0)) * 1_000_000)
+    for output in tx.outputs:
+        value_get = output.value
         total_receive += value_get
+        template = output.template
         
-        if "scriptPubKey" in output and "asm" in output["scriptPubKey"]:
-            script_asm = output["scriptPubKey"]["asm"]
-            
-            # 普通地址处理
-            if output["scriptPubKey"].get("type") == "pubkeyhash" and "addresses" in output["scriptPubKey"]:
-                for addr in output['scriptPubKey']['addresses']:
-                    receivers.add(addr)
-                    balance_changes[addr] = balance_changes.get(addr, 0) + value_get
-            
-            # TBC20 FT 处理（与 get_history 保持一致）
-            elif script_asm.startswith("9 OP_PICK OP_TOALTSTACK"):
-                if not if_type_detected:
-                    if_type_detected = True
-                    tx_type = "TBC20"
-                # 处理 Pool 合约（与 get_history 保持一致）
-                if script_asm.endswith("01 32436f6465"):
-                    pool_contract_id = "Pool_" + script_asm[-53:-11]
-                    receivers.add(pool_contract_id)
-                    # Pool 合约不参与余额变化计算
-            
-            # TBC721 NFT 处理（与 get_history 保持一致）
-            elif (script_asm.startswith("OP_RETURN") or 
-                  script_asm.startswith("0 OP_RETURN") or 
-                  script_asm.startswith("1 OP_PICK")) and not if_type_detected:
+        # 普通地址处理
+        if template == "pubkeyhash":
+            addr = output.address
+            receivers.add(addr)
+            balance_changes[addr] = balance_changes.get(addr, 0) + value_get
+        
+        # TBC20 FT 处理（与 get_history 保持一致）
+        elif template in ("ft", "pool"):
+            if not if_type_detected:
                 if_type_detected = True
-                tx_type = "TBC721"
-            
-            # P2MS 多重签名处理
-            elif script_asm.endswith("OP_CHECKMULTISIG"):
-                if not if_type_detected:
-                    if_type_detected = True
-                    tx_type = "P2MS"
-                try:
-                    ms_address = convert_p2ms_script_to_ms_address(script_asm)
-                    receivers.add(ms_address)
-                    balance_changes[ms_address] = balance_changes.get(ms_address, 0) + value_get
-                except (ValueError, ImportError):
-                    pass
+                tx_type = "TBC20"
+            # 处理 Pool 合约（与 get_history 保持一致）
+            if template == "pool" and output.address is not None:
+                receivers.add(output.address)
+                # Pool 合约不参与余额变化计算
+        
+        # TBC721 NFT 处理（与 get_history 保持一致, 含所有 "1 OP_PICK" 开头的脚本）
+        elif (template in ("nulldata", "nft") or output.script[:2] == b"\x51\x79") and not if_type_detected:
+            if_type_detected = True
+            tx_type = "TBC721"
+        
+        # P2MS 多重签名处理
+        elif template == "multisig":
+            if not if_type_detected:
+                if_type_detected = True
+                tx_type = "P2MS"
+            ms_address = output.address
+            if ms_address is not None:
+                receivers.add(ms_address)
+                balance_changes[ms_address] = balance_changes.get(ms_address, 0) + value_get
     
     # 处理输入，获取发送方和总支出金额
-    for vin in decode_tx['vin']:
-        if "txid" not in vin:
+    for vin in tx.inputs:
+        if vin.is_coinbase:
             senders.add("coinbase")
             total_spend += 325  # coinbase 固定费用
         else:
-            vin_txid = vin['txid']
-            vin_vout = vin['vout']
             try:
-                vin_decode = await syclic_call_rpc(method="getrawtransaction", params=[vin_txid, 1])
-                value_spend = round(float(vin_decode['vout'][vin_vout].get('value', 0)) * 1_000_000)
+                prevout = await prevout_cache.get(vin.txid, vin.vout)
+                value_spend = prevout.value
                 total_spend += value_spend
                 
-                if "scriptPubKey" in vin_decode['vout'][vin_vout] and "asm" in vin_decode['vout'][vin_vout]['scriptPubKey']:
-                    vin_script_asm = vin_decode['vout'][vin_vout]['scriptPubKey']['asm']
-                    
-                    # 普通地址处理
-                    if vin_decode['vout'][vin_vout]['scriptPubKey'].get("type") == "pubkeyhash" and "addresses" in vin_decode['vout'][vin_vout]['scriptPubKey']:
-                        for addr in vin_decode['vout'][vin_vout]['scriptPubKey']['addresses']:
-                            senders.add(addr)
-                            balance_changes[addr] = balance_changes.get(addr, 0) - value_spend
-                    
-                    # P2MS 多重签名处理
-                    elif vin_script_asm.endswith("OP_CHECKMULTISIG"):
-                        try:
-                            ms_address = convert_p2ms_script_to_ms_address(vin_script_asm)
-                            senders.add(ms_address)
-                            balance_changes[ms_address] = balance_changes.get(ms_address, 0) - value_spend
-                        except (ValueError, ImportError):
-                            pass
-                    
-                    # TBC20 Pool 合约处理（与 get_history 保持一致）
-                    elif vin_script_asm.startswith("9 OP_PICK OP_TOALTSTACK"):
-                        if vin_script_asm.endswith("01 32436f6465"):
-                            pool_contract_id = "Pool_" + vin_script_asm[-53:-11]
-                            senders.add(pool_contract_id)
-                            # Pool 合约不参与余额变化计算
+                # 普通地址处理 / P2MS 多重签名处理
+                if prevout.script_type in ("pubkeyhash", "multisig"):
+                    senders.add(prevout.address)
+                    balance_changes[prevout.address] = balance_changes.get(prevout.address, 0) - value_spend
+                
+                # TBC20 Pool 合约处理（与 get_history 保持一致）
+                elif prevout.script_type == "pool":
+                    senders.add(prevout.address)
+                    # Pool 合约不参与余额变化计算
             except Exception as e:
                 logging.error("处理交易输入 %s 时出错: %s", decode_txid, str(e))
     
@@ -129,7 +126,7 @@ async def process_transaction_record(decode_tx, block_height, timestamp, tx_type
 
 async def update_transaction_tables(tx_hash, fee, timestamp, utc_time, tx_type, block_height, balance_changes, senders, receivers):
     """
-    更新交易相关数据表
+    更新交易相关数据表（写入写缓存, 区块结束时由 history_writer 在检查点事务中批量写入）
     
     Args:
         tx_hash: 交易哈希
@@ -143,20 +140,7 @@ async def update_transaction_tables(tx_hash, fee, timestamp, utc_time, tx_type,
         receivers: 接收方集合
     """
     # 1. 存储交易基本信息
-    transactions_insert_query = """
-    INSERT INTO transactions (tx_hash, fee, time_stamp, transaction_utc_time, tx_type, block_height)
-    VALUES (%s, %s, %s, %s, %s, %s) AS new
-    ON DUPLICATE KEY UPDATE
-        fee = new.fee,
-        time_stamp = new.time_stamp,
-        transaction_utc_time = new.transaction_utc_time,
-        tx_type = new.tx_type,
-        block_height = new.block_height,
-        updated_at = CURRENT_TIMESTAMP
-    """
-    await DBManager.execute_update(transactions_insert_query, (
-        tx_hash, fee, timestamp, utc_time, tx_type, block_height
-    ))
+    transactions_buffer.add((tx_hash, fee, timestamp, utc_time, tx_type, block_height))
     
     # 2. 处理地址交易关系 - 为每个地址分别计算发送方/接收方逻辑（与 get_history 保持一致）
     final_senders = set()
@@ -190,53 +174,20 @@ async def update_transaction_tables(tx_hash, fee, timestamp, utc_time, tx_type,
         if formatted_balance in ('', '+'):
             formatted_balance = "0"
         
-        address_tx_insert_query = """
-        INSERT INTO address_transactions (address, tx_hash, is_sender, is_recipient, balance_change)
-        VALUES (%s, %s, %s, %s, %s) AS new
-        ON DUPLICATE KEY UPDATE
-            is_sender = new.is_sender,
-            is_recipient = new.is_recipient,
-            balance_change = new.balance_change,
-            updated_at = CURRENT_TIMESTAMP
-        """
-        await DBManager.execute_update(address_tx_insert_query, (
-            address, tx_hash, is_sender, is_recipient, formatted_balance
-        ))
+        address_transactions_buffer.add((address, tx_hash, is_sender, is_recipient, formatted_balance))
     
     # 处理没有余额变化但参与交易的地址（如 Pool 合约等）
     for sender in senders:
         if sender not in balance_changes:
             final_senders.add(sender)
             
-            address_tx_insert_query = """
-            INSERT INTO address_transactions (address, tx_hash, is_sender, is_recipient, balance_change)
-            VALUES (%s, %s, %s, %s, %s) AS new
-            ON DUPLICATE KEY UPDATE
-                is_sender = new.is_sender,
-                is_recipient = new.is_recipient,
-                balance_change = new.balance_change,
-                updated_at = CURRENT_TIMESTAMP
-            """
-            await DBManager.execute_update(address_tx_insert_query, (
-                sender, tx_hash, True, False, "0"
-            ))
+            address_transactions_buffer.add((sender, tx_hash, True, False, "0"))
     
     for receiver in receivers:
         if receiver not in balance_changes:
             final_receivers.add(receiver)
             
-            address_tx_insert_query = """
-            INSERT INTO address_transactions (address, tx_hash, is_sender, is_recipient, balance_change)
-            VALUES (%s, %s, %s, %s, %s) AS new
-            ON DUPLICATE KEY UPDATE
-                is_sender = new.is_sender,
-                is_recipient = new.is_recipient,
-                balance_change = new.balance_change,
-                updated_at = CURRENT_TIMESTAMP
-            """
-            await DBManager.execute_update(address_tx_insert_query, (
-                receiver, tx_hash, False, True, "0"
-            ))
+            address_transactions_buffer.add((receiver, tx_hash, False, True, "0"))
     
     # 确保至少有一个发送方和接收方（与 get_history 逻辑保持一致）
     if len(final_senders) == 0 and len(balance_changes) > 0:
@@ -249,23 +200,13 @@ async def update_transaction_tables(tx_hash, fee, timestamp, utc_time, tx_type,
         first_address = next(iter(balance_changes.keys()))
         final_receivers.add(first_address)
     
-    # 3. 处理交易参与方
-    # 清除旧记录
-    await DBManager.execute_update("DELETE FROM transaction_participants WHERE tx_hash = %s", (tx_hash,))
-    
-    # 插入发送方
-    for sender in final_senders:
-        await DBManager.execute_update(
-            "INSERT INTO transaction_participants (tx_hash, address, role) VALUES (%s, %s, %s)",
-            (tx_hash, sender, "sender")
-        )
-    
-    # 插入接收方
-    for receiver in final_receivers:
-        await DBManager.execute_update(
-            "INSERT INTO transaction_participants (tx_hash, address, role) VALUES (%s, %s, %s)",
-            (tx_hash, receiver, "recipient")
-        )
+    # 3. 处理交易参与方（替换旧记录）
+    transaction_participants_buffer.replace(
+        tx_hash,
+        [(tx_hash, sender, "sender") for sender in final_senders] +
+        [(tx_hash, receiver, "recipient") for receiver in final_receivers]
+    )
+
 
 # 获取未确认的交易
 async def get_unconfirmed_transactions():
@@ -330,4 +271,31 @@ async def delete_transactions_below_height(current_height):
         
     except Exception as e:
         logging.error("删除旧交易数据时出错: %s", str(e))
-        raise
\ No newline at end of file
+        raise
+
+async def delete_transactions_above_height_nocommit(conn, fork_height):
+    """
+    在当前事务中删除分叉点之后区块中的交易数据（不提交）, 链重组回滚时使用
+
+    Args:
+        conn: 数据库连接
+        fork_height (int): 分叉点高度, 该高度及以下的交易保留
+    """
+    # 与 delete_transactions_below_height 一致, 依次删除三张相关表的数据
+    participant_delete = """
+    DELETE p FROM transaction_participants p
+    JOIN transactions t ON p.tx_hash = t.tx_hash
+    WHERE t.block_height > %s
+    """
+    await DBManager.execute_update_nocommit(conn, participant_delete, (fork_height,))
+
+    addr_tx_delete = """
+    DELETE a FROM address_transactions a
+    JOIN transactions t ON a.tx_hash = t.tx_hash
+    WHERE t.block_height > %s
+    """
+    await DBManager.execute_update_nocommit(conn, addr_tx_delete, (fork_height,))
+
+    tx_delete = "DELETE FROM transactions WHERE block_height > %s"
+    await DBManager.execute_update_nocommit(conn, tx_delete, (fork_height,))
+    logging.info("已删除区块高度 %d 之后的交易数据", fork_height)
@@ -0,0 +1,136 @@
+import json
+import logging
+from app.dependencies import DBManager
+
+# 可回滚的表及其主键列
+UNDO_TABLE_KEYS = {
+    "ft_tokens": ("ft_contract_id",),
+    "ft_txo_set": ("utxo_txid", "utxo_vout"),
+    "ft_balance": ("ft_holder_combine_script", "ft_contract_id"),
+    "nft_collections": ("collection_id",),
+    "nft_utxo_set": ("nft_contract_id",),
+}
+
+
+class UndoJournal:
+    """
+    记录当前区块对数据表的行级修改的逆操作, 与区块数据在同一事务中写入 t_index_undo_journal
+
+    每条记录为紧凑的列表:
+        ["d", 表, 主键值]              删除新插入的行
+        ["u", 表, 主键值, {列: 旧值}]   恢复被更新的列
+        ["i", 表, {列: 旧值}]          重新插入被删除的行
+        ["a", 表, 主键值, 列, 增量]     对计数列加上增量
+    """
+    def __init__(self):
+        self._entries = []
+
+    def __len__(self):
+        return len(self._entries)
+
+    def record_insert(self, table, key):
+        """
+        记录新插入的行, 回滚时删除
+        """
+        self._entries.append(["d", table, list(key)])
+
+    def record_update(self, table, key, old_values):
+        """
+        记录被更新行的旧值, 回滚时恢复
+        """
+        self._entries.append(["u", table, list(key), dict(old_values)])
+
+    def record_delete(self, table, old_row):
+        """
+        记录被删除的整行, 回滚时重新插入
+        """
+        self._entries.append(["i", table, dict(old_row)])
+
+    def record_increment(self, table, key, column, amount):
+        """
+        记录计数列的增量, 回滚时减去
+        """
+        if amount:
+            self._entries.append(["a", table, list(key), column, -amount])
+
+    def discard(self):
+        """
+        丢弃尚未写入的记录（区块事务回滚时使用）
+        """
+        self._entries = []
+
+    async def save_nocommit(self, conn, height):
+        """
+        在当前事务中写入累积的记录（不提交）, 同一高度可写入多次（内存池模式）
+        """
+        entries, self._entries = self._entries, []
+        if not entries:
+            return
+        query = "INSERT INTO t_index_undo_journal (height, journal) VALUES (%s, %s)"
+        await DBManager.execute_update_nocommit(conn, query, (height, json.dumps(entries, separators=(",", ":"))))
+
+
+def _where(table, key):
+    key_columns = UNDO_TABLE_KEYS[table]
+    return " AND ".join(f"{column} = %s" for column in key_columns), list(key)
+
+
+async def _apply_entry_nocommit(conn, entry):
+    op, table = entry[0], entry[1]
+    if table not in UNDO_TABLE_KEYS:
+        raise ValueError(f"Unknown table in undo journal: {table}")
+
+    if op == "d":
+        where, params = _where(table, entry[2])
+        await DBManager.execute_update_nocommit(conn, f"DELETE FROM {table} WHERE {where}", params)
+    elif op == "u":
+        where, params = _where(table, entry[2])
+        columns = list(entry[3])
+        assignments = ", ".join(f"{column} = %s" for column in columns)
+        await DBManager.execute_update_nocommit(conn, f"UPDATE {table} SET {assignments} WHERE {where}",
+                                                [entry[3][column] for column in columns] + params)
+    elif op == "i":
+        columns = list(entry[2])
+        query = f"INSERT IGNORE INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})"
+        await DBManager.execute_update_nocommit(conn, query, [entry[2][column] for column in columns])
+    elif op == "a":
+        where, params = _where(table, entry[2])
+        column = entry[3]
+        await DBManager.execute_update_nocommit(conn, f"UPDATE {table} SET {column} = {column} + %s WHERE {where}",
+                                                [entry[4]] + params)
+    else:
+        raise ValueError(f"Unknown undo journal operation: {op}")
+
+
+async def rollback_undo_journal_nocommit(conn, fork_height):
+    """
+    在当前事务中撤销高度大于 fork_height 的全部修改（不提交）, 按写入顺序逆序执行
+
+    Args:
+        conn: 数据库连接
+        fork_height: 分叉点高度, 该高度及以下的修改保留
+
+    Returns:
+        int: 撤销的记录数
+    """
+    query = "SELECT journal FROM t_index_undo_journal WHERE height > %s ORDER BY Fid DESC"
+    rows = await DBManager.execute_query_with_conn(conn, query, (fork_height,))
+    count = 0
+    for (journal,) in rows:
+        for entry in reversed(json.loads(journal)):
+            await _apply_entry_nocommit(conn, entry)
+            count += 1
+
+    await DBManager.execute_update_nocommit(conn, "DELETE FROM t_index_undo_journal WHERE height > %s", (fork_height,))
+    logging.info("撤销区块高度 %s 之后的 %s 条修改", fork_height, count)
+    return count
+
+
+async def prune_undo_journal_nocommit(conn, min_height):
+    """
+    删除高度低于 min_height 的记录（不提交）, 超出保留深度的区块不再回滚
+    """
+    await DBManager.execute_update_nocommit(conn, "DELETE FROM t_index_undo_journal WHERE height < %s", (min_height,))
+
+
+undo_journal = UndoJournal()
@@ -6,8 +6,71 @@ from app.config import config
 import aiomysql
 import logging
 import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
 
-async def call_node_rpc(method: str, params: list, if_full_response=False):
+# 连接池与超时默认值, 可在 app.config 中覆盖
+RPC_MAX_CONNECTIONS = getattr(config, "TBC_RPC_MAX_CONNECTIONS", 16)
+RPC_TIMEOUT = getattr(config, "TBC_RPC_TIMEOUT", 30)
+RPC_KEEPALIVE_TIMEOUT = getattr(config, "TBC_RPC_KEEPALIVE_TIMEOUT", 60)
+RPC_BATCH_SIZE = getattr(config, "TBC_RPC_BATCH_SIZE", 100)
+RPC_BATCH_RETRIES = getattr(config, "TBC_RPC_BATCH_RETRIES", 3)
+RPC_PREFETCH_BATCH_SIZE = getattr(config, "TBC_RPC_PREFETCH_BATCH_SIZE", 50)
+RPC_PREFETCH_CONCURRENCY = getattr(config, "TBC_RPC_PREFETCH_CONCURRENCY", 4)
+DB_WRITE_BUFFER_SIZE = getattr(config, "DB_WRITE_BUFFER_SIZE", 500)
+
+
+class RPCManager:
+    """
+    Node RPC client manager
+    """
+    _session = None
+    _semaphore = None
+    _timeout = RPC_TIMEOUT
+
+    @classmethod
+    async def init_session(cls, max_connections=RPC_MAX_CONNECTIONS, timeout=RPC_TIMEOUT, keepalive_timeout=RPC_KEEPALIVE_TIMEOUT):
+        """
+        初始化长连接 RPC 会话, 连接池大小即最大并发请求数
+        """
+        await cls.close_session()
+        connector = aiohttp.TCPConnector(
+            limit=max_connections,
+            limit_per_host=max_connections,
+            keepalive_timeout=keepalive_timeout
+        )
+        cls._session = aiohttp.ClientSession(
+            connector=connector,
+            auth=aiohttp.BasicAuth(*config.TBC_RPC_AUTH)
+        )
+        # 等待连接池空位的时间不计入单次请求超时
+        cls._semaphore = asyncio.Semaphore(max_connections)
+        cls._timeout = timeout
+
+    @classmethod
+    async def close_session(cls):
+        """
+        关闭 RPC 会话
+        """
+        if cls._session and not cls._session.closed:
+            await cls._session.close()
+        cls._session = None
+        cls._semaphore = None
+
+    @classmethod
+    async def post(cls, payload, timeout=None):
+        """
+        通过连接池发送 JSON-RPC 请求并返回解析后的响应
+        """
+        if cls._session is None or cls._session.closed:
+            await cls.init_session()
+        request_timeout = aiohttp.ClientTimeout(total=timeout or cls._timeout)
+        async with cls._semaphore:
+            async with cls._session.post(config.TBC_RPC_URL, json=payload, timeout=request_timeout) as response:
+                return await response.json()
+
+
+async def call_node_rpc(method: str, params: list, if_full_response=False, timeout=None):
     """
     Call node RPC
     """
@@ -18,37 +81,126 @@ async def call_node_rpc(method: str, params: list, if_full_response=False):
         "params": params
     }
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                config.TBC_RPC_URL,
-                json=data, auth=aiohttp.BasicAuth(*config.TBC_RPC_AUTH)
-            ) as response:
-
-                result = await response.json()
+        result = await RPCManager.post(data, timeout=timeout)
 
-                # if full txt response is needed
-                if not if_full_response:
-                    result = result["result"]
+        # if full txt response is needed
+        if not if_full_response:
+            result = result["result"]
 
-                return result
+        return result
     except Exception as e:
         raise ConnectionError(f"Failed to call node RPC {method}: {str(e)}") from e
 
 
-async def syclic_call_rpc(method, params):
+async def syclic_call_rpc(method, params, timeout=None):
     """
     Syclic call RPC.
     """
     retry_interval = 5
     while True:
         try:
-            res = await call_node_rpc(method=method, params=params)
+            res = await call_node_rpc(method=method, params=params, timeout=timeout)
             return res
         except (ConnectionError, TimeoutError, ValueError) as e:
             logging.error("Error calling node RPC %s: %s. Retrying in %s seconds...", method, e, retry_interval)
             await asyncio.sleep(retry_interval)
 
 
+async def call_node_rpc_batch(calls, batch_size=RPC_BATCH_SIZE, max_retries=RPC_BATCH_RETRIES, timeout=None):
+    """
+    Call node RPC in JSON-RPC batch mode.
+
+    Args:
+        calls: [(method, params), ...]
+        batch_size: 每个批量请求包含的调用数
+        max_retries: 失败调用的最大重试次数（只重试未收到响应的条目, 节点返回错误的条目不重试）
+        timeout: 单个批量请求的超时时间
+
+    Returns:
+        list: 与 calls 顺序一致的结果列表, 节点返回错误的条目为 None
+    """
+    results = [None] * len(calls)
+    pending = list(range(len(calls)))
+
+    async def post_chunk(chunk):
+        payload = [
+            {"jsonrpc": "1.0", "id": i, "method": calls[i][0], "params": calls[i][1]}
+            for i in chunk
+        ]
+        try:
+            responses = await RPCManager.post(payload, timeout=timeout)
+        except Exception as e:
+            logging.error("Error calling node RPC batch of %s requests: %s", len(chunk), e)
+            return chunk
+        if not isinstance(responses, list):
+            logging.error("Unexpected node RPC batch response: %s", responses)
+            return chunk
+
+        # 按 id 将响应映射回原始调用
+        responses_by_id = {response.get("id"): response for response in responses if isinstance(response, dict)}
+        failed = []
+        for i in chunk:
+            response = responses_by_id.get(i)
+            if response is None:
+                failed.append(i)
+            elif response.get("error") is not None:
+                # 节点明确返回错误（如交易不存在）, 重试结果相同, 保持为 None
+                logging.error("Node RPC %s %s returned error: %s", calls[i][0], calls[i][1], response["error"])
+            else:
+                results[i] = response.get("result")
+        return failed
+
+    for attempt in range(max_retries + 1):
+        chunks = [pending[start:start + batch_size] for start in range(0, len(pending), batch_size)]
+        failed_chunks = await asyncio.gather(*(post_chunk(chunk) for chunk in chunks))
+        pending = [i for failed in failed_chunks for i in failed]
+        if not pending:
+            break
+        if attempt < max_retries:
+            logging.warning("Retrying %s of %s node RPC batch requests", len(pending), len(calls))
+            await asyncio.sleep(1)
+
+    # 重试后仍未收到响应视为连接问题
+    if pending:
+        raise ConnectionError(f"Failed to call node RPC batch: {len(pending)} of {len(calls)} requests unanswered")
+
+    return results
+
+
+async def syclic_call_rpc_batch(calls, batch_size=RPC_BATCH_SIZE, timeout=None):
+    """
+    Syclic call RPC in batch mode.
+    """
+    retry_interval = 5
+    while True:
+        try:
+            return await call_node_rpc_batch(calls, batch_size=batch_size, timeout=timeout)
+        except (ConnectionError, TimeoutError, ValueError) as e:
+            logging.error("Error calling node RPC batch: %s. Retrying in %s seconds...", e, retry_interval)
+            await asyncio.sleep(retry_interval)
+
+
+async def iter_rpc_batch(calls, batch_size=RPC_PREFETCH_BATCH_SIZE, concurrency=RPC_PREFETCH_CONCURRENCY):
+    """
+    以有界并发预取批量 RPC 结果, 并按 calls 的原始顺序逐个产出
+
+    最多同时有 concurrency 个批次在请求或等待消费, 后续批次的请求与当前结果的处理相互重叠
+    """
+    chunks = [calls[start:start + batch_size] for start in range(0, len(calls), batch_size)]
+    pending = deque()
+    next_chunk = 0
+    try:
+        while pending or next_chunk < len(chunks):
+            while next_chunk < len(chunks) and len(pending) < concurrency:
+                pending.append(asyncio.ensure_future(syclic_call_rpc_batch(chunks[next_chunk], batch_size=batch_size)))
+                next_chunk += 1
+            for result in await pending.popleft():
+                yield result
+    finally:
+        for task in pending:
+            task.cancel()
+
+
 class DBManager:
     """
     Database manager
@@ -91,6 +243,21 @@ class DBManager:
                 result = await cur.fetchall()
                 return result
 
+    @classmethod
+    @asynccontextmanager
+    async def transaction(cls):
+        """
+        获取一个连接并开启事务, 正常退出时提交, 出现异常时回滚
+        """
+        async with cls._pool.acquire() as conn:
+            await conn.begin()
+            try:
+                yield conn
+            except BaseException:
+                await conn.rollback()
+                raise
+            await conn.commit()
+
     @classmethod
     async def execute_update(cls, query, params=None):
         """
@@ -101,11 +268,227 @@ class DBManager:
                 await cur.execute(query, params or ())
                 await conn.commit()
 
-                
+
+    @staticmethod
+    async def execute_query_with_conn(conn, query, params=None):
+        """
+        在指定连接（事务）上执行 SQL 查询
+        """
+        async with conn.cursor() as cur:
+            await cur.execute(query, params or ())
+            return await cur.fetchall()
+
     @staticmethod
     async def execute_update_nocommit(conn, query, params=None):
         """
         执行 SQL 更新语句但不提交 (INSERT, UPDATE, DELETE)
         """
         async with conn.cursor() as cur:
-            await cur.execute(query, params or ())
\ No newline at end of file
+            await cur.execute(query, params or ())
+
+    @staticmethod
+    async def execute_many_nocommit(conn, query, params_list):
+        """
+        使用同一语句批量执行多组参数但不提交
+        """
+        async with conn.cursor() as cur:
+            await cur.executemany(query, params_list)
+
+
+class BaseWriteBuffer:
+    """
+    写缓存基类: 缓存待写入的行, 以多行 INSERT ... AS new ON DUPLICATE KEY UPDATE 批量写入
+    """
+    def __init__(self, table, columns, update_columns=None, update_extra=None, flush_size=DB_WRITE_BUFFER_SIZE):
+        self.table = table
+        self.columns = tuple(columns)
+        self.update_columns = tuple(update_columns or ())
+        self.update_extra = update_extra
+        self.flush_size = flush_size
+        self._rows = self._new_rows()
+
+    def _new_rows(self):
+        return []
+
+    def __len__(self):
+        return len(self._rows)
+
+    def is_full(self):
+        """
+        缓存行数是否达到刷新阈值
+        """
+        return len(self) >= self.flush_size
+
+    def rows(self):
+        """
+        返回缓存中的所有行（不清空）, 格式与 write 的 rows 参数一致
+        """
+        return list(self._rows)
+
+    def take(self):
+        """
+        取出并清空缓存中的所有行
+        """
+        rows = self.rows()
+        self._rows = self._new_rows()
+        return rows
+
+    def build_insert_query(self, row_count):
+        """
+        构建 row_count 行的多行插入语句
+        """
+        placeholders = "(" + ", ".join(["%s"] * len(self.columns)) + ")"
+        query = f"INSERT INTO {self.table} ({', '.join(self.columns)}) VALUES " + ", ".join([placeholders] * row_count)
+        updates = [f"{column} = new.{column}" for column in self.update_columns]
+        if self.update_extra:
+            updates.append(self.update_extra)
+        if updates:
+            query += " AS new ON DUPLICATE KEY UPDATE " + ", ".join(updates)
+        return query
+
+    async def insert(self, conn, rows):
+        """
+        在指定连接上分批插入行
+        """
+        for start in range(0, len(rows), self.flush_size):
+            chunk = rows[start:start + self.flush_size]
+            params = [value for row in chunk for value in row]
+            await DBManager.execute_update_nocommit(conn, self.build_insert_query(len(chunk)), params)
+
+    async def write(self, conn, rows):
+        """
+        在指定连接上写入已取出的行
+        """
+        await self.insert(conn, rows)
+
+    async def flush(self, conn):
+        """
+        将缓存中的所有行写入指定连接（不提交）
+
+        写入成功后才清空缓存, 失败时行保留在缓存中, 下次刷新时重新写入（插入语句可重复执行）
+        """
+        await self.write(conn, self.rows())
+        self._rows = self._new_rows()
+
+
+class WriteBuffer(BaseWriteBuffer):
+    """
+    按表缓存待写入的行
+
+    key_columns 指定时, 同一主键的后写入行覆盖先写入的行, 并可通过 get/update 读写缓存中的行
+    """
+    def __init__(self, table, columns, key_columns=None, update_columns=None, update_extra=None, flush_size=DB_WRITE_BUFFER_SIZE):
+        columns = tuple(columns)
+        self.key_indexes = tuple(columns.index(column) for column in key_columns) if key_columns else None
+        super().__init__(table, columns, update_columns, update_extra, flush_size)
+
+    def _new_rows(self):
+        return {} if self.key_indexes else []
+
+    def rows(self):
+        return list(self._rows.values()) if self.key_indexes else list(self._rows)
+
+    def add(self, row):
+        """
+        添加一行, 列顺序与 columns 一致
+        """
+        row = tuple(row)
+        if self.key_indexes:
+            self._rows[tuple(row[i] for i in self.key_indexes)] = row
+        else:
+            self._rows.append(row)
+
+    def get(self, key):
+        """
+        按主键读取缓存中尚未写入的行
+        """
+        return self._rows.get(tuple(key))
+
+    def update(self, key, **values):
+        """
+        修改缓存中尚未写入的行, 行不存在时返回 False
+        """
+        key = tuple(key)
+        row = self._rows.get(key)
+        if row is None:
+            return False
+        row = list(row)
+        for column, value in values.items():
+            row[self.columns.index(column)] = value
+        self._rows[key] = tuple(row)
+        return True
+
+
+class ReplaceWriteBuffer(BaseWriteBuffer):
+    """
+    先按 replace_column 删除旧行再批量插入新行的写缓存, 用于没有唯一键的明细表
+    """
+    def __init__(self, table, columns, replace_column, flush_size=DB_WRITE_BUFFER_SIZE):
+        super().__init__(table, columns, flush_size=flush_size)
+        self.replace_column = replace_column
+        self._replace_index = self.columns.index(replace_column)
+
+    def _new_rows(self):
+        # replace_column 的值 -> 行列表
+        return {}
+
+    def __len__(self):
+        return sum(len(rows) for rows in self._rows.values())
+
+    def rows(self):
+        return dict(self._rows)
+
+    def replace(self, value, rows):
+        """
+        用 rows 替换 replace_column 等于 value 的全部行
+        """
+        self._rows[value] = [tuple(row) for row in rows]
+
+    def add(self, row):
+        row = tuple(row)
+        self._rows.setdefault(row[self._replace_index], []).append(row)
+
+    async def write(self, conn, rows):
+        if not rows:
+            return
+        replace_values = tuple(rows.keys())
+        for start in range(0, len(replace_values), self.flush_size):
+            chunk = replace_values[start:start + self.flush_size]
+            await DBManager.execute_update_nocommit(conn, f"DELETE FROM {self.table} WHERE {self.replace_column} IN %s", (chunk,))
+        await self.insert(conn, [row for value_rows in rows.values() for row in value_rows])
+
+
+class WriteBufferGroup:
+    """
+    按顺序刷新的一组写缓存（外键依赖的表需排在后面）
+    """
+    def __init__(self, *buffers):
+        self.buffers = buffers
+        self._lock = asyncio.Lock()
+
+    def is_full(self):
+        """
+        任一缓存达到刷新阈值
+        """
+        return any(buffer.is_full() for buffer in self.buffers)
+
+    async def flush(self, conn=None):
+        """
+        刷新所有缓存; 未指定连接时在独立事务中写入并提交
+
+        全部写入成功后才清空缓存, 失败时行保留在缓存中（写入期间不应再向缓存添加行）
+        """
+        async with self._lock:
+            # 同步读取所有缓存, 保证同一笔交易的各表数据在同一次刷新中写入
+            pending = [(buffer, buffer.rows()) for buffer in self.buffers]
+            if not any(rows for _, rows in pending):
+                return
+            if conn is not None:
+                for buffer, rows in pending:
+                    await buffer.write(conn, rows)
+            else:
+                async with DBManager.transaction() as transaction_conn:
+                    for buffer, rows in pending:
+                        await buffer.write(transaction_conn, rows)
+            for buffer in self.buffers:
+                buffer.take()
@@ -0,0 +1,67 @@
+"""
+Local index of icons already uploaded to S3, keyed by content-addressed object key.
+"""
+import logging
+import sqlite3
+
+from app.config import config
+
+ICON_INDEX_PATH = getattr(config, "ICON_INDEX_PATH", "icon_index.sqlite")
+
+
+class IconIndex:
+    """
+    基于 SQLite 的已上传图标索引: 对象键 (icons/<sha256>.<ext>) -> 公共 URL
+
+    只在事件循环线程中访问, 相同图片再次出现时无需任何 S3 请求
+    """
+    def __init__(self, path=ICON_INDEX_PATH):
+        self.path = path
+        self._conn = None
+
+    def open(self):
+        """
+        打开索引文件, 不存在时创建
+        """
+        if self._conn is not None:
+            return
+        self._conn = sqlite3.connect(self.path)
+        self._conn.execute("PRAGMA journal_mode = WAL")
+        self._conn.execute("PRAGMA synchronous = NORMAL")
+        self._conn.execute("""
+        CREATE TABLE IF NOT EXISTS icons (
+            object_key TEXT PRIMARY KEY,
+            url TEXT NOT NULL
+        ) WITHOUT ROWID
+        """)
+        self._conn.commit()
+        logging.info("Icon index opened: %s", self.path)
+
+    def close(self):
+        """
+        关闭索引文件
+        """
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def get(self, object_key):
+        """
+        查询已上传对象的 URL, 未上传或索引未打开时返回 None
+        """
+        if self._conn is None:
+            return None
+        row = self._conn.execute("SELECT url FROM icons WHERE object_key = ?", (object_key,)).fetchone()
+        return row[0] if row else None
+
+    def put(self, object_key, url):
+        """
+        记录已上传的对象
+        """
+        if self._conn is None:
+            return
+        self._conn.execute("INSERT OR REPLACE INTO icons (object_key, url) VALUES (?, ?)", (object_key, url))
+        self._conn.commit()
+
+
+icon_index = IconIndex()
@@ -0,0 +1,243 @@
+"""
+Icon upload queue: NFT / collection icons are uploaded by a thread-pool worker pool after the block commits.
+
+Icons are content-addressed (icons/<sha256>.<ext>); repeated images resolve from the local icon index without S3 calls.
+"""
+import asyncio
+import logging
+from collections import OrderedDict
+
+from app.config import config
+from app.dependencies import DBManager
+from app.icon_index import icon_index
+from app.s3 import upload_image_bytes_to_s3_async, s3_uploader, decode_data_url, sniff_image_type, icon_object_key
+
+ICON_UPLOAD_WORKERS = getattr(config, "ICON_UPLOAD_WORKERS", 4)
+# 等待上传的任务数上限, 队列满时区块提交后的 release 等待（背压）
+ICON_UPLOAD_QUEUE_SIZE = getattr(config, "ICON_UPLOAD_QUEUE_SIZE", 1000)
+# 保留最近完成的上传结果数, 供引用同一图标的后续行直接使用
+ICON_UPLOAD_RESULT_CACHE_SIZE = getattr(config, "ICON_UPLOAD_RESULT_CACHE_SIZE", 10000)
+
+# 上传完成前写入数据表的占位值: "pending:icons/<sha256>.<ext>"
+PLACEHOLDER_PREFIX = "pending:"
+
+# 可能包含占位值的 (表, 主键列, 图标列)
+ICON_COLUMNS = (
+    ("nft_collections", "collection_id", "collection_icon"),
+    ("nft_utxo_set", "nft_contract_id", "nft_icon"),
+)
+
+
+def placeholder(object_name):
+    return PLACEHOLDER_PREFIX + object_name
+
+
+class IconUploadJob:
+    """
+    一个对象的上传任务, targets 为上传完成后需要回填的 (表, 主键列, 主键值, 图标列)
+    """
+    __slots__ = ("object_name", "image_data", "image_bytes", "content_type", "targets", "result")
+
+    def __init__(self, object_name, image_data, targets, image_bytes=None, content_type=None, result=None):
+        self.object_name = object_name
+        self.image_data = image_data
+        self.image_bytes = image_bytes
+        self.content_type = content_type
+        self.targets = targets
+        self.result = result
+
+
+class IconUploadQueue:
+    """
+    区块处理中 submit/attach 的任务先暂存, 区块事务提交后 release 进入有界队列, 由工作协程通过共享的S3客户端上传并回填图标列
+    """
+    def __init__(self, workers=ICON_UPLOAD_WORKERS, max_queued=ICON_UPLOAD_QUEUE_SIZE, result_cache_size=ICON_UPLOAD_RESULT_CACHE_SIZE, uploader=upload_image_bytes_to_s3_async, index=icon_index):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.result_cache_size = result_cache_size
+        self.uploader = uploader
+        self.index = index
+        self._queue = None
+        self._tasks = []
+        self._staged_jobs = []
+        self._staged_targets = []
+        self._jobs = {}
+        self._results = OrderedDict()
+        # 上传失败的图片数据, 只用于回填提交前已登记的行, submit 不使用（相同图片重新上传）
+        self._failed = OrderedDict()
+
+    def submit(self, image_data, target):
+        """
+        登记图标上传, 返回当前应写入数据表的值
+
+        Args:
+            image_data: base64 图片数据 ("data:image/...;base64,...")
+            target: (表, 主键列, 主键值, 图标列)
+
+        Returns:
+            str: 已上传过的相同图片返回其 URL, 否则返回占位值; 不是有效的 base64 图片时原样返回 image_data
+        """
+        if not image_data.startswith('data:image'):
+            return image_data
+        try:
+            image_bytes, declared_type = decode_data_url(image_data)
+        except ValueError as e:
+            logging.error("Error decoding icon data: %s", str(e))
+            return image_data
+        extension, content_type = sniff_image_type(image_bytes, declared_type)
+        object_name = icon_object_key(image_bytes, extension)
+
+        # 相同内容的图片已上传过: 不需要任何网络请求
+        url = self.index.get(object_name)
+        if url is not None:
+            return url
+        if object_name in self._results:
+            return self._results[object_name]
+        job = self._jobs.get(object_name)
+        if job is not None:
+            self._staged_targets.append((object_name, target))
+        else:
+            job = IconUploadJob(object_name, image_data, [target], image_bytes, content_type)
+            self._jobs[object_name] = job
+            self._staged_jobs.append(job)
+        return placeholder(object_name)
+
+    def attach(self, value, target):
+        """
+        引用其他行的图标（如从集合铸造的 NFT 使用集合图标）: 为占位值时在上传完成后一并回填
+
+        Returns:
+            str: 当前应写入数据表的值
+        """
+        if not value or not value.startswith(PLACEHOLDER_PREFIX):
+            return value
+        object_name = value[len(PLACEHOLDER_PREFIX):]
+        url = self.index.get(object_name)
+        if url is not None:
+            return url
+        if object_name in self._results:
+            return self._results[object_name]
+        self._staged_targets.append((object_name, target))
+        return value
+
+    def discard(self):
+        """
+        丢弃当前区块暂存的任务（区块事务回滚时使用）
+        """
+        for job in self._staged_jobs:
+            self._jobs.pop(job.object_name, None)
+        self._staged_jobs = []
+        self._staged_targets = []
+
+    async def release(self):
+        """
+        区块事务提交后将暂存的任务放入上传队列, 队列满时等待
+        """
+        staged_jobs, self._staged_jobs = self._staged_jobs, []
+        staged_targets, self._staged_targets = self._staged_targets, []
+        if self._queue is None:
+            await self.start()
+
+        for job in staged_jobs:
+            await self._queue.put(job)
+        for object_name, target in staged_targets:
+            job = self._jobs.get(object_name)
+            if job is not None:
+                job.targets.append(target)
+            elif object_name in self._results:
+                # 上传已在提交前完成, 只需回填
+                await self._queue.put(IconUploadJob(object_name, None, [target], result=self._results[object_name]))
+            elif object_name in self._failed:
+                await self._queue.put(IconUploadJob(object_name, None, [target], result=self._failed[object_name]))
+
+    async def start(self):
+        """
+        启动工作协程, 并在后台回填上次退出时未完成的占位值
+        """
+        if self._queue is not None:
+            return
+        self.index.open()
+        # 启动时解析一次桶区域, 之后生成URL不再请求S3; 失败时不影响索引, 首次上传时再解析
+        try:
+            await s3_uploader.run(s3_uploader.warm_up)
+        except Exception as e:
+            logging.error("Error resolving S3 public URL prefix: %s", str(e))
+        self._queue = asyncio.Queue(maxsize=self.max_queued)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._recover()))
+
+    async def stop(self):
+        """
+        等待队列中的任务完成后停止
+        """
+        if self._queue is None:
+            return
+        await self._queue.join()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        s3_uploader.shutdown()
+        self.index.close()
+        self._queue = None
+        self._tasks = []
+
+    def _remember(self, results, object_name, result):
+        results[object_name] = result
+        results.move_to_end(object_name)
+        while len(results) > self.result_cache_size:
+            results.popitem(last=False)
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                if job.result is None:
+                    success, url = await self.uploader(job.image_bytes, job.object_name, job.content_type)
+                    if success:
+                        self.index.put(job.object_name, url)
+                        job.result = url
+                        self._failed.pop(job.object_name, None)
+                        self._remember(self._results, job.object_name, url)
+                    else:
+                        # 上传失败时保留原始图片数据, 与同步上传时的行为一致; 不缓存为结果, 之后相同的图片重新上传
+                        job.result = job.image_data
+                        self._remember(self._failed, job.object_name, job.image_data)
+                    self._jobs.pop(job.object_name, None)
+                await self._patch(job.object_name, job.result, job.targets)
+            except Exception as e:
+                logging.error("Error uploading icon %s: %s", job.object_name, str(e))
+                self._jobs.pop(job.object_name, None)
+            finally:
+                self._queue.task_done()
+
+    async def _patch(self, object_name, value, targets):
+        # 只替换仍为占位值的行, 行已被更新或回滚删除时不受影响
+        async with DBManager.transaction() as conn:
+            for table, key_column, key, column in targets:
+                query = f"UPDATE {table} SET {column} = %s WHERE {key_column} = %s AND {column} = %s"
+                await DBManager.execute_update_nocommit(conn, query, (value, key, placeholder(object_name)))
+
+    async def _recover(self):
+        # 进程在上传完成前退出时, 占位值对应的图片数据已不在内存中: 对象已上传的回填 URL, 否则记录警告
+        try:
+            for table, key_column, column in ICON_COLUMNS:
+                query = f"SELECT {key_column}, {column} FROM {table} WHERE {column} LIKE %s"
+                rows = await DBManager.execute_query(query, (PLACEHOLDER_PREFIX + "%",))
+                for key, value in rows:
+                    object_name = value[len(PLACEHOLDER_PREFIX):]
+                    if object_name in self._jobs:
+                        continue
+                    url = self.index.get(object_name)
+                    if url is None:
+                        object_key = await s3_uploader.run(s3_uploader.find_object, object_name)
+                        if object_key:
+                            url = await s3_uploader.run(s3_uploader.get_public_url, None, object_key)
+                    if url:
+                        await self._patch(object_name, url, [(table, key_column, key, column)])
+                        continue
+                    logging.warning("Icon upload for %s.%s=%s was interrupted: %s", table, key_column, key, object_name)
+        except Exception as e:
+            logging.error("Error recovering pending icon uploads: %s", str(e))
+
+
+icon_upload_queue = IconUploadQueue()
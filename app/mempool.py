@@ -0,0 +1,123 @@
+"""
+Mempool tracker: remembers processed txids and diffs them against getrawmempool in O(n).
+"""
+import logging
+from itertools import islice
+
+from app.config import config
+from app.dependencies import syclic_call_rpc
+
+# 已处理但尚未确认的交易数上限, 超出时淘汰最早加入的交易
+# 检查点以 JSON 保存在 MEDIUMTEXT 列中 (最大 16 MiB), 每个 txid 约 68 字节, 超过约 24 万时无法写入检查点
+MEMPOOL_TRACKER_MAX_SIZE = getattr(config, "MEMPOOL_TRACKER_MAX_SIZE", 200000)
+
+
+class MempoolTracker:
+    """
+    已处理交易的跟踪
+
+    pending 为已处理但尚未确认的交易 (按加入顺序的 dict), 区块确认后移出;
+    confirmed 为最近一个区块的交易, 避免区块刚产生时节点返回的旧内存池被重复处理
+    """
+    def __init__(self, max_size=MEMPOOL_TRACKER_MAX_SIZE):
+        self.max_size = max_size
+        self._pending = {}
+        self._confirmed = set()
+        # getrawmempool 的 mempool_sequence: None 表示尚未探测, False 表示节点不支持
+        self.sequence_supported = None
+        self._sequence = None
+        self._fetched_sequence = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def __contains__(self, txid):
+        return txid in self._pending or txid in self._confirmed
+
+    def diff(self, txids):
+        """
+        返回 txids 中尚未处理的交易, 保持原有顺序
+        """
+        pending = self._pending
+        confirmed = self._confirmed
+        return [tx for tx in txids if tx not in pending and tx not in confirmed]
+
+    def add(self, txids):
+        """
+        记录已处理的交易（在数据提交成功后调用）
+        """
+        pending = self._pending
+        for tx in txids:
+            pending[tx] = None
+        self._sequence = self._fetched_sequence
+
+        overflow = len(pending) - self.max_size
+        if overflow > 0:
+            for tx in list(islice(pending, overflow)):
+                del pending[tx]
+            logging.warning("内存池跟踪超过上限 %s, 淘汰最早的 %s 笔交易", self.max_size, overflow)
+
+    def confirm(self, block_txids):
+        """
+        区块处理完成后, 将区块中的交易移出 pending 并作为最近确认的交易
+        """
+        pending = self._pending
+        for tx in block_txids:
+            pending.pop(tx, None)
+        self._confirmed = set(block_txids)
+        self._sequence = None
+
+    def checkpoint(self, new_txids=(), block_txids=None):
+        """
+        返回 add(new_txids) 及 confirm(block_txids) 之后的状态, 用于在提交前写入检查点
+
+        Returns:
+            tuple: (pending, confirmed) 两个 txid 列表
+        """
+        if block_txids is None:
+            pending = list(self._pending) + [tx for tx in dict.fromkeys(new_txids) if tx not in self._pending]
+            # 与 add 相同, 超出上限时淘汰最早加入的交易
+            return pending[max(0, len(pending) - self.max_size):], list(self._confirmed)
+        block_set = set(block_txids)
+        return [tx for tx in self._pending if tx not in block_set], list(block_txids)
+
+    def restore(self, pending, confirmed):
+        """
+        从检查点恢复
+        """
+        self._pending = dict.fromkeys(pending)
+        self._confirmed = set(confirmed)
+        self._sequence = None
+
+    def reset(self):
+        """
+        清空全部状态（链重组回滚后重新处理内存池）
+        """
+        self.restore([], [])
+
+    async def fetch(self):
+        """
+        获取节点当前内存池的 txid 列表
+
+        节点支持 getrawmempool 的 mempool_sequence 时, 序号与上次处理时相同则返回 None, 调用方可跳过本轮比较
+
+        Returns:
+            list: txid 列表, 内存池无变化时为 None
+        """
+        if self.sequence_supported is not False:
+            res = await syclic_call_rpc(method="getrawmempool", params=[False, True])
+            if isinstance(res, dict) and "txids" in res and "mempool_sequence" in res:
+                self.sequence_supported = True
+                self._fetched_sequence = res["mempool_sequence"]
+                if self._fetched_sequence == self._sequence:
+                    return None
+                return res["txids"]
+
+            logging.info("节点不支持 getrawmempool mempool_sequence, 每轮比较完整的内存池列表")
+            self.sequence_supported = False
+            if isinstance(res, list):
+                return res
+        return await syclic_call_rpc(method="getrawmempool", params=[])
+
+
+mempool_tracker = MempoolTracker()
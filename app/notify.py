@@ -0,0 +1,240 @@
+"""
+Chain notifier: wake the indexers on hashblock / hashtx notifications, with adaptive polling as fallback.
+
+Stand-in publisher for nodes without -zmqpubhashblock / -zmqpubhashtx (polls RPC and republishes over ZMQ):
+    python -m app.notify --bind tcp://127.0.0.1:28332
+"""
+import argparse
+import asyncio
+import logging
+import struct
+import time
+
+from app.config import config
+from app.dependencies import syclic_call_rpc, RPCManager
+
+try:
+    import zmq
+    import zmq.asyncio
+except ImportError:  # pyzmq 为可选依赖, 未安装时只使用轮询
+    zmq = None
+
+# 节点 -zmqpubhashblock / -zmqpubhashtx 的地址, 如 "tcp://127.0.0.1:28332"; 未配置时使用轮询
+ZMQ_NOTIFY_ENDPOINT = getattr(config, "ZMQ_NOTIFY_ENDPOINT", None)
+# 订阅可用时, 没有通知到达的最长等待时间（兜底轮询）
+NOTIFY_IDLE_TIMEOUT = getattr(config, "NOTIFY_IDLE_TIMEOUT", 30)
+# 订阅可用时, 定期以完整的 getrawmempool 校正通过 hashtx 收集的交易（ZMQ 在高水位时会丢弃消息）
+NOTIFY_RESYNC_INTERVAL = getattr(config, "NOTIFY_RESYNC_INTERVAL", 60)
+# hashtx 收集的交易数上限, 超出后下一轮回退为完整的 getrawmempool
+NOTIFY_MAX_PENDING_TXIDS = getattr(config, "NOTIFY_MAX_PENDING_TXIDS", 100000)
+# 未订阅时的自适应轮询: 连续空闲时间隔按系数增长, 直到上限
+NOTIFY_MAX_POLL_INTERVAL = getattr(config, "NOTIFY_MAX_POLL_INTERVAL", 10)
+NOTIFY_POLL_BACKOFF = getattr(config, "NOTIFY_POLL_BACKOFF", 1.5)
+
+TOPICS = ("hashblock", "hashtx")
+
+
+class ChainNotifier:
+    """
+    订阅节点的 hashblock / hashtx 通知, 通知到达时立即唤醒索引循环
+
+    订阅不可用（未配置地址或未安装 pyzmq）时按自适应间隔轮询: 有新数据时使用索引程序给出的间隔, 空闲时逐步放慢
+    """
+    def __init__(self, endpoint=ZMQ_NOTIFY_ENDPOINT, idle_timeout=NOTIFY_IDLE_TIMEOUT, resync_interval=NOTIFY_RESYNC_INTERVAL,
+                 max_pending_txids=NOTIFY_MAX_PENDING_TXIDS, max_poll_interval=NOTIFY_MAX_POLL_INTERVAL, poll_backoff=NOTIFY_POLL_BACKOFF):
+        self.endpoint = endpoint
+        self.idle_timeout = idle_timeout
+        self.resync_interval = resync_interval
+        self.max_pending_txids = max_pending_txids
+        self.max_poll_interval = max_poll_interval
+        self.poll_backoff = poll_backoff
+        self.subscribed = False
+        self.last_block_hash = None
+        self._event = asyncio.Event()
+        self._task = None
+        self._socket = None
+        self._txids = {}
+        self._overflow = False
+        self._last_resync = 0
+        self._idle_rounds = 0
+        self._block_listeners = []
+
+    async def start(self):
+        """
+        连接到通知地址并开始接收; 不可用时保持轮询模式
+        """
+        if not self.endpoint:
+            return
+        if zmq is None:
+            logging.warning("未安装 pyzmq, 忽略 ZMQ_NOTIFY_ENDPOINT 并使用轮询")
+            return
+        self._socket = zmq.asyncio.Context.instance().socket(zmq.SUB)
+        self._socket.connect(self.endpoint)
+        for topic in TOPICS:
+            self._socket.setsockopt(zmq.SUBSCRIBE, topic.encode())
+        self._task = asyncio.create_task(self._run())
+        self.subscribed = True
+        logging.info("已订阅节点通知: %s", self.endpoint)
+
+    async def stop(self):
+        """
+        停止接收通知
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self._socket is not None:
+            self._socket.close(linger=0)
+        self._task = None
+        self._socket = None
+        self.subscribed = False
+
+    async def _run(self):
+        while True:
+            try:
+                frames = await self._socket.recv_multipart()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error("接收节点通知出错: %s", str(e))
+                await asyncio.sleep(1)
+                continue
+            if len(frames) >= 2:
+                self.notify(frames[0].decode(errors="replace"), frames[1].hex())
+
+    def notify(self, topic, value=None):
+        """
+        处理一条通知并唤醒等待中的索引循环（订阅任务和本地测试直接调用）
+
+        Args:
+            topic: "hashblock" 或 "hashtx"
+            value: 区块哈希或 txid
+        """
+        if topic == "hashblock":
+            self.last_block_hash = value
+            for callback in self._block_listeners:
+                callback()
+        elif topic == "hashtx" and value is not None:
+            if len(self._txids) < self.max_pending_txids:
+                self._txids[value] = None
+            else:
+                self._overflow = True
+        self._event.set()
+
+    def add_block_listener(self, callback):
+        """
+        注册 hashblock 通知到达时调用的回调（如唤醒区块预取）
+        """
+        self._block_listeners.append(callback)
+
+    def poll_timeout(self, interval, idle_rounds):
+        """
+        未订阅时连续空闲 idle_rounds 轮后的轮询间隔, 按 poll_backoff 增长至 max_poll_interval
+
+        Returns:
+            tuple: (轮询间隔, 下一轮的 idle_rounds), 达到最长间隔后不再增加, 避免长时间空闲时指数运算溢出
+        """
+        max_timeout = max(interval, self.max_poll_interval)
+        timeout = min(interval * self.poll_backoff ** idle_rounds, max_timeout)
+        return timeout, idle_rounds + 1 if timeout < max_timeout else idle_rounds
+
+    def mark_activity(self):
+        """
+        索引程序在本轮处理了新数据时调用, 轮询间隔恢复为最短
+        """
+        self._idle_rounds = 0
+
+    async def wait(self, interval):
+        """
+        等待下一轮扫描: 已订阅时等待通知到达（最长 idle_timeout）, 否则按自适应间隔轮询
+
+        Args:
+            interval: 索引程序给出的扫描间隔, 为 0 时（追赶区块）不等待
+        """
+        if interval <= 0:
+            return
+        if self.subscribed:
+            timeout = self.idle_timeout
+        else:
+            timeout, self._idle_rounds = self.poll_timeout(interval, self._idle_rounds)
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._event.clear()
+
+    async def mempool_txids(self, tracker):
+        """
+        返回内存池模式下本轮需要比较的 txid
+
+        已订阅时使用 hashtx 收集的交易（按到达顺序, 父交易在前）; 未订阅、到达校正周期或收集溢出时回退为完整的内存池列表
+
+        Args:
+            tracker: app.mempool.MempoolTracker
+
+        Returns:
+            list: txid 列表, 内存池无变化时为 None
+        """
+        now = time.monotonic()
+        if self.subscribed and not self._overflow and now - self._last_resync < self.resync_interval:
+            txids, self._txids = list(self._txids), {}
+            return txids
+
+        self._txids = {}
+        self._overflow = False
+        self._last_resync = now
+        return await tracker.fetch()
+
+
+chain_notifier = ChainNotifier()
+
+
+async def run_stand_in_publisher(bind, poll_interval=1):
+    """
+    本地测试用的替代发布器: 轮询节点 RPC, 以与节点相同的 [topic, body, sequence] 格式发布 hashblock / hashtx
+    """
+    if zmq is None:
+        raise RuntimeError("The stand-in publisher requires pyzmq")
+    from app.mempool import MempoolTracker
+
+    socket = zmq.asyncio.Context.instance().socket(zmq.PUB)
+    socket.bind(bind)
+    logging.info("替代发布器已启动: %s", bind)
+    sequences = dict.fromkeys(TOPICS, 0)
+
+    async def publish(topic, value):
+        await socket.send_multipart([topic.encode(), bytes.fromhex(value), struct.pack("<I", sequences[topic])])
+        sequences[topic] = (sequences[topic] + 1) & 0xffffffff
+
+    await RPCManager.init_session()
+    tracker = MempoolTracker()
+    best_block_hash = None
+    try:
+        while True:
+            block_hash = await syclic_call_rpc(method="getbestblockhash", params=[])
+            if block_hash != best_block_hash:
+                if best_block_hash is not None:
+                    await publish("hashblock", block_hash)
+                best_block_hash = block_hash
+            txids = await tracker.fetch()
+            if txids is not None:
+                new_txids = tracker.diff(txids)
+                for txid in new_txids:
+                    await publish("hashtx", txid)
+                tracker.add(new_txids)
+            await asyncio.sleep(poll_interval)
+    finally:
+        socket.close(linger=0)
+        await RPCManager.close_session()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Stand-in hashblock/hashtx publisher for local testing")
+    parser.add_argument("--bind", default="tcp://127.0.0.1:28332", help="发布地址")
+    parser.add_argument("--interval", type=float, default=1, help="轮询节点的间隔（秒）")
+    args = parser.parse_args()
+    asyncio.run(run_stand_in_publisher(args.bind, args.interval))
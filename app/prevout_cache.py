@@ -0,0 +1,138 @@
+"""
+Previous output cache for input resolution.
+"""
+import asyncio
+import logging
+from collections import OrderedDict, namedtuple
+
+from app.config import config
+from app.dependencies import syclic_call_rpc
+from app.tx_parser import parse_transaction_hex
+
+PREVOUT_CACHE_SIZE = getattr(config, "PREVOUT_CACHE_SIZE", 200_000)
+
+# 输入解析只需要的输出信息: 金额(聪), 脚本类型, 地址或 Pool ID
+Prevout = namedtuple("Prevout", ["value", "script_type", "address"])
+PREVOUT_SCRIPT_TYPES = ("pubkeyhash", "multisig", "pool")
+
+
+def extract_prevout(output):
+    """
+    从解析后的交易输出中提取输入解析所需的精简信息
+
+    Args:
+        output: app.tx_parser.TxOutput
+
+    Returns:
+        Prevout: script_type 为 "pubkeyhash"、"multisig"、"pool" 或 None
+    """
+    if output.template in PREVOUT_SCRIPT_TYPES:
+        address = output.address
+        if address is not None:
+            return Prevout(output.value, output.template, address)
+    return Prevout(output.value, None, None)
+
+
+class PrevoutCache:
+    """
+    以 (txid, vout) 为键的 LRU 缓存, 在并发任务间共享并合并对同一父交易的重复查询
+
+    未命中时先查询本地 UTXO 存储 (store), 仍未找到才请求节点
+    """
+    def __init__(self, max_size=PREVOUT_CACHE_SIZE, store=None):
+        self.max_size = max_size
+        self.store = store
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self.hits = 0
+        self.store_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def put(self, txid, vout, prevout):
+        """
+        写入一条输出信息, 超出容量时淘汰最久未使用的条目
+        """
+        key = (txid, vout)
+        self._entries[key] = prevout
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def add_transaction(self, tx):
+        """
+        将已解析交易的所有输出写入缓存
+        """
+        txid = tx.txid
+        for vout, output in enumerate(tx.outputs):
+            self.put(txid, vout, extract_prevout(output))
+
+    async def _fetch(self, txid):
+        tx_hex = await syclic_call_rpc(method="getrawtransaction", params=[txid, 0])
+        if tx_hex is None:
+            raise ValueError(f"Transaction {txid} not found")
+        tx = parse_transaction_hex(tx_hex, txid)
+        self.add_transaction(tx)
+        return tx
+
+    async def get(self, txid, vout):
+        """
+        获取 (txid, vout) 对应的输出信息, 缓存和本地存储均未命中时从节点获取父交易
+
+        Returns:
+            Prevout: 输出信息
+        """
+        key = (txid, vout)
+        prevout = self._entries.get(key)
+        if prevout is not None:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return prevout
+
+        if self.store is not None:
+            prevout = self.store.get(txid, vout)
+            if prevout is not None:
+                self.store_hits += 1
+                self.put(txid, vout, prevout)
+                return prevout
+
+        self.misses += 1
+        future = self._inflight.get(txid)
+        if future is None:
+            future = asyncio.ensure_future(self._fetch(txid))
+            self._inflight[txid] = future
+            future.add_done_callback(lambda _: self._inflight.pop(txid, None))
+        else:
+            self.coalesced += 1
+
+        # shield 防止单个任务取消时中断其他任务共享的请求
+        tx = await asyncio.shield(future)
+        return extract_prevout(tx.outputs[vout])
+
+    def stats(self):
+        """
+        返回缓存命中统计
+        """
+        lookups = self.hits + self.store_hits + self.misses
+        return {
+            "hits": self.hits,
+            "store_hits": self.store_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "size": len(self._entries),
+            "hit_rate": (self.hits + self.store_hits) / lookups if lookups else 0.0,
+        }
+
+    def log_stats(self):
+        """
+        输出缓存命中统计日志
+        """
+        stats = self.stats()
+        logging.info("Prevout cache: hits=%s store_hits=%s misses=%s coalesced=%s size=%s hit_rate=%.2f%%",
+                     stats["hits"], stats["store_hits"], stats["misses"], stats["coalesced"], stats["size"], stats["hit_rate"] * 100)
+
+
+prevout_cache = PrevoutCache()
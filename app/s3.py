@@ -1,28 +1,217 @@
-import boto3
-from botocore.exceptions import NoCredentialsError, ClientError
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config as BotoConfig
+from botocore.exceptions import BotoCoreError, NoCredentialsError, ClientError
+import asyncio
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlparse
 from app.config import config
+from app.s3_backends import create_s3_client
 
 import base64
+import hashlib
+import io
 import os
-import tempfile
+
+# 超过阈值的图片使用分片上传
+S3_MULTIPART_THRESHOLD = getattr(config, "S3_MULTIPART_THRESHOLD", 8 * 1024 * 1024)
+S3_MULTIPART_CHUNKSIZE = getattr(config, "S3_MULTIPART_CHUNKSIZE", 8 * 1024 * 1024)
+S3_MULTIPART_CONCURRENCY = getattr(config, "S3_MULTIPART_CONCURRENCY", 4)
+# 共享客户端的连接池大小, 同时也是异步接口线程池的大小（分片上传时每个对象另占 S3_MULTIPART_CONCURRENCY 个连接）
+S3_MAX_POOL_CONNECTIONS = getattr(config, "S3_MAX_POOL_CONNECTIONS", 32)
+# botocore 重试: 最大尝试次数与重试模式 ("standard" / "adaptive")
+S3_MAX_ATTEMPTS = getattr(config, "S3_MAX_ATTEMPTS", 5)
+S3_RETRY_MODE = getattr(config, "S3_RETRY_MODE", "adaptive")
+# 桶所在区域, 未配置时在首次使用时查询一次 get_bucket_location
+S3_BUCKET_REGION = getattr(config, "S3_BUCKET_REGION", None)
+# 公共URL前缀（如 CDN 域名 "https://cdn.example.com/"）, 未配置时使用 "https://<bucket>.s3.<region>.amazonaws.com/"
+S3_PUBLIC_URL_BASE = getattr(config, "S3_PUBLIC_URL_BASE", None)
+# 按内容哈希存储的图标对象键前缀
+S3_ICON_KEY_PREFIX = getattr(config, "S3_ICON_KEY_PREFIX", "icons/")
+
+# 图片文件头 -> (扩展名, ContentType)
+IMAGE_SIGNATURES = (
+    (b"\xff\xd8\xff", ("jpg", "image/jpeg")),
+    (b"\x89PNG\r\n\x1a\n", ("png", "image/png")),
+    (b"GIF87a", ("gif", "image/gif")),
+    (b"GIF89a", ("gif", "image/gif")),
+    (b"BM", ("bmp", "image/bmp")),
+    (b"II*\x00", ("tiff", "image/tiff")),
+    (b"MM\x00*", ("tiff", "image/tiff")),
+    (b"\x00\x00\x01\x00", ("ico", "image/x-icon")),
+)
+# ISO BMFF (ftyp) 品牌 -> (扩展名, ContentType)
+FTYP_BRANDS = {
+    b"avif": ("avif", "image/avif"),
+    b"avis": ("avif", "image/avif"),
+    b"heic": ("heic", "image/heic"),
+    b"heix": ("heic", "image/heic"),
+    b"mif1": ("heic", "image/heif"),
+}
+# data URL 中声明的类型 -> 扩展名（无法从文件头识别时使用）
+DECLARED_EXTENSIONS = {
+    "image/jpeg": "jpg", "image/jpg": "jpg", "image/png": "png", "image/gif": "gif", "image/webp": "webp",
+    "image/svg+xml": "svg", "image/bmp": "bmp", "image/avif": "avif", "image/x-icon": "ico",
+}
+
+
+def sniff_image_type(image_bytes, declared_type=None):
+    """
+    根据文件头识别图片类型
+
+    Args:
+        image_bytes: 图片数据
+        declared_type: data URL 中声明的 ContentType, 文件头无法识别时使用
+
+    Returns:
+        tuple: (扩展名, ContentType), 都无法识别时为 ("jpg", "image/jpeg")
+    """
+    for signature, image_type in IMAGE_SIGNATURES:
+        if image_bytes.startswith(signature):
+            return image_type
+    if image_bytes[:4] == b"RIFF" and image_bytes[8:12] == b"WEBP":
+        return "webp", "image/webp"
+    if image_bytes[4:8] == b"ftyp" and image_bytes[8:12] in FTYP_BRANDS:
+        return FTYP_BRANDS[image_bytes[8:12]]
+    head = image_bytes[:256].lstrip().lower()
+    if head.startswith(b"<svg") or (head.startswith(b"<?xml") and b"<svg" in head):
+        return "svg", "image/svg+xml"
+    if declared_type in DECLARED_EXTENSIONS:
+        return DECLARED_EXTENSIONS[declared_type], declared_type
+    return "jpg", "image/jpeg"
+
+
+def decode_data_url(image_data):
+    """
+    解析 "data:image/png;base64,..." 格式的图片数据
+
+    Returns:
+        tuple: (图片字节, 声明的 ContentType)
+    """
+    header, _, encoded = image_data.partition(',')
+    declared_type = header[len('data:'):].split(';')[0].strip().lower() or None
+    return base64.b64decode(encoded), declared_type
+
+
+def icon_object_key(image_bytes, extension):
+    """
+    按内容哈希生成对象键 "icons/<sha256>.<ext>", 相同图片共用一个对象
+    """
+    return f"{S3_ICON_KEY_PREFIX}{hashlib.sha256(image_bytes).hexdigest()}.{extension}"
 
 class S3Uploader:
-    def __init__(self, aws_access_key_id=None, aws_secret_access_key=None, region_name=None):
+    def __init__(self, aws_access_key_id=None, aws_secret_access_key=None, region_name=None, backend=None):
         """
         初始化S3客户端
         :param aws_access_key_id: AWS访问密钥ID
         :param aws_secret_access_key: AWS秘密访问密钥
         :param region_name: AWS区域
+        :param backend: 存储后端 ("boto" / "local" / "memory" / "moto"), 默认为配置 S3_BACKEND
         """
-        self.s3_client = boto3.client(
-            's3',
+        self.s3_client = create_s3_client(
+            backend,
             aws_access_key_id=aws_access_key_id or config.AWS_ACCESS_KEY_ID,
             aws_secret_access_key=aws_secret_access_key or config.AWS_SECRET_ACCESS_KEY,
-            region_name=region_name or config.AWS_REGION_NAME
+            region_name=region_name or config.AWS_REGION_NAME,
+            boto_config=BotoConfig(
+                max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+                retries={'max_attempts': S3_MAX_ATTEMPTS, 'mode': S3_RETRY_MODE}
+            )
+        )
+        self.transfer_config = TransferConfig(
+            multipart_threshold=S3_MULTIPART_THRESHOLD,
+            multipart_chunksize=S3_MULTIPART_CHUNKSIZE,
+            max_concurrency=S3_MULTIPART_CONCURRENCY
         )
         self.logger = logging.getLogger(__name__)
+        # 桶名称 -> 区域 / 公共URL前缀, 每个桶只查询一次
+        self._regions = {}
+        self._url_prefixes = {}
+        self._executor = None
+
+    def set_client(self, s3_client):
+        """
+        替换存储后端的客户端（如基准测试中切换后端）, 同时清除区域与URL缓存
+        :param s3_client: S3客户端, 见 app.s3_backends
+        """
+        self.s3_client = s3_client
+        self._regions = {}
+        self._url_prefixes = {}
+
+    async def run(self, func, *args):
+        """
+        在共享线程池中调用同步方法（异步接口, 所有调用共用同一个带连接池的客户端）
+        :param func: 要调用的函数, 如 self.check_object_exists
+        :return: func 的返回值
+        """
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=S3_MAX_POOL_CONNECTIONS, thread_name_prefix="s3")
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def shutdown(self):
+        """
+        关闭异步接口的线程池
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def warm_up(self, bucket_name=None):
+        """
+        启动时解析桶区域并生成公共URL前缀, 之后的 get_public_url 不再请求S3
+        :param bucket_name: 桶名称，如果未指定则使用默认桶
+        :return: 公共URL前缀，失败时返回None
+        """
+        if bucket_name is None:
+            bucket_name = config.S3_BUCKET_NAME
+        prefix = self._public_url_prefix(bucket_name)
+        if prefix is not None:
+            self.logger.info(f"公共URL前缀: {prefix}")
+        return prefix
+
+    def get_bucket_region(self, bucket_name=None):
+        """
+        获取桶所在区域（缓存）
+        :param bucket_name: 桶名称，如果未指定则使用默认桶
+        :return: 区域名称，失败时返回None
+        """
+        if bucket_name is None:
+            bucket_name = config.S3_BUCKET_NAME
+        region = self._regions.get(bucket_name)
+        if region is not None:
+            return region
+        if S3_BUCKET_REGION and bucket_name == config.S3_BUCKET_NAME:
+            region = S3_BUCKET_REGION
+        else:
+            try:
+                # 如果桶在us-east-1，LocationConstraint会是None
+                region = self.s3_client.get_bucket_location(Bucket=bucket_name)['LocationConstraint'] or 'us-east-1'
+            except ClientError as e:
+                self.logger.error(f"获取桶位置时出错: {e.response['Error']['Message']}")
+                return None
+            except BotoCoreError as e:
+                # 缺少凭证、端点不可达等; 不缓存, 下次生成URL时重试
+                self.logger.error(f"获取桶位置时出错: {e}")
+                return None
+        self._regions[bucket_name] = region
+        return region
+
+    def _public_url_prefix(self, bucket_name):
+        prefix = self._url_prefixes.get(bucket_name)
+        if prefix is not None:
+            return prefix
+        if S3_PUBLIC_URL_BASE and bucket_name == config.S3_BUCKET_NAME:
+            prefix = S3_PUBLIC_URL_BASE.rstrip('/') + '/'
+        elif getattr(self.s3_client, "public_url_base", None):
+            # 本地后端的对象URL
+            prefix = f"{self.s3_client.public_url_base}{bucket_name}/"
+        else:
+            region = self.get_bucket_region(bucket_name)
+            if region is None:
+                return None
+            prefix = f"https://{bucket_name}.s3.{region}.amazonaws.com/"
+        self._url_prefixes[bucket_name] = prefix
+        return prefix
 
     def check_object_exists(self, object_name, bucket_name=None):
         """
@@ -52,6 +241,72 @@ class S3Uploader:
             self.logger.error(f"检查对象时发生未知错误: {str(e)}")
             return False
             
+    def find_object(self, object_name, bucket_name=None):
+        """
+        按去掉扩展名的对象名称查找已上传的对象（上传时扩展名按图片实际类型确定）
+        :param object_name: 对象键名称, 扩展名可以与实际不同
+        :param bucket_name: 桶名称，如果未指定则使用默认桶
+        :return: 找到时返回对象键，否则返回None
+        """
+        try:
+            if bucket_name is None:
+                bucket_name = config.S3_BUCKET_NAME
+            prefix = os.path.splitext(object_name)[0] + "."
+            response = self.s3_client.list_objects_v2(Bucket=bucket_name, Prefix=prefix, MaxKeys=10)
+            for item in response.get('Contents', []):
+                if '/' not in item['Key'][len(prefix):]:
+                    return item['Key']
+            return None
+        except ClientError as e:
+            self.logger.error(f"查找对象时出错: {e.response['Error']['Message']}")
+            return None
+
+    def upload_bytes(self, data, object_name, bucket_name=None, content_type='image/jpeg', storage_class='STANDARD', metadata=None):
+        """
+        从内存上传数据到S3, 超过分片阈值时自动使用分片上传
+        :param data: 要上传的字节数据
+        :param object_name: S3对象名称
+        :param bucket_name: 桶名称
+        :param content_type: 内容类型
+        :param storage_class: 存储类
+        :param metadata: 元数据字典
+        :return: 上传成功返回True和对象键，失败返回False和错误信息
+        """
+        try:
+            if bucket_name is None:
+                bucket_name = config.S3_BUCKET_NAME
+
+            extra_args = {
+                'ContentType': content_type,
+                'StorageClass': storage_class
+            }
+            if metadata:
+                extra_args['Metadata'] = metadata
+
+            self.s3_client.upload_fileobj(
+                io.BytesIO(data),
+                bucket_name,
+                object_name,
+                ExtraArgs=extra_args,
+                Config=self.transfer_config
+            )
+
+            self.logger.info(f"成功上传 {len(data)} 字节到 {bucket_name}/{object_name}")
+            return True, object_name
+
+        except NoCredentialsError:
+            error_msg = "AWS凭证未配置或无效"
+            self.logger.error(error_msg)
+            return False, error_msg
+        except ClientError as e:
+            error_msg = f"AWS客户端错误: {e.response['Error']['Message']}"
+            self.logger.error(error_msg)
+            return False, error_msg
+        except Exception as e:
+            error_msg = f"上传过程中发生未知错误: {str(e)}"
+            self.logger.error(error_msg)
+            return False, error_msg
+
     def upload_image(self, bucket_name=None, file_path=None, object_name=None, content_type='image/jpeg', 
                     acl='private', storage_class='STANDARD', metadata=None, tags=None):
         """
@@ -164,35 +419,67 @@ class S3Uploader:
         :param object_name: 对象键
         :return: 公共URL或None
         """
-        try:
-            # 如果没有指定bucket_name，则使用配置中的默认值
-            if bucket_name is None:
-                bucket_name = config.S3_BUCKET_NAME
-                
-            # 检查桶区域以构建正确的端点
-            location = self.s3_client.get_bucket_location(Bucket=bucket_name)['LocationConstraint']
-            
-            # 如果桶在us-east-1，LocationConstraint会是None
-            if location is None:
-                location = 'us-east-1'
-                
-            return f"https://{bucket_name}.s3.{location}.amazonaws.com/{object_name}"
-        except ClientError as e:
-            self.logger.error(f"获取桶位置时出错: {e.response['Error']['Message']}")
+        # 如果没有指定bucket_name，则使用配置中的默认值
+        if bucket_name is None:
+            bucket_name = config.S3_BUCKET_NAME
+
+        # 桶区域只在首次使用时查询, 之后按缓存的前缀拼接
+        prefix = self._public_url_prefix(bucket_name)
+        if prefix is None:
             return None
+        return prefix + object_name
 
 
 
 s3_uploader = S3Uploader()
 
-def upload_base64_image_to_s3(image_data, object_name, content_type='image/jpeg'):
+def upload_image_bytes_to_s3(image_bytes, object_name, content_type='image/jpeg'):
+    """
+    上传已解码的图片到S3存储, 对象已存在时直接返回其URL
+    
+    Args:
+        image_bytes: 图片数据
+        object_name: S3中的对象名称，如"icons/<sha256>.png"
+        content_type: 文件的内容类型
+        
+    Returns:
+        tuple: (success, image_url), 失败时 image_url 为 None
+    """
+    # 先检查S3上是否已经存在该对象
+    if s3_uploader.check_object_exists(object_name):
+        # 对象已存在，直接获取URL
+        image_url = s3_uploader.get_public_url(object_name=object_name)
+        logging.info("Image already exists in S3, reusing: %s", image_url)
+        return image_url is not None, image_url
+        
+    # 如果不存在，则从内存上传
+    success, _ = s3_uploader.upload_bytes(image_bytes, object_name=object_name, content_type=content_type)
+    if not success:
+        return False, None
+
+    # 获取公共URL
+    image_url = s3_uploader.get_public_url(object_name=object_name)
+    logging.info("Image uploaded to S3: %s", image_url)
+    return image_url is not None, image_url
+
+
+async def upload_image_bytes_to_s3_async(image_bytes, object_name, content_type='image/jpeg'):
+    """
+    upload_image_bytes_to_s3 的异步版本, 在共享客户端的线程池中执行
+
+    Returns:
+        tuple: (success, image_url), 失败时 image_url 为 None
     """
-    上传base64编码的图片到S3存储
+    return await s3_uploader.run(upload_image_bytes_to_s3, image_bytes, object_name, content_type)
+
+
+def upload_base64_image_to_s3(image_data, content_type=None):
+    """
+    上传base64编码的图片到S3存储（在内存中解码上传, 不写临时文件）, 对象名称按内容哈希确定
     
     Args:
         image_data: base64编码的图片数据，格式如"data:image/jpeg;base64,/9j/4AAQSkZ..."
-        object_name: S3中的对象名称，如"collections/xyz.jpg"
-        content_type: 文件的内容类型，默认为'image/jpeg'
+        content_type: 文件的内容类型，默认按文件头识别
         
     Returns:
         tuple: (success, result)
@@ -203,41 +490,11 @@ def upload_base64_image_to_s3(image_data, object_name, content_type='image/jpeg'
         return False, image_data
     
     try:
-        # 先检查S3上是否已经存在该对象
-        if s3_uploader.check_object_exists(object_name):
-            # 对象已存在，直接获取URL
-            image_url = s3_uploader.get_public_url(object_name=object_name)
-            logging.info("Image already exists in S3, reusing: %s", image_url)
-            return True, image_url
-            
-        # 如果不存在，则进行上传
-        # 解析Base64图片数据
-        image_data_encoded = image_data.split(',')[1]
-        image_bytes = base64.b64decode(image_data_encoded)
-        
-        # 创建临时文件保存图片
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as temp_file:
-            temp_file_path = temp_file.name
-            temp_file.write(image_bytes)
-        
-        # 上传到S3
-        success, _ = s3_uploader.upload_image(
-            file_path=temp_file_path,
-            object_name=object_name,
-            content_type=content_type
-        )
-        
-        # 删除临时文件
-        os.unlink(temp_file_path)
-        
-        if success:
-            # 获取公共URL
-            image_url = s3_uploader.get_public_url(object_name=object_name)
-            logging.info("Image uploaded to S3: %s", image_url)
-            return True, image_url
-        else:
-            return False, image_data
-            
+        # 解析Base64图片数据, 按文件头确定对象扩展名和 ContentType
+        image_bytes, declared_type = decode_data_url(image_data)
+        extension, sniffed_type = sniff_image_type(image_bytes, declared_type)
+        success, image_url = upload_image_bytes_to_s3(image_bytes, icon_object_key(image_bytes, extension), content_type or sniffed_type)
+        return (True, image_url) if success else (False, image_data)
     except Exception as e:
         logging.error("Error uploading image to S3: %s", str(e))
         return False, image_data
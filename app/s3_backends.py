@@ -0,0 +1,178 @@
+"""
+Storage backends behind S3Uploader: the boto3 S3 client, or stand-ins implementing the subset of its API the uploader uses.
+
+    S3_BACKEND = "boto"    AWS S3 (默认)
+    S3_BACKEND = "local"   本地目录 S3_LOCAL_ROOT/<bucket>/<key>, 公共URL为 file://
+    S3_BACKEND = "memory"  进程内字典, 用于测试和基准
+    S3_BACKEND = "moto"    moto 模拟的 S3（需要安装 moto）
+"""
+import io
+import os
+import threading
+import time
+from pathlib import Path
+
+import boto3
+from botocore.exceptions import ClientError
+
+from app.config import config
+
+S3_BACKEND = getattr(config, "S3_BACKEND", "boto")
+S3_LOCAL_ROOT = getattr(config, "S3_LOCAL_ROOT", "s3_local")
+# 本地后端每个请求的模拟延迟（秒）, 用于估计网络往返对吞吐量的影响
+S3_LOCAL_LATENCY = getattr(config, "S3_LOCAL_LATENCY", 0)
+
+BACKENDS = ("boto", "local", "memory", "moto")
+
+
+def _client_error(code, message, operation_name):
+    return ClientError({'Error': {'Code': code, 'Message': message}}, operation_name)
+
+
+class MemoryS3Client:
+    """
+    进程内对象存储, 实现 S3Uploader 使用的 S3 客户端方法
+
+    线程安全; requests 为收到的请求数
+    """
+    def __init__(self, region=None, latency=S3_LOCAL_LATENCY):
+        self.region = region
+        self.latency = latency
+        self.requests = 0
+        # S3Uploader 按 public_url_base + "<bucket>/<key>" 生成公共URL, 不查询桶区域
+        self.public_url_base = "memory://"
+        self._objects = {}
+        self._lock = threading.Lock()
+
+    def _request(self):
+        with self._lock:
+            self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _read(self, bucket, key):
+        with self._lock:
+            return self._objects.get((bucket, key))
+
+    def _write(self, bucket, key, data):
+        with self._lock:
+            self._objects[(bucket, key)] = data
+
+    def _keys(self, bucket, prefix):
+        with self._lock:
+            return sorted(key for object_bucket, key in self._objects if object_bucket == bucket and key.startswith(prefix))
+
+    def head_object(self, Bucket, Key, **kwargs):
+        self._request()
+        data = self._read(Bucket, Key)
+        if data is None:
+            raise _client_error('404', 'Not Found', 'HeadObject')
+        return {'ContentLength': len(data)}
+
+    def get_object(self, Bucket, Key, **kwargs):
+        self._request()
+        data = self._read(Bucket, Key)
+        if data is None:
+            raise _client_error('NoSuchKey', 'The specified key does not exist.', 'GetObject')
+        return {'Body': io.BytesIO(data), 'ContentLength': len(data)}
+
+    def list_objects_v2(self, Bucket, Prefix="", MaxKeys=1000, **kwargs):
+        self._request()
+        keys = self._keys(Bucket, Prefix)[:MaxKeys]
+        return {'KeyCount': len(keys), 'Contents': [{'Key': key} for key in keys]}
+
+    def put_object(self, Bucket, Key, Body=b"", **kwargs):
+        self._request()
+        self._write(Bucket, Key, Body if isinstance(Body, bytes) else Body.read())
+        return {}
+
+    def upload_fileobj(self, Fileobj, Bucket, Key, ExtraArgs=None, Callback=None, Config=None):
+        # 本地后端没有分片上传, 一次写入
+        self.put_object(Bucket=Bucket, Key=Key, Body=Fileobj.read(), **(ExtraArgs or {}))
+
+    def get_bucket_location(self, Bucket):
+        self._request()
+        return {'LocationConstraint': self.region}
+
+    def generate_presigned_url(self, ClientMethod, Params=None, ExpiresIn=3600, **kwargs):
+        return f"{self.public_url_base}{Params['Bucket']}/{Params['Key']}"
+
+
+class LocalS3Client(MemoryS3Client):
+    """
+    本地目录对象存储: 对象保存为 <root>/<bucket>/<key>
+    """
+    def __init__(self, root=S3_LOCAL_ROOT, region=None, latency=S3_LOCAL_LATENCY):
+        super().__init__(region, latency)
+        self.root = Path(root).resolve()
+        self.public_url_base = self.root.as_uri() + "/"
+
+    def _path(self, bucket, key):
+        path = (self.root / bucket / key).resolve()
+        if self.root / bucket not in path.parents:
+            raise _client_error('InvalidObjectName', f'Invalid key: {key}', 'PutObject')
+        return path
+
+    def _read(self, bucket, key):
+        try:
+            return self._path(bucket, key).read_bytes()
+        except (FileNotFoundError, IsADirectoryError):
+            return None
+
+    def _write(self, bucket, key, data):
+        path = self._path(bucket, key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # 先写临时文件再替换, 并发读取时不会看到不完整的对象
+        tmp_path = path.with_name(f".{path.name}.{threading.get_ident()}.tmp")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+
+    def _keys(self, bucket, prefix):
+        bucket_root = self.root / bucket
+        if not bucket_root.is_dir():
+            return []
+        keys = (path.relative_to(bucket_root).as_posix() for path in bucket_root.rglob("*") if path.is_file() and not path.name.startswith("."))
+        return sorted(key for key in keys if key.startswith(prefix))
+
+
+def create_s3_client(backend=None, aws_access_key_id=None, aws_secret_access_key=None, region_name=None, boto_config=None):
+    """
+    按后端名称创建 S3 客户端
+
+    Args:
+        backend: BACKENDS 中的名称, 默认为 S3_BACKEND
+        aws_access_key_id / aws_secret_access_key / region_name: boto 与 moto 后端使用
+        boto_config: botocore Config（连接池与重试）
+
+    Returns:
+        S3 客户端对象
+    """
+    backend = backend or S3_BACKEND
+    if backend == "memory":
+        return MemoryS3Client(region=region_name)
+    if backend == "local":
+        return LocalS3Client(region=region_name)
+    if backend == "moto":
+        try:
+            from moto import mock_aws
+        except ImportError:
+            try:
+                from moto import mock_s3 as mock_aws  # moto < 5
+            except ImportError:
+                raise RuntimeError("S3_BACKEND = 'moto' requires the moto package") from None
+        # 进程内模拟, 不会停止
+        mock_aws().start()
+        region_name = region_name or 'us-east-1'
+        client = boto3.client('s3', aws_access_key_id='testing', aws_secret_access_key='testing', region_name=region_name, config=boto_config)
+        create_args = {} if region_name == 'us-east-1' else {'CreateBucketConfiguration': {'LocationConstraint': region_name}}
+        client.create_bucket(Bucket=config.S3_BUCKET_NAME, **create_args)
+        return client
+    if backend == "boto":
+        return boto3.client(
+            's3',
+            aws_access_key_id=aws_access_key_id,
+            aws_secret_access_key=aws_secret_access_key,
+            region_name=region_name,
+            config=boto_config
+        )
+    raise ValueError(f"Unknown S3 backend: {backend}")
@@ -0,0 +1,344 @@
+"""
+Byte-level locking script classifier.
+
+节点 scriptPubKey.asm 中数据推送渲染为十六进制, 小整数操作码渲染为数字; 协议中按 asm 偏移定义的字段
+(如 FT 的 origin UTXO) 通过逐个操作码累计 asm 长度在字节上定位, 无需渲染整个脚本.
+"""
+import struct
+
+import base58
+
+# 操作码名称, 与节点 scriptPubKey.asm 的渲染保持一致
+OPCODE_NAMES = {
+    0x00: "0", 0x4f: "-1", 0x50: "OP_RESERVED",
+    0x61: "OP_NOP", 0x62: "OP_VER", 0x63: "OP_IF", 0x64: "OP_NOTIF", 0x65: "OP_VERIF", 0x66: "OP_VERNOTIF",
+    0x67: "OP_ELSE", 0x68: "OP_ENDIF", 0x69: "OP_VERIFY", 0x6a: "OP_RETURN",
+    0x6b: "OP_TOALTSTACK", 0x6c: "OP_FROMALTSTACK", 0x6d: "OP_2DROP", 0x6e: "OP_2DUP", 0x6f: "OP_3DUP",
+    0x70: "OP_2OVER", 0x71: "OP_2ROT", 0x72: "OP_2SWAP", 0x73: "OP_IFDUP", 0x74: "OP_DEPTH", 0x75: "OP_DROP",
+    0x76: "OP_DUP", 0x77: "OP_NIP", 0x78: "OP_OVER", 0x79: "OP_PICK", 0x7a: "OP_ROLL", 0x7b: "OP_ROT",
+    0x7c: "OP_SWAP", 0x7d: "OP_TUCK",
+    0x7e: "OP_CAT", 0x7f: "OP_SPLIT", 0x80: "OP_NUM2BIN", 0x81: "OP_BIN2NUM", 0x82: "OP_SIZE",
+    0x83: "OP_INVERT", 0x84: "OP_AND", 0x85: "OP_OR", 0x86: "OP_XOR", 0x87: "OP_EQUAL", 0x88: "OP_EQUALVERIFY",
+    0x89: "OP_RESERVED1", 0x8a: "OP_RESERVED2",
+    0x8b: "OP_1ADD", 0x8c: "OP_1SUB", 0x8d: "OP_2MUL", 0x8e: "OP_2DIV", 0x8f: "OP_NEGATE", 0x90: "OP_ABS",
+    0x91: "OP_NOT", 0x92: "OP_0NOTEQUAL", 0x93: "OP_ADD", 0x94: "OP_SUB", 0x95: "OP_MUL", 0x96: "OP_DIV",
+    0x97: "OP_MOD", 0x98: "OP_LSHIFT", 0x99: "OP_RSHIFT", 0x9a: "OP_BOOLAND", 0x9b: "OP_BOOLOR",
+    0x9c: "OP_NUMEQUAL", 0x9d: "OP_NUMEQUALVERIFY", 0x9e: "OP_NUMNOTEQUAL", 0x9f: "OP_LESSTHAN",
+    0xa0: "OP_GREATERTHAN", 0xa1: "OP_LESSTHANOREQUAL", 0xa2: "OP_GREATERTHANOREQUAL", 0xa3: "OP_MIN",
+    0xa4: "OP_MAX", 0xa5: "OP_WITHIN",
+    0xa6: "OP_RIPEMD160", 0xa7: "OP_SHA1", 0xa8: "OP_SHA256", 0xa9: "OP_HASH160", 0xaa: "OP_HASH256",
+    0xab: "OP_CODESEPARATOR", 0xac: "OP_CHECKSIG", 0xad: "OP_CHECKSIGVERIFY", 0xae: "OP_CHECKMULTISIG",
+    0xaf: "OP_CHECKMULTISIGVERIFY",
+    0xb0: "OP_NOP1", 0xb1: "OP_CHECKLOCKTIMEVERIFY", 0xb2: "OP_CHECKSEQUENCEVERIFY", 0xb3: "OP_NOP4",
+    0xb4: "OP_NOP5", 0xb5: "OP_NOP6", 0xb6: "OP_NOP7", 0xb7: "OP_NOP8", 0xb8: "OP_NOP9", 0xb9: "OP_NOP10",
+}
+OPCODE_NAMES.update({0x50 + n: str(n) for n in range(1, 17)})
+
+OP_PUSHDATA1 = 0x4c
+OP_PUSHDATA2 = 0x4d
+OP_PUSHDATA4 = 0x4e
+OP_RETURN = 0x6a
+OP_CHECKMULTISIG = 0xae
+
+P2PKH_ADDRESS_VERSION = b"\x00"
+
+# 模板前缀表: 首字节 -> [(前缀, 模板, NFT 类型)], 同一首字节下按前缀长度降序匹配
+PREFIX_TABLE = {}
+for _prefix, _template, _nft_kind in (
+    (b"\x76\xa9\x14", "pubkeyhash", None),                    # OP_DUP OP_HASH160 <20>
+    (b"\x59\x79\x6b", "ft", None),                            # 9 OP_PICK OP_TOALTSTACK
+    (b"\x6a", "nulldata", None),                              # OP_RETURN
+    (b"\x00\x6a", "nulldata", None),                          # 0 OP_RETURN
+    (b"\x51\x79\x53\x7f\x01\x20", "nft", "nft"),              # 1 OP_PICK 3 OP_SPLIT 20
+    (b"\x51\x79\x53\x7f\x77", "nft", "pool_nft"),             # 1 OP_PICK 3 OP_SPLIT OP_NIP
+    (b"\x51\x79\x53\x7f", "nft", None),                       # 1 OP_PICK 3 OP_SPLIT
+    (b"\x54\x79\x81\x6b\x51\x79\x53\x7f", "nft", "pool_nft"),  # 4 OP_PICK OP_BIN2NUM OP_TOALTSTACK 1 OP_PICK 3 OP_SPLIT
+):
+    PREFIX_TABLE.setdefault(_prefix[0], []).append((_prefix, _template, _nft_kind))
+for _entries in PREFIX_TABLE.values():
+    _entries.sort(key=lambda entry: len(entry[0]), reverse=True)
+
+POOL_SUFFIX = b"\x01\x01\x05\x32\x43\x6f\x64\x65"  # 01 32436f6465
+LEGACY_FT_SUFFIX = b"\xac\x6a\x05"                 # OP_CHECKSIG OP_RETURN <5 字节>
+
+# FT origin UTXO 在代码脚本 asm 中的位置, 新版本协议及 LP 输出通过该位置上的固定内容识别
+FT_ORIGIN_UTXO_RANGE = (2384, 2456)
+FT_ORIGIN_UTXO_RANGE_V2 = (2477, 2549)
+FT_V2_MARKER = "P OP_EQUAL OP_IF OP_FROMALTSTACK OP_DROP OP_TOALTSTACK OP_TOALTSTACK OP_"
+FT_LP_MARKER = "UALVERIFY OP_ENDIF OP_DUP 2 OP_EQUAL OP_IF OP_DROP 2 OP_PICK 2 OP_PICK O"
+
+# 模板 -> (UTXO类型, 交易类型)
+UTXO_TYPES = {
+    "ft": ("FT", "TBC20"),
+    "pool": ("FT", "TBC20"),
+    "nulldata": ("NFT_COLLECTION", "TBC721"),
+    "nft": ("NFT", "TBC721"),
+    "multisig": ("MULTISIG", "P2MS"),
+}
+
+_unpack_u16 = struct.Struct("<H").unpack_from
+_unpack_u32 = struct.Struct("<I").unpack_from
+
+
+def iter_script_ops(script):
+    """
+    遍历脚本中的操作码, 数据推送以 memoryview 切片返回, 不复制
+
+    Yields:
+        tuple: (opcode, data), 非推送操作码的 data 为 None
+    """
+    script = memoryview(script)
+    pos = 0
+    end = len(script)
+    while pos < end:
+        opcode = script[pos]
+        pos += 1
+        if 0 < opcode < OP_PUSHDATA1:
+            size = opcode
+        elif opcode == OP_PUSHDATA1:
+            size = script[pos]
+            pos += 1
+        elif opcode == OP_PUSHDATA2:
+            size = _unpack_u16(script, pos)[0]
+            pos += 2
+        elif opcode == OP_PUSHDATA4:
+            size = _unpack_u32(script, pos)[0]
+            pos += 4
+        else:
+            yield opcode, None
+            continue
+        if pos + size > end:
+            raise ValueError("Script push exceeds script length")
+        yield opcode, script[pos:pos + size]
+        pos += size
+
+
+def op_to_asm(opcode, data):
+    """
+    将单个操作码渲染为 asm, 数据推送渲染为十六进制
+    """
+    if data is not None:
+        return data.hex()
+    return OPCODE_NAMES.get(opcode, "OP_UNKNOWN")
+
+
+def script_to_asm(script):
+    """
+    将脚本渲染为与节点一致的 asm 字符串
+    """
+    return " ".join(op_to_asm(opcode, data) for opcode, data in iter_script_ops(script))
+
+
+def script_asm_prefix(script, min_length):
+    """
+    只渲染脚本开头的若干操作码, 直到 asm 长度不小于 min_length
+    """
+    parts = []
+    length = -1
+    for opcode, data in iter_script_ops(script):
+        part = op_to_asm(opcode, data)
+        parts.append(part)
+        length += len(part) + 1
+        if length >= min_length:
+            break
+    return " ".join(parts)
+
+
+def script_asm_tail(script, min_length):
+    """
+    只渲染脚本末尾的若干操作码, 直到 asm 长度不小于 min_length, 用于大脚本的尾部切片
+    """
+    ops = list(iter_script_ops(script))
+    parts = []
+    length = -1
+    for opcode, data in reversed(ops):
+        part = op_to_asm(opcode, data)
+        parts.append(part)
+        length += len(part) + 1
+        if length >= min_length:
+            break
+    return " ".join(reversed(parts))
+
+
+def _small_int(opcode):
+    if 0x51 <= opcode <= 0x60:
+        return opcode - 0x50
+    raise ValueError(f"Opcode {opcode:#x} is not a small integer")
+
+
+def p2pkh_address(pubkey_hash):
+    """
+    由公钥哈希生成 P2PKH 地址
+    """
+    return base58.b58encode_check(P2PKH_ADDRESS_VERSION + bytes(pubkey_hash)).decode("utf-8")
+
+
+def p2ms_address(script):
+    """
+    由 P2MS 锁定脚本生成多签地址, 与 convert_p2ms_script_to_ms_address 的规则一致
+    """
+    ops = list(iter_script_ops(script))
+    sig_needed_count = _small_int(ops[0][0])
+    sig_total_count = _small_int(ops[-2][0])
+    ms_pubkeys_hash = ops[-4][1]
+    if ms_pubkeys_hash is None:
+        raise ValueError("Invalid ms script")
+    version_byte = (sig_needed_count << 4) | (sig_total_count & 0x0f)
+    return base58.b58encode_check(bytes([version_byte]) + bytes(ms_pubkeys_hash)).decode("utf-8")
+
+
+class ScriptInfo:
+    """
+    输出脚本分类结果
+
+    template: "pubkeyhash"、"ft"、"pool"、"nulldata"、"nft"、"multisig" 或 None
+    nft_kind: NFT 代码脚本的类型, "nft" 或 "pool_nft", 无法识别时为 None
+    combine_script: FT 持有者组合脚本 (十六进制), 对应 hex[-54:-12]
+    legacy_ft: 错误版本的 TBC20 (代码脚本以 OP_CHECKSIG OP_RETURN <5 字节> 结尾)
+    pool_id: TBC20 Pool 合约 ID
+    tape_hex: OP_RETURN 输出的 tape 数据 (十六进制)
+    """
+    __slots__ = ("script", "asm", "template", "nft_kind", "combine_script", "legacy_ft", "pool_id", "_origin_utxo", "_tape_hex")
+
+    def __init__(self, script, asm=None, template=None, nft_kind=None):
+        self.script = script
+        self.asm = asm
+        self.template = template
+        self.nft_kind = nft_kind
+        self.combine_script = None
+        self.legacy_ft = False
+        self.pool_id = None
+        self._origin_utxo = False
+        self._tape_hex = False
+
+    @property
+    def utxo_type(self):
+        """
+        UTXO 类型: "FT"、"NFT_COLLECTION"、"NFT"、"MULTISIG" 或 "NORMAL"
+        """
+        return UTXO_TYPES.get(self.template, ("NORMAL", None))[0]
+
+    @property
+    def origin_utxo(self):
+        """
+        FT 代码脚本中的 origin UTXO, LP 输出为 "LP"; 首次访问时计算
+        """
+        if self._origin_utxo is False:
+            self._origin_utxo = self._extract_origin_utxo() if self.template in ("ft", "pool") else None
+        return self._origin_utxo
+
+    @property
+    def tape_hex(self):
+        """
+        OP_RETURN 输出的 tape 数据, 对应 asm[12:-11] (0 OP_RETURN) 或 asm[10:-10] (OP_RETURN); 首次访问时计算
+        """
+        if self._tape_hex is False:
+            self._tape_hex = None
+            if self.template == "nulldata":
+                if self.script[0] == OP_RETURN:
+                    self._tape_hex = self.asm_slice(10, -10)
+                else:
+                    self._tape_hex = self.asm_slice(12, -11)
+        return self._tape_hex
+
+    def _extract_origin_utxo(self):
+        ft_origin_utxo = self.asm_slice(*FT_ORIGIN_UTXO_RANGE)
+        # 处理新版本代币协议
+        if ft_origin_utxo == FT_V2_MARKER:
+            ft_origin_utxo = self.asm_slice(*FT_ORIGIN_UTXO_RANGE_V2)
+        # 处理 LP 输出
+        if ft_origin_utxo == FT_LP_MARKER:
+            ft_origin_utxo = "LP"
+        return ft_origin_utxo
+
+    def asm_slice(self, start, end):
+        """
+        返回 asm[start:end], 有节点 asm 时直接切片, 否则只渲染所需的部分
+        """
+        if self.asm is not None:
+            return self.asm[start:end]
+        if start >= 0 and end >= 0:
+            return script_asm_prefix(self.script, end)[start:end]
+        if start < 0 and end < 0:
+            return script_asm_tail(self.script, -start)[start:end]
+        return script_to_asm(self.script)[start:end]
+
+    def asm_element(self, index):
+        """
+        返回 asm.split(" ")[index]
+        """
+        if self.asm is not None:
+            return self.asm.split(" ")[index]
+        for i, (opcode, data) in enumerate(iter_script_ops(self.script)):
+            if i == index:
+                return op_to_asm(opcode, data)
+        raise IndexError("Script element index out of range")
+
+
+def _match_template(script):
+    length = len(script)
+    if not length:
+        return None, None
+    for prefix, template, nft_kind in PREFIX_TABLE.get(script[0], ()):
+        if script[:len(prefix)] == prefix:
+            if template == "pubkeyhash" and not (length == 25 and script[23:] == b"\x88\xac"):
+                break
+            return template, nft_kind
+    if script[-1] == OP_CHECKMULTISIG:
+        last_opcode = None
+        try:
+            for last_opcode, _ in iter_script_ops(script):
+                pass
+        except ValueError:
+            return None, None
+        if last_opcode == OP_CHECKMULTISIG:
+            return "multisig", None
+    return None, None
+
+
+def classify_script(script, asm=None):
+    """
+    根据脚本字节判断输出模板并提取协议字段, 每个输出只需调用一次
+
+    Args:
+        script: 锁定脚本字节 (bytes 或 memoryview)
+        asm: 节点返回的 asm, 提供时按 asm 偏移定义的字段直接从中切片
+
+    Returns:
+        ScriptInfo: 分类结果
+    """
+    template, nft_kind = _match_template(script)
+    info = ScriptInfo(script, asm, template, nft_kind)
+    try:
+        if template == "ft":
+            info.combine_script = bytes(script[-27:-6]).hex()
+            info.legacy_ft = script[-8:-5] == LEGACY_FT_SUFFIX
+            if script[-8:] == POOL_SUFFIX:
+                info.template = "pool"
+                # 与 asm[-53:-11] 的切片规则保持一致
+                info.pool_id = "Pool_" + info.asm_slice(-53, -11)
+    except ValueError:
+        info.template = None
+    return info
+
+
+def classify_output(output):
+    """
+    对节点返回的 JSON 输出 (vout 中的一项) 进行分类
+    """
+    script_pubkey = output.get("scriptPubKey", {})
+    return classify_script(bytes.fromhex(script_pubkey.get("hex", "")), script_pubkey.get("asm"))
+
+
+def classify_transaction(script_infos):
+    """
+    根据各输出的分类结果确定交易类型, 以第一个可识别的输出为准
+
+    Returns:
+        str: 交易类型，如 "P2PKH"、"TBC20"、"TBC721"、"P2MS"
+    """
+    for info in script_infos:
+        tx_type = UTXO_TYPES.get(info.template, (None, None))[1]
+        if tx_type is not None:
+            return tx_type
+    return "P2PKH"
@@ -0,0 +1,395 @@
+"""
+Compact in-memory TBC20 / TBC721 state: unspent FT outputs, FT balances and NFT ownership.
+
+Reads during block processing are served from memory; MySQL stays the persistence layer, written in the block transaction.
+"""
+import logging
+import sys
+from array import array
+
+from app.config import config
+from app.dependencies import DBManager
+
+# 未花费 FT 输出数上限, 超出时停用内存状态, 改为逐行查询数据库
+# 每个输出约 130 字节, 默认值使状态保持在 PM2 max_memory_restart (1G) 以内, 见 benchmarks/bench_state_memory.py
+FT_UNSPENT_INDEX_MAX_SIZE = getattr(config, "FT_UNSPENT_INDEX_MAX_SIZE", 4_000_000)
+# 加载状态时每次查询的行数
+FT_UNSPENT_INDEX_LOAD_CHUNK = getattr(config, "FT_UNSPENT_INDEX_LOAD_CHUNK", 100_000)
+
+
+def pack_hex(value):
+    """
+    十六进制字符串转换为字节（长度减半）, 无法原样还原时保留原值
+    """
+    if isinstance(value, str):
+        try:
+            packed = bytes.fromhex(value)
+        except ValueError:
+            return value
+        if packed.hex() == value:
+            return packed
+    return value
+
+
+def unpack_hex(value):
+    """
+    pack_hex 的逆操作
+    """
+    return value.hex() if isinstance(value, bytes) else value
+
+
+def utxo_key(utxo_txid, utxo_vout):
+    """
+    36 字节的紧凑 UTXO 主键: txid (32) + vout (4)
+    """
+    return bytes.fromhex(utxo_txid) + utxo_vout.to_bytes(4, "little")
+
+
+class InternTable:
+    """
+    值 <-> 整数编号 的双向表, 编号从 0 开始且不回收（合约ID、持有者组合脚本）
+
+    值以 pack_hex 后的形式保存, 21 字节的组合脚本代替 42 个字符的十六进制
+    """
+    __slots__ = ("_ids", "_values")
+
+    def __init__(self):
+        self._ids = {}
+        self._values = []
+
+    def __len__(self):
+        return len(self._values)
+
+    def id(self, value):
+        """
+        返回值的编号, 不存在时分配新编号
+        """
+        value = pack_hex(value)
+        index = self._ids.get(value)
+        if index is None:
+            index = self._ids[value] = len(self._values)
+            self._values.append(value)
+        return index
+
+    def find(self, value):
+        """
+        返回值的编号, 不存在时返回 None
+        """
+        return self._ids.get(pack_hex(value))
+
+    def value(self, index):
+        return unpack_hex(self._values[index])
+
+
+class FTUnspentSet:
+    """
+    未花费 FT 输出: 主键 -> 行号, 合约编号、持有者编号和余额分别保存在 array 列中, 删除的行号复用
+    """
+    def __init__(self, state):
+        self._state = state
+        self._rows = {}
+        self._contract = array("I")
+        self._holder = array("I")
+        self._balance = array("Q")
+        self._free = []
+
+    def __len__(self):
+        return len(self._rows)
+
+    def _insert(self, key, contract, holder, balance):
+        if self._free:
+            row = self._free.pop()
+            self._contract[row], self._holder[row], self._balance[row] = contract, holder, balance
+        else:
+            row = len(self._contract)
+            self._contract.append(contract)
+            self._holder.append(holder)
+            self._balance.append(balance)
+        self._rows[key] = row
+
+    def _remove(self, key):
+        self._free.append(self._rows.pop(key))
+
+    def get(self, utxo_txid, utxo_vout):
+        """
+        Returns:
+            tuple: (合约ID, 持有者组合脚本, 代币余额), 不是未花费的 FT 输出时返回 None
+        """
+        row = self._rows.get(utxo_key(utxo_txid, utxo_vout))
+        if row is None:
+            return None
+        return self._state.contracts.value(self._contract[row]), self._state.scripts.value(self._holder[row]), self._balance[row]
+
+    def add(self, utxo_txid, utxo_vout, ft_contract_id, holder_combine_script, ft_balance):
+        """
+        添加未花费输出（已存在时覆盖）
+        """
+        key = utxo_key(utxo_txid, utxo_vout)
+        if key in self._rows:
+            self._state.journal(self._restore, key, self.get(utxo_txid, utxo_vout))
+            self._remove(key)
+        else:
+            self._state.journal(self._remove, key)
+        self._insert(key, self._state.contracts.id(ft_contract_id), self._state.scripts.id(holder_combine_script), ft_balance or 0)
+
+    def spend(self, utxo_txid, utxo_vout):
+        """
+        移除被花费的输出
+
+        Returns:
+            tuple: 被花费输出的 (合约ID, 持有者组合脚本, 代币余额), 不是未花费的 FT 输出时返回 None
+        """
+        spent_utxo_info = self.get(utxo_txid, utxo_vout)
+        if spent_utxo_info is not None:
+            key = utxo_key(utxo_txid, utxo_vout)
+            self._remove(key)
+            self._state.journal(self._restore, key, spent_utxo_info)
+        return spent_utxo_info
+
+    def _restore(self, key, spent_utxo_info):
+        if key in self._rows:
+            self._remove(key)
+        ft_contract_id, holder_combine_script, ft_balance = spent_utxo_info
+        self._insert(key, self._state.contracts.id(ft_contract_id), self._state.scripts.id(holder_combine_script), ft_balance)
+
+
+class FTBalanceMap:
+    """
+    FT 余额: (持有者编号 << 32 | 合约编号) -> 余额
+    """
+    def __init__(self, state):
+        self._state = state
+        self._balances = {}
+
+    def __len__(self):
+        return len(self._balances)
+
+    def _key(self, holder_combine_script, ft_contract_id, create=False):
+        if create:
+            return self._state.scripts.id(holder_combine_script) << 32 | self._state.contracts.id(ft_contract_id)
+        holder = self._state.scripts.find(holder_combine_script)
+        contract = self._state.contracts.find(ft_contract_id)
+        if holder is None or contract is None:
+            return None
+        return holder << 32 | contract
+
+    def get(self, holder_combine_script, ft_contract_id):
+        """
+        返回余额, 没有记录时返回 None
+        """
+        key = self._key(holder_combine_script, ft_contract_id)
+        return None if key is None else self._balances.get(key)
+
+    def set(self, holder_combine_script, ft_contract_id, ft_balance):
+        """
+        设置余额, ft_balance 为 None 时删除记录
+        """
+        key = self._key(holder_combine_script, ft_contract_id, create=ft_balance is not None)
+        if key is None:
+            return
+        self._state.journal(self._put, key, self._balances.get(key))
+        self._put(key, ft_balance)
+
+    def _put(self, key, ft_balance):
+        if ft_balance is None:
+            self._balances.pop(key, None)
+        else:
+            self._balances[key] = ft_balance
+
+
+class NFTOwner:
+    """
+    NFT 当前所在的 UTXO 与持有者（nft_utxo_set 中转移时更新的列）
+    """
+    __slots__ = ("nft_utxo_id", "nft_code_balance", "nft_p2pkh_balance", "nft_holder_address", "nft_holder_script_hash",
+                 "nft_last_transfer_timestamp", "nft_transfer_time_count")
+
+    def __init__(self, *values):
+        for column, value in zip(self.__slots__, values):
+            setattr(self, column, value)
+
+    def values(self):
+        return tuple(getattr(self, column) for column in self.__slots__)
+
+
+class NFTOwnership:
+    """
+    NFT 合约ID -> NFTOwner, 以及 nft_utxo_id -> NFT 合约ID 的反查（Pool NFT 转移时按输入查找）
+
+    同一交易转移的多个 NFT 具有相同的 nft_utxo_id, 反查的值为单个合约ID, 有多个时为合约ID集合
+    合约ID、UTXO ID 与脚本哈希以字节保存, 持有者地址驻留（同一持有者的多个 NFT 共用一个字符串）
+    """
+    def __init__(self, state):
+        self._state = state
+        self._owners = {}
+        self._by_utxo = {}
+
+    def __len__(self):
+        return len(self._owners)
+
+    def get(self, nft_contract_id):
+        """
+        Returns:
+            dict: {列: 值}, 不存在时返回 None
+        """
+        owner = self._owners.get(pack_hex(nft_contract_id))
+        if owner is None:
+            return None
+        return dict(zip(NFTOwner.__slots__, map(unpack_hex, owner.values())))
+
+    def find_by_utxo(self, nft_utxo_id):
+        """
+        返回当前位于 nft_utxo_id 的 NFT 合约ID, 不存在时返回 None; 有多个时返回最小的（与按索引顺序查询数据库时相同）
+        """
+        nft_contract_id = self._by_utxo.get(pack_hex(nft_utxo_id))
+        if isinstance(nft_contract_id, set):
+            nft_contract_id = min(nft_contract_id)
+        return None if nft_contract_id is None else unpack_hex(nft_contract_id)
+
+    def set(self, nft_contract_id, values, create=True):
+        """
+        写入 NFT 的当前持有信息
+
+        Args:
+            values: {列: 值}, 只更新其中的列
+            create: 不存在时是否新建（铸造）; 为 False 时只更新已有的 NFT（转移）
+        """
+        key = pack_hex(nft_contract_id)
+        owner = self._owners.get(key)
+        if owner is None and not create:
+            return
+        self._state.journal(self._put, key, None if owner is None else owner.values())
+        values = {column: pack_hex(value) for column, value in values.items()}
+        if "nft_holder_address" in values and isinstance(values["nft_holder_address"], str):
+            values["nft_holder_address"] = sys.intern(values["nft_holder_address"])
+        new_values = owner.values() if owner is not None else (None,) * len(NFTOwner.__slots__)
+        self._put(key, tuple(values.get(column, old) for column, old in zip(NFTOwner.__slots__, new_values)))
+
+    def _link(self, nft_utxo_id, key):
+        linked = self._by_utxo.get(nft_utxo_id)
+        if linked is None:
+            self._by_utxo[nft_utxo_id] = key
+        elif isinstance(linked, set):
+            linked.add(key)
+        elif linked != key:
+            self._by_utxo[nft_utxo_id] = {linked, key}
+
+    def _unlink(self, nft_utxo_id, key):
+        linked = self._by_utxo.get(nft_utxo_id)
+        if isinstance(linked, set):
+            linked.discard(key)
+            if len(linked) == 1:
+                self._by_utxo[nft_utxo_id] = linked.pop()
+        elif linked == key:
+            del self._by_utxo[nft_utxo_id]
+
+    def _put(self, key, values):
+        owner = self._owners.pop(key, None)
+        if owner is not None and owner.nft_utxo_id is not None:
+            self._unlink(owner.nft_utxo_id, key)
+        if values is not None:
+            owner = self._owners[key] = NFTOwner(*values)
+            if owner.nft_utxo_id is not None:
+                self._link(owner.nft_utxo_id, key)
+
+
+class StateEngine:
+    """
+    TBC20 / TBC721 的内存状态
+
+    启动时从数据库加载; 区块处理中的修改立即生效并记录逆操作, 区块提交后 commit 清空, 事务回滚时 discard 撤销。
+    链重组回滚数据库后需重新 load。未花费 FT 输出超过上限时停用（loaded 为 False）, 处理函数回退为查询数据库
+    """
+    def __init__(self, max_ft_outputs=FT_UNSPENT_INDEX_MAX_SIZE, load_chunk=FT_UNSPENT_INDEX_LOAD_CHUNK):
+        self.max_ft_outputs = max_ft_outputs
+        self.load_chunk = load_chunk
+        self.loaded = False
+        self._undo = []
+        self._reset()
+
+    def _reset(self):
+        self.contracts = InternTable()
+        self.scripts = InternTable()
+        self.ft_unspent = FTUnspentSet(self)
+        self.ft_balances = FTBalanceMap(self)
+        self.nft_owners = NFTOwnership(self)
+        self._undo = []
+
+    def journal(self, func, *args):
+        """
+        记录当前区块中一项修改的逆操作
+        """
+        if self.loaded:
+            self._undo.append((func, args))
+
+    def commit(self):
+        """
+        区块事务提交后清空逆操作
+        """
+        self._undo = []
+        if len(self.ft_unspent) > self.max_ft_outputs:
+            self._disable()
+
+    def discard(self):
+        """
+        撤销当前区块的修改（区块事务回滚时使用）
+        """
+        undo, self._undo = self._undo, []
+        for func, args in reversed(undo):
+            func(*args)
+
+    def _disable(self):
+        logging.warning("未花费 FT 输出超过上限 %s, 停用内存状态, 改为逐行查询数据库", self.max_ft_outputs)
+        self.loaded = False
+        self._reset()
+
+    async def _iter_rows(self, table, columns, key_columns, where=""):
+        # 按主键分批读取全表
+        last_key = None
+        while True:
+            conditions = [where] if where else []
+            params = []
+            if last_key is not None:
+                conditions.append(f"({', '.join(key_columns)}) > ({', '.join(['%s'] * len(key_columns))})")
+                params.extend(last_key)
+            query = f"SELECT {', '.join(columns)} FROM {table}"
+            if conditions:
+                query += " WHERE " + " AND ".join(conditions)
+            query += f" ORDER BY {', '.join(key_columns)} LIMIT %s"
+            rows = await DBManager.execute_query(query, (*params, self.load_chunk))
+            for row in rows:
+                yield row
+            if len(rows) < self.load_chunk:
+                return
+            last_key = rows[-1][:len(key_columns)]
+
+    async def load(self):
+        """
+        从数据库加载全部状态（使用独立连接, 只包含已提交的数据; 在区块之间调用）
+        """
+        self.loaded = False
+        self._reset()
+
+        async for utxo_txid, utxo_vout, ft_contract_id, holder_combine_script, ft_balance in self._iter_rows(
+                "ft_txo_set", ("utxo_txid", "utxo_vout", "ft_contract_id", "ft_holder_combine_script", "ft_balance"),
+                ("utxo_txid", "utxo_vout"), "if_spend = 0"):
+            self.ft_unspent.add(utxo_txid, utxo_vout, ft_contract_id, holder_combine_script, ft_balance)
+            if len(self.ft_unspent) > self.max_ft_outputs:
+                self._disable()
+                return
+
+        async for holder_combine_script, ft_contract_id, ft_balance in self._iter_rows(
+                "ft_balance", ("ft_holder_combine_script", "ft_contract_id", "ft_balance"),
+                ("ft_holder_combine_script", "ft_contract_id")):
+            self.ft_balances.set(holder_combine_script, ft_contract_id, ft_balance or 0)
+
+        async for nft_contract_id, *values in self._iter_rows(
+                "nft_utxo_set", ("nft_contract_id",) + NFTOwner.__slots__, ("nft_contract_id",)):
+            self.nft_owners.set(nft_contract_id, dict(zip(NFTOwner.__slots__, values)))
+
+        self.loaded = True
+        logging.info("已加载内存状态: %s 个未花费 FT 输出, %s 条 FT 余额, %s 个 NFT, %s 个合约, %s 个持有者脚本",
+                     len(self.ft_unspent), len(self.ft_balances), len(self.nft_owners), len(self.contracts), len(self.scripts))
+
+
+state = StateEngine()
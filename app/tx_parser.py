@@ -0,0 +1,189 @@
+"""
+Raw transaction / block parser built on memoryview.
+"""
+import hashlib
+import struct
+
+from app.script_classifier import classify_script, p2pkh_address, p2ms_address
+
+_unpack_u16 = struct.Struct("<H").unpack_from
+_unpack_u32 = struct.Struct("<I").unpack_from
+_unpack_u64 = struct.Struct("<Q").unpack_from
+
+
+def read_varint(data, pos):
+    """
+    读取 CompactSize 变长整数
+
+    Returns:
+        tuple: (数值, 新的偏移量)
+    """
+    first = data[pos]
+    if first < 0xfd:
+        return first, pos + 1
+    if first == 0xfd:
+        return _unpack_u16(data, pos + 1)[0], pos + 3
+    if first == 0xfe:
+        return _unpack_u32(data, pos + 1)[0], pos + 5
+    return _unpack_u64(data, pos + 1)[0], pos + 9
+
+
+class TxInput:
+    """
+    交易输入: txid 为被花费交易的 txid (十六进制), coinbase 输入的 txid 为 None
+    """
+    __slots__ = ("txid", "vout", "script_sig", "sequence")
+
+    def __init__(self, txid, vout, script_sig, sequence):
+        self.txid = txid
+        self.vout = vout
+        self.script_sig = script_sig
+        self.sequence = sequence
+
+    @property
+    def is_coinbase(self):
+        return self.txid is None
+
+
+class TxOutput:
+    """
+    交易输出: value 为整数聪, script 为原始锁定脚本 (memoryview), info 为脚本分类结果 (ScriptInfo)
+    """
+    __slots__ = ("value", "script", "info", "_address")
+
+    def __init__(self, value, script):
+        self.value = value
+        self.script = script
+        self.info = classify_script(script)
+        self._address = False
+
+    @property
+    def template(self):
+        return self.info.template
+
+    @property
+    def address(self):
+        """
+        输出的地址 (P2PKH / P2MS) 或 Pool ID, 其他模板返回 None; 首次访问时计算
+        """
+        if self._address is False:
+            self._address = self._derive_address()
+        return self._address
+
+    def _derive_address(self):
+        try:
+            if self.template == "pubkeyhash":
+                return p2pkh_address(self.script[3:23])
+            if self.template == "multisig":
+                return p2ms_address(self.script)
+            if self.template == "pool":
+                return self.info.pool_id
+        except (ValueError, IndexError):
+            return None
+        return None
+
+
+class Transaction:
+    """
+    解析后的交易, raw 为交易原始字节 (memoryview)
+    """
+    __slots__ = ("txid", "version", "inputs", "outputs", "locktime", "raw")
+
+    def __init__(self, txid, version, inputs, outputs, locktime, raw):
+        self.txid = txid
+        self.version = version
+        self.inputs = inputs
+        self.outputs = outputs
+        self.locktime = locktime
+        self.raw = raw
+
+
+def compute_txid(raw):
+    """
+    按标准序列化计算 txid (双 SHA256, 字节反序)
+    """
+    return hashlib.sha256(hashlib.sha256(raw).digest()).digest()[::-1].hex()
+
+
+def parse_transaction(data, pos=0, txid=None):
+    """
+    从 data 的 pos 处解析一笔交易, 脚本均为 data 的切片, 不复制
+
+    Args:
+        data: 原始字节 (bytes 或 memoryview)
+        pos: 起始偏移
+        txid: 交易 txid, 节点已返回时直接传入以免重复计算哈希
+
+    Returns:
+        tuple: (Transaction, 交易结束后的偏移)
+    """
+    data = memoryview(data)
+    start = pos
+    version = _unpack_u32(data, pos)[0]
+    pos += 4
+
+    input_count, pos = read_varint(data, pos)
+    inputs = []
+    for _ in range(input_count):
+        prev_hash = data[pos:pos + 32]
+        prev_vout = _unpack_u32(data, pos + 32)[0]
+        pos += 36
+        script_size, pos = read_varint(data, pos)
+        script_sig = data[pos:pos + script_size]
+        pos += script_size
+        sequence = _unpack_u32(data, pos)[0]
+        pos += 4
+        if prev_vout == 0xffffffff and prev_hash == bytes(32):
+            prev_txid = None
+        else:
+            prev_txid = bytes(prev_hash[::-1]).hex()
+        inputs.append(TxInput(prev_txid, prev_vout, script_sig, sequence))
+
+    output_count, pos = read_varint(data, pos)
+    outputs = []
+    for _ in range(output_count):
+        value = _unpack_u64(data, pos)[0]
+        pos += 8
+        script_size, pos = read_varint(data, pos)
+        outputs.append(TxOutput(value, data[pos:pos + script_size]))
+        pos += script_size
+
+    locktime = _unpack_u32(data, pos)[0]
+    pos += 4
+    if pos > len(data):
+        raise ValueError("Transaction exceeds data length")
+
+    raw = data[start:pos]
+    if txid is None:
+        txid = compute_txid(raw)
+    return Transaction(txid, version, inputs, outputs, locktime, raw), pos
+
+
+def parse_transaction_hex(tx_hex, txid=None):
+    """
+    解析 getrawtransaction (verbose=0) 返回的十六进制交易
+    """
+    tx, _ = parse_transaction(bytes.fromhex(tx_hex), 0, txid)
+    return tx
+
+
+def parse_block(data, txids=None):
+    """
+    解析原始区块 (80 字节区块头 + 交易列表)
+
+    Args:
+        data: 区块原始字节
+        txids: 节点返回的 txid 列表 (与区块内交易顺序一致), 为 None 时自行计算
+
+    Returns:
+        list: Transaction 列表
+    """
+    data = memoryview(data)
+    tx_count, pos = read_varint(data, 80)
+    if txids is not None and len(txids) != tx_count:
+        raise ValueError(f"Block has {tx_count} transactions but {len(txids)} txids were given")
+    transactions = []
+    for i in range(tx_count):
+        tx, pos = parse_transaction(data, pos, txids[i] if txids is not None else None)
+        transactions.append(tx)
+    return transactions
@@ -0,0 +1,117 @@
+"""
+Local compact UTXO store for input resolution.
+"""
+import logging
+import sqlite3
+
+from app.config import config
+from app.prevout_cache import Prevout, extract_prevout
+
+UTXO_STORE_PATH = getattr(config, "UTXO_STORE_PATH", "utxo_store.sqlite")
+
+# 脚本类型以整数存储以压缩体积
+SCRIPT_TYPE_CODES = {None: 0, "pubkeyhash": 1, "multisig": 2, "pool": 3}
+SCRIPT_TYPE_NAMES = {code: name for name, code in SCRIPT_TYPE_CODES.items()}
+
+
+class UTXOStore:
+    """
+    基于 SQLite 的本地未花费输出索引: (txid, vout) -> (value, script_type, address)
+    """
+    def __init__(self, path=UTXO_STORE_PATH):
+        self.path = path
+        self._conn = None
+
+    def open(self):
+        """
+        打开存储文件, 不存在时创建
+        """
+        if self._conn is not None:
+            return
+        self._conn = sqlite3.connect(self.path)
+        self._conn.execute("PRAGMA journal_mode = WAL")
+        self._conn.execute("PRAGMA synchronous = NORMAL")
+        self._conn.execute("""
+        CREATE TABLE IF NOT EXISTS prevouts (
+            txid BLOB NOT NULL,
+            vout INTEGER NOT NULL,
+            value INTEGER NOT NULL,
+            script_type INTEGER NOT NULL,
+            address TEXT,
+            PRIMARY KEY (txid, vout)
+        ) WITHOUT ROWID
+        """)
+        self._conn.execute("""
+        CREATE TABLE IF NOT EXISTS meta (
+            name TEXT PRIMARY KEY,
+            value TEXT
+        )
+        """)
+        self._conn.commit()
+        logging.info("UTXO store opened: %s", self.path)
+
+    def close(self):
+        """
+        提交并关闭存储文件
+        """
+        if self._conn is not None:
+            self._conn.commit()
+            self._conn.close()
+            self._conn = None
+
+    def get(self, txid, vout):
+        """
+        查询 (txid, vout) 对应的输出信息
+
+        Returns:
+            Prevout: 输出信息, 不存在时返回 None
+        """
+        row = self._conn.execute(
+            "SELECT value, script_type, address FROM prevouts WHERE txid = ? AND vout = ?",
+            (bytes.fromhex(txid), vout)
+        ).fetchone()
+        if row is None:
+            return None
+        return Prevout(row[0], SCRIPT_TYPE_NAMES.get(row[1]), row[2])
+
+    def add_transactions(self, txs):
+        """
+        写入已解析交易的所有输出
+        """
+        rows = []
+        for tx in txs:
+            txid = bytes.fromhex(tx.txid)
+            for vout, output in enumerate(tx.outputs):
+                prevout = extract_prevout(output)
+                rows.append((txid, vout, prevout.value, SCRIPT_TYPE_CODES[prevout.script_type], prevout.address))
+        self._conn.executemany("INSERT OR REPLACE INTO prevouts VALUES (?, ?, ?, ?, ?)", rows)
+
+    def spend_transactions(self, txs):
+        """
+        删除已解析交易的输入所花费的输出
+        """
+        keys = [
+            (bytes.fromhex(vin.txid), vin.vout)
+            for tx in txs
+            for vin in tx.inputs
+            if not vin.is_coinbase
+        ]
+        self._conn.executemany("DELETE FROM prevouts WHERE txid = ? AND vout = ?", keys)
+
+    def get_height(self):
+        """
+        获取已写入存储的最高区块高度
+        """
+        row = self._conn.execute("SELECT value FROM meta WHERE name = 'height'").fetchone()
+        return int(row[0]) if row else None
+
+    def commit(self, height=None):
+        """
+        提交当前写入, 可同时记录已处理的区块高度
+        """
+        if height is not None:
+            self._conn.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('height', ?)", (str(height),))
+        self._conn.commit()
+
+
+utxo_store = UTXOStore()
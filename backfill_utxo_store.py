@@ -0,0 +1,51 @@
+import argparse
+import asyncio
+import logging
+
+from app.dependencies import syclic_call_rpc
+from app.dependencies import RPCManager
+from app.utxo_store import utxo_store
+from app.block_prefetcher import block_prefetcher
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+async def backfill(from_height, to_height=None):
+    """
+    从指定高度开始逐块构建本地 UTXO 存储
+
+    Args:
+        from_height: 起始区块高度
+        to_height: 结束区块高度（包含），为 None 时处理到当前最新区块
+    """
+    await RPCManager.init_session()
+    block_prefetcher.fetch_mode = "raw"
+    utxo_store.open()
+    try:
+        if to_height is None:
+            to_height = await syclic_call_rpc(method="getblockcount", params=[])
+        logging.info("开始构建本地 UTXO 存储: %s -> %s", from_height, to_height)
+
+        for height in range(from_height, to_height + 1):
+            _, txs = await block_prefetcher.fetch_block(height)
+
+            # 先写入输出再删除输入, 同一区块内创建并花费的输出不会残留
+            utxo_store.add_transactions(txs)
+            utxo_store.spend_transactions(txs)
+            utxo_store.commit(height=height)
+
+            if height % 100 == 0:
+                logging.info("UTXO 存储已构建到高度: %s", height)
+    finally:
+        utxo_store.close()
+        await RPCManager.close_session()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backfill the local UTXO store used by transactions_index.py")
+    parser.add_argument("--from-height", type=int, required=True, help="起始区块高度")
+    parser.add_argument("--to-height", type=int, default=None, help="结束区块高度（默认最新区块）")
+    args = parser.parse_args()
+
+    asyncio.run(backfill(args.from_height, args.to_height))
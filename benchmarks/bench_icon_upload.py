@@ -0,0 +1,222 @@
+"""
+Benchmark: icon upload path (process_nft_collections / process_nft_utxo_set -> IconUploadQueue -> S3Uploader) per storage backend.
+
+Replays synthetic collection and NFT mint transactions in blocks, with the database replaced by an in-process table
+so only the icon path is measured. Reports uploaded icons/sec and event-loop stalls (how late a 1 ms timer fires).
+
+Usage:
+    python -m benchmarks.bench_icon_upload [--backends memory,local,moto] [--collections 20] [--nfts-per-collection 50]
+                                           [--unique-ratio 0.5] [--icon-kb 32] [--latency-ms 20] [--block-size 100]
+"""
+import argparse
+import asyncio
+import base64
+import contextlib
+import json
+import os
+import tempfile
+import time
+
+from app.dependencies import DBManager
+from app.db.nft_collections import process_nft_collections
+from app.db.nft_utxo_set import process_nft_utxo_set
+from app.db.undo_journal import undo_journal
+from app.icon_index import IconIndex
+from app.icon_upload import IconUploadQueue
+from app.script_classifier import classify_output
+from app.s3 import s3_uploader
+from app.s3_backends import BACKENDS, MemoryS3Client, LocalS3Client, create_s3_client
+import app.db.nft_collections as nft_collections_module
+import app.db.nft_utxo_set as nft_utxo_set_module
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+TAPE_SUFFIX = " 4e54617065"
+
+
+def _txid():
+    return os.urandom(32).hex()
+
+
+def _p2pkh_output(value=0.000001):
+    pubkey_hash = os.urandom(20).hex()
+    return {"value": value, "scriptPubKey": {"hex": f"76a914{pubkey_hash}88ac", "asm": f"OP_DUP OP_HASH160 {pubkey_hash} OP_EQUALVERIFY OP_CHECKSIG",
+                                             "addresses": ["1" + pubkey_hash[:33]]}}
+
+
+def _tape_output(tape):
+    tape_hex = json.dumps(tape).encode().hex()
+    return {"value": 0, "scriptPubKey": {"hex": "006a" + tape_hex, "asm": f"0 OP_RETURN {tape_hex}{TAPE_SUFFIX}"}}
+
+
+def _nft_code_output():
+    # 1 OP_PICK 3 OP_SPLIT 20 ...
+    return {"value": 0.0002, "scriptPubKey": {"hex": "5179537f0120" + os.urandom(32).hex()}}
+
+
+def build_corpus(collections, nfts_per_collection, unique_ratio, icon_kb):
+    """
+    生成交易列表: 每个集合一笔创建交易, 其后为从该集合铸造的 NFT（一半使用集合图标, 一半使用自己的图标）
+
+    Returns:
+        list: (decode_tx, 输出类型) 列表, 输出类型为 "collection" 或 "nft"
+    """
+    images = []
+    icon_count = 0
+
+    def icon():
+        # 不同图片占 unique_ratio, 其余重复使用已有图片
+        nonlocal icon_count
+        if len(images) <= icon_count * unique_ratio:
+            images.append("data:image/png;base64," + base64.b64encode(PNG_SIGNATURE + os.urandom(icon_kb * 1024)).decode())
+            value = images[-1]
+        else:
+            value = images[icon_count % len(images)]
+        icon_count += 1
+        return value
+
+    corpus = []
+    for _ in range(collections):
+        collection_txid = _txid()
+        tape = {"collectionName": "bench", "symbol": "B", "description": "", "supply": nfts_per_collection, "file": icon()}
+        decode_tx = {"txid": collection_txid, "vin": [{"txid": _txid(), "vout": 0, "scriptSig": {"hex": "00"}}],
+                     "vout": [_tape_output(tape), _p2pkh_output()]}
+        corpus.append((decode_tx, "collection"))
+        for n in range(nfts_per_collection):
+            if n % 2:
+                nft_file = collection_txid + "00000000"
+            else:
+                nft_file = icon()
+            tape = {"nftName": f"bench #{n}", "symbol": "B", "description": "", "file": nft_file}
+            decode_tx = {"txid": _txid(), "vin": [{"txid": collection_txid, "vout": n, "scriptSig": {"hex": "00"}}],
+                         "vout": [_nft_code_output(), _p2pkh_output(), _tape_output(tape)]}
+            corpus.append((decode_tx, "nft"))
+    return corpus, len(images)
+
+
+class MemoryTables:
+    """
+    进程内代替 MySQL: 只保存集合信息（铸造 NFT 时查询）并统计语句数
+
+    每条语句让出一次事件循环, 与 aiomysql 等待数据库响应时相同
+    """
+    def __init__(self):
+        self.collections = {}
+        self.statements = 0
+
+    async def execute_update_nocommit(self, conn, query, params=None):
+        self.statements += 1
+        await asyncio.sleep(0)
+        if "INSERT INTO nft_collections" in query:
+            self.collections[params[0]] = (params[0], params[7], params[1], params[9])
+        return 1
+
+    async def execute_query_with_conn(self, conn, query, params=None):
+        self.statements += 1
+        await asyncio.sleep(0)
+        if "FROM nft_collections" in query:
+            record = self.collections.get(params[0])
+            return [record] if record else []
+        return []
+
+    async def execute_query(self, query, params=None):
+        return []
+
+    @contextlib.asynccontextmanager
+    async def transaction(self):
+        yield None
+
+
+def install_tables(tables):
+    for name in ("execute_update_nocommit", "execute_query_with_conn", "execute_query", "transaction"):
+        setattr(DBManager, name, getattr(tables, name))
+
+
+async def monitor_loop(stalls, interval=0.001):
+    # 记录定时器的延迟: 事件循环被阻塞时延迟增大
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        stalls.append(loop.time() - expected)
+
+
+async def run_backend(name, client, corpus, block_size, workers):
+    s3_uploader.set_client(client)
+    install_tables(MemoryTables())
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        queue = IconUploadQueue(workers=workers, index=IconIndex(os.path.join(tmp_dir, "icon_index.sqlite")))
+        # 处理函数通过模块中的 icon_upload_queue 登记上传
+        nft_collections_module.icon_upload_queue = queue
+        nft_utxo_set_module.icon_upload_queue = queue
+
+        stalls = []
+        monitor = asyncio.create_task(monitor_loop(stalls))
+        start = time.perf_counter()
+        await queue.start()
+        for offset in range(0, len(corpus), block_size):
+            for decode_tx, kind in corpus[offset:offset + block_size]:
+                script_infos = [classify_output(output) for output in decode_tx["vout"]]
+                if kind == "collection":
+                    await process_nft_collections(None, decode_tx, 0, 0, script_infos)
+                else:
+                    await process_nft_utxo_set(None, decode_tx, 0, 0, script_infos)
+            undo_journal.discard()
+            await queue.release()
+        await queue.stop()
+        elapsed = time.perf_counter() - start
+        monitor.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await monitor
+
+    stalls.sort()
+    return {
+        "elapsed": elapsed,
+        "stall_max": stalls[-1] if stalls else 0,
+        "stall_p99": stalls[int(len(stalls) * 0.99)] if stalls else 0,
+        "stall_total": sum(stall for stall in stalls if stall > 0.005),
+        "requests": getattr(client, "requests", None),
+    }
+
+
+def make_client(name, latency, tmp_dir):
+    if name == "memory":
+        return MemoryS3Client(latency=latency)
+    if name == "local":
+        return LocalS3Client(root=os.path.join(tmp_dir, "s3"), latency=latency)
+    return create_s3_client(name)
+
+
+async def main_async(args):
+    corpus, unique_icons = build_corpus(args.collections, args.nfts_per_collection, args.unique_ratio, args.icon_kb)
+    print(f"transactions: {len(corpus)}, unique icons: {unique_icons} x {args.icon_kb} KiB, "
+          f"latency: {args.latency_ms} ms/request, workers: {args.workers}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name in args.backends.split(","):
+            try:
+                client = make_client(name, args.latency_ms / 1000, tmp_dir)
+            except RuntimeError as e:
+                print(f"{name:>7}: skipped ({e})")
+                continue
+            result = await run_backend(name, client, corpus, args.block_size, args.workers)
+            requests = "" if result["requests"] is None else f", {result['requests']} requests"
+            print(f"{name:>7}: {result['elapsed'] * 1000:8.1f} ms  ({unique_icons / result['elapsed']:,.0f} icons/s{requests})  "
+                  f"loop stall max {result['stall_max'] * 1000:.1f} ms, p99 {result['stall_p99'] * 1000:.1f} ms, "
+                  f"total >5ms {result['stall_total'] * 1000:.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", default="memory,local", help=f"逗号分隔的后端: {', '.join(BACKENDS)}（boto 会访问真实的 S3）")
+    parser.add_argument("--collections", type=int, default=20, help="集合数量")
+    parser.add_argument("--nfts-per-collection", type=int, default=50, help="每个集合铸造的 NFT 数量")
+    parser.add_argument("--unique-ratio", type=float, default=0.5, help="不同图片占图标总数的比例")
+    parser.add_argument("--icon-kb", type=int, default=32, help="图片大小 (KiB)")
+    parser.add_argument("--latency-ms", type=float, default=20, help="memory/local 后端每个请求的模拟延迟")
+    parser.add_argument("--block-size", type=int, default=100, help="每个区块的交易数")
+    parser.add_argument("--workers", type=int, default=4, help="上传工作协程数")
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
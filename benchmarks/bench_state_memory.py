@@ -0,0 +1,114 @@
+"""
+Benchmark: memory footprint of the in-memory FT / NFT state (app.state) vs. keeping the rows as returned by MySQL.
+
+Sizes default to rough mainnet estimates; pass the real counts from
+    SELECT COUNT(*) FROM ft_txo_set WHERE if_spend = 0;
+    SELECT COUNT(*) FROM ft_balance;
+    SELECT COUNT(DISTINCT ft_holder_combine_script) FROM ft_balance;
+    SELECT COUNT(*) FROM ft_tokens;
+    SELECT COUNT(*) FROM nft_utxo_set;
+
+Usage:
+    python -m benchmarks.bench_state_memory [--ft-utxos 2000000] [--ft-balances 500000] [--holders 300000]
+                                            [--contracts 2000] [--nfts 200000] [--limit-mb 1024]
+"""
+import argparse
+import gc
+import os
+import random
+import time
+import tracemalloc
+
+from app.state import StateEngine, NFTOwner
+
+
+def build_rows(args):
+    """
+    生成三张表的行; 字符串列以 bytes 保存, 加载时再解码, 与数据库驱动为每行创建新字符串相同
+    """
+    rng = random.Random(1)
+    contracts = [os.urandom(32) for _ in range(args.contracts)]
+    holders = [os.urandom(21) for _ in range(args.holders)]
+    ft_utxos = [(os.urandom(32), rng.randrange(4), rng.choice(contracts), rng.choice(holders), rng.randrange(1, 10 ** 12))
+                for _ in range(args.ft_utxos)]
+    balance_keys = {(rng.choice(holders), rng.choice(contracts)) for _ in range(args.ft_balances)}
+    ft_balances = [(holder, contract, rng.randrange(1, 10 ** 12)) for holder, contract in balance_keys]
+    addresses = [b"1" + os.urandom(16).hex()[:33].encode() for _ in range(max(1, args.nfts // 5))]
+    nfts = [(os.urandom(32), os.urandom(32), 200, 100, rng.choice(addresses), os.urandom(32), 1700000000, rng.randrange(10))
+            for _ in range(args.nfts)]
+    return ft_utxos, ft_balances, nfts
+
+
+def iter_rows(ft_utxos, ft_balances, nfts):
+    # 按 MySQL 返回的格式解码: 十六进制字符串 + 整数
+    return (
+        ((txid.hex(), vout, contract.hex(), holder.hex(), balance) for txid, vout, contract, holder, balance in ft_utxos),
+        ((holder.hex(), contract.hex(), balance) for holder, contract, balance in ft_balances),
+        ((nft_id.hex(), utxo_id.hex(), code, p2pkh, address.decode(), script_hash.hex(), timestamp, count)
+         for nft_id, utxo_id, code, p2pkh, address, script_hash, timestamp, count in nfts),
+    )
+
+
+def load_rows(ft_utxos, ft_balances, nfts):
+    # 直接缓存查询结果: 主键元组 -> 行元组
+    ft_utxo_rows, ft_balance_rows, nft_rows = iter_rows(ft_utxos, ft_balances, nfts)
+    return (
+        {(row[0], row[1]): row[2:] for row in ft_utxo_rows},
+        {(row[0], row[1]): row[2] for row in ft_balance_rows},
+        {row[0]: row[1:] for row in nft_rows},
+    )
+
+
+def load_state(ft_utxos, ft_balances, nfts):
+    ft_utxo_rows, ft_balance_rows, nft_rows = iter_rows(ft_utxos, ft_balances, nfts)
+    state = StateEngine(max_ft_outputs=len(ft_utxos) + 1)
+    for row in ft_utxo_rows:
+        state.ft_unspent.add(*row)
+    for row in ft_balance_rows:
+        state.ft_balances.set(*row)
+    for nft_contract_id, *values in nft_rows:
+        state.nft_owners.set(nft_contract_id, dict(zip(NFTOwner.__slots__, values)))
+    return state
+
+
+def measure(func, *args):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ft-utxos", type=int, default=2_000_000, help="未花费 FT 输出数")
+    parser.add_argument("--ft-balances", type=int, default=500_000, help="FT 余额记录数")
+    parser.add_argument("--holders", type=int, default=300_000, help="不同的持有者组合脚本数")
+    parser.add_argument("--contracts", type=int, default=2_000, help="FT 合约数")
+    parser.add_argument("--nfts", type=int, default=200_000, help="NFT 数")
+    parser.add_argument("--limit-mb", type=int, default=1024, help="内存上限 (ecosystem.config.js max_memory_restart)")
+    args = parser.parse_args()
+
+    ft_utxos, ft_balances, nfts = build_rows(args)
+    entries = len(ft_utxos) + len(ft_balances) + len(nfts)
+    print(f"ft utxos: {len(ft_utxos):,}, ft balances: {len(ft_balances):,}, nfts: {len(nfts):,}")
+
+    results = {}
+    for name, func in (("rows", load_rows), ("state", load_state)):
+        result, size, elapsed = measure(func, ft_utxos, ft_balances, nfts)
+        results[name] = size
+        print(f"{name:>6}: {size / 2 ** 20:8.1f} MiB  ({size / entries:5.0f} B/entry, load {elapsed:.1f} s)")
+        del result
+
+    state_mb = results["state"] / 2 ** 20
+    print(f"reduction: {results['rows'] / results['state']:.2f}x")
+    print(f"state within {args.limit_mb} MiB limit: {'yes' if state_mb < args.limit_mb else 'no'} "
+          f"({args.limit_mb - state_mb:.0f} MiB left for the interpreter, buffers and caches)")
+
+
+if __name__ == "__main__":
+    main()
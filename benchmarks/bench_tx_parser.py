@@ -0,0 +1,129 @@
+"""
+Benchmark: raw block parsing (app.tx_parser) vs. decoding the node's verbose JSON.
+
+Usage:
+    python -m benchmarks.bench_tx_parser [--txs 2000] [--ft-ratio 0.3] [--rounds 5]
+"""
+import argparse
+import json
+import os
+import struct
+import time
+
+from app.script_classifier import script_to_asm
+from app.tx_parser import parse_block, compute_txid
+
+
+def _varint(n):
+    if n < 0xfd:
+        return bytes([n])
+    if n <= 0xffff:
+        return b"\xfd" + struct.pack("<H", n)
+    return b"\xfe" + struct.pack("<I", n)
+
+
+def _push(data):
+    if len(data) < 0x4c:
+        return bytes([len(data)]) + data
+    if len(data) <= 0xff:
+        return b"\x4c" + bytes([len(data)]) + data
+    return b"\x4d" + struct.pack("<H", len(data)) + data
+
+
+def _p2pkh():
+    return b"\x76\xa9\x14" + os.urandom(20) + b"\x88\xac"
+
+
+def _ft_script():
+    # FT 模板: 9 OP_PICK OP_TOALTSTACK + 约 1.5KB 合约代码
+    body = b"".join(_push(os.urandom(32)) + b"\x7c\x7e" for _ in range(40))
+    return b"\x59\x79\x6b" + body + _push(os.urandom(21)) + b"\x6a"
+
+
+def _transaction(ft):
+    inputs = [(os.urandom(32), 0, _push(os.urandom(71)) + _push(os.urandom(33)))]
+    outputs = [(1000, _p2pkh()), (2000, _p2pkh())]
+    if ft:
+        inputs.append((os.urandom(32), 1, b"\x51" + _push(os.urandom(71))))
+        outputs = [(500, _ft_script()), (0, b"\x00\x6a" + _push(os.urandom(200)))] + outputs
+
+    raw = struct.pack("<I", 10) + _varint(len(inputs))
+    for prev_hash, vout, script_sig in inputs:
+        raw += prev_hash + struct.pack("<I", vout) + _varint(len(script_sig)) + script_sig + b"\xff\xff\xff\xff"
+    raw += _varint(len(outputs))
+    for value, script in outputs:
+        raw += struct.pack("<Q", value) + _varint(len(script)) + script
+    return raw + b"\x00\x00\x00\x00", inputs, outputs
+
+
+def _verbose_json(raw, inputs, outputs):
+    # 模拟节点 getrawtransaction verbose 的 JSON 结构
+    return {
+        "txid": compute_txid(raw),
+        "hex": raw.hex(),
+        "version": 10,
+        "locktime": 0,
+        "vin": [
+            {"txid": prev_hash[::-1].hex(), "vout": vout,
+             "scriptSig": {"asm": script_to_asm(script_sig), "hex": script_sig.hex()}, "sequence": 4294967295}
+            for prev_hash, vout, script_sig in inputs
+        ],
+        "vout": [
+            {"value": value / 1_000_000, "n": n,
+             "scriptPubKey": {"asm": script_to_asm(script), "hex": script.hex(), "type": "nonstandard"}}
+            for n, (value, script) in enumerate(outputs)
+        ],
+    }
+
+
+def _consume_json(json_text):
+    # 旧流程: 解析 JSON 后按 asm 前缀分类并把金额转换为聪
+    count = 0
+    for decode_tx in json.loads(json_text):
+        for output in decode_tx["vout"]:
+            value = round(float(output["value"]) * 1_000_000)
+            script_asm = output["scriptPubKey"]["asm"]
+            if script_asm.startswith("9 OP_PICK OP_TOALTSTACK") or script_asm.startswith("0 OP_RETURN"):
+                count += value
+    return count
+
+
+def _consume_raw(block, txids):
+    count = 0
+    for tx in parse_block(block, txids):
+        for output in tx.outputs:
+            if output.template in ("ft", "nulldata"):
+                count += output.value
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--txs", type=int, default=2000, help="交易数量")
+    parser.add_argument("--ft-ratio", type=float, default=0.3, help="FT 交易占比")
+    parser.add_argument("--rounds", type=int, default=5, help="重复轮数")
+    args = parser.parse_args()
+
+    ft_every = int(1 / args.ft_ratio) if args.ft_ratio > 0 else 0
+    txs = [_transaction(ft_every and i % ft_every == 0) for i in range(args.txs)]
+    block = bytes(80) + _varint(len(txs)) + b"".join(raw for raw, _, _ in txs)
+    txids = [compute_txid(raw) for raw, _, _ in txs]
+    json_text = json.dumps([_verbose_json(*tx) for tx in txs])
+
+    print(f"transactions: {args.txs}, raw block: {len(block) / 1024:.0f} KiB, verbose JSON: {len(json_text) / 1024:.0f} KiB")
+
+    results = {}
+    for name, func, arg in (("json", _consume_json, (json_text,)), ("raw", _consume_raw, (block, txids))):
+        best = float("inf")
+        for _ in range(args.rounds):
+            start = time.perf_counter()
+            func(*arg)
+            best = min(best, time.perf_counter() - start)
+        results[name] = best
+        print(f"{name:>5}: {best * 1000:8.1f} ms  ({args.txs / best:,.0f} tx/s)")
+
+    print(f"speedup: {results['json'] / results['raw']:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,27 @@
+import argparse
 import asyncio
 import time
 import logging
 
-from app.dependencies import syclic_call_rpc
+from app.dependencies import syclic_call_rpc, iter_rpc_batch
 from app.dependencies import DBManager
+from app.dependencies import RPCManager
+from app.block_prefetcher import block_prefetcher
+from app.mempool import mempool_tracker
+from app.notify import chain_notifier
+from app.blacklist import blacklist
+from app.icon_upload import icon_upload_queue
+from app.script_classifier import classify_output, classify_transaction
 from app.db.nft_collections import process_nft_collections
 from app.db.nft_utxo_set import process_nft_utxo_set
 from app.db.ft import process_ft_txo_set, process_ft_balance
 from app.db.ft import process_ft_inputs, process_spent_ft_balances
 from app.db.ft import process_ft_tokens
+from app.db.ft import ft_txo_set_buffer, ft_balance_aggregator, ft_contract_cache, ft_unspent_index
+from app.db.index_status import load_index_status, save_index_status_nocommit
+from app.db.index_status import save_block_hash_nocommit, delete_block_hashes_nocommit, find_fork_height, REORG_UNDO_DEPTH
+from app.db.undo_journal import undo_journal, rollback_undo_journal_nocommit, prune_undo_journal_nocommit
+from app.state import state
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -16,37 +29,70 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 # 定义并初始化全局变量
 index_height = 862600
 index_interval = 0
-mempool = []
-last_mempool = []
 
-def schedule_task(task):
+def schedule_task(task, rebuild=False):
     """
     Schedule task.
+
+    Args:
+        task: 每轮执行的任务
+        rebuild: 是否清空数据表并从初始高度全量重建, 否则从检查点恢复
     """
     async def wrapper():
         await DBManager.init_pool(db="TBC20721")
-
-        # clear db
-        clear_db_query = """
-        SET FOREIGN_KEY_CHECKS = 0;
-        TRUNCATE TABLE `ft_tokens`;
-        TRUNCATE TABLE `ft_balance`;
-        TRUNCATE TABLE `ft_txo_set`;
-        TRUNCATE TABLE `nft_collections`;
-        TRUNCATE TABLE `nft_utxo_set`;
-        SET FOREIGN_KEY_CHECKS = 1;
-        """
-        await DBManager.execute_update(clear_db_query)
+        await RPCManager.init_session()
+        await chain_notifier.start()
+        blacklist.install_sighup_handler()
+        await icon_upload_queue.start()
+
+        global index_height
+        nonlocal rebuild
+        if not rebuild:
+            checkpoint_height, checkpoint_mempool, checkpoint_last_mempool = await load_index_status()
+            if checkpoint_height is not None:
+                index_height = checkpoint_height
+                mempool_tracker.restore(checkpoint_mempool, checkpoint_last_mempool)
+                logging.info("从检查点恢复索引, 区块高度: %s", index_height)
+            else:
+                # 没有检查点时表中可能仍有旧数据（如升级前的索引）, 在其上继续写入会重复累计余额, 必须清空重建
+                logging.info("未找到检查点, 清空数据表并全量重建")
+                rebuild = True
+
+        if rebuild:
+            # clear db
+            clear_db_query = """
+            SET FOREIGN_KEY_CHECKS = 0;
+            TRUNCATE TABLE `ft_tokens`;
+            TRUNCATE TABLE `ft_balance`;
+            TRUNCATE TABLE `ft_txo_set`;
+            TRUNCATE TABLE `nft_collections`;
+            TRUNCATE TABLE `nft_utxo_set`;
+            TRUNCATE TABLE `t_index_undo_journal`;
+            DELETE FROM `t_index_block_hash` WHERE `indexer` = '';
+            SET FOREIGN_KEY_CHECKS = 1;
+            """
+            await DBManager.execute_update(clear_db_query)
+            async with DBManager.transaction() as conn:
+                await save_index_status_nocommit(conn, index_height, [], [])
+            logging.info("全量重建索引, 从区块高度 %s 开始", index_height)
+
+        # 启动时加载 FT / NFT 内存状态, 处理区块时不再逐行查询 ft_txo_set / ft_balance / nft_utxo_set
+        await state.load()
 
         while True:
             try:
                 global index_interval
                 await task()
-                await asyncio.sleep(index_interval)
+                # 订阅节点通知时新区块/新交易到达立即唤醒, 否则按自适应间隔轮询
+                await chain_notifier.wait(index_interval)
             except KeyboardInterrupt:
                 logging.info("Interrupted by user")
                 break
             
+        await block_prefetcher.stop()
+        await chain_notifier.stop()
+        await icon_upload_queue.stop()
+        await RPCManager.close_session()
         await DBManager.close_pool()
     asyncio.run(wrapper())
 
@@ -56,7 +102,7 @@ def schedule_task(task):
 
 async def analyze_transaction_data(decode_tx):
     """
-    全面分析交易数据，返回交易类型和UTXO类型信息
+    全面分析交易数据，返回交易类型和每个输出的脚本分类结果
     
     Args:
         decode_tx: 解码后的交易数据
@@ -64,55 +110,31 @@ async def analyze_transaction_data(decode_tx):
     Returns:
         dict: 包含交易分析结果的字典
     """
-    result = {
-        'tx_type': 'P2PKH',  # 默认类型
-        'utxo_types': []     # 每个输出的类型
+    # 每个输出只分类一次, 后续处理直接使用分类结果
+    script_infos = [classify_output(output) for output in decode_tx['vout']]
+    return {
+        'tx_type': classify_transaction(script_infos),
+        'utxo_types': [info.utxo_type for info in script_infos],
+        'script_infos': script_infos
     }
-    
-    # 分析每个输出，确定交易类型和每个UTXO的类型
-    for i, output in enumerate(decode_tx['vout']):
-        if 'scriptPubKey' not in output or 'asm' not in output['scriptPubKey']:
-            result['utxo_types'].append('UNKNOWN')
-            continue
-            
-        script_asm = output['scriptPubKey']['asm']
-        utxo_type = 'NORMAL'
-        
-        # 判断UTXO类型
-        if script_asm.startswith("9 OP_PICK OP_TOALTSTACK"):
-            utxo_type = 'FT'
-            if result['tx_type'] == 'P2PKH':  # 只有当前类型是默认值时才更新
-                result['tx_type'] = 'TBC20'
-        elif (script_asm.startswith("OP_RETURN") or 
-              script_asm.startswith("0 OP_RETURN")):
-            utxo_type = 'NFT_COLLECTION'
-            if result['tx_type'] == 'P2PKH':
-                result['tx_type'] = 'TBC721'
-        elif (script_asm.startswith("1 OP_PICK 3 OP_SPLIT") or 
-              script_asm.startswith("4 OP_PICK OP_BIN2NUM OP_TOALTSTACK 1 OP_PICK 3 OP_SPLIT")):
-            utxo_type = 'NFT'
-            if result['tx_type'] == 'P2PKH':
-                result['tx_type'] = 'TBC721'
-        elif script_asm.endswith("OP_CHECKMULTISIG"):
-            utxo_type = 'MULTISIG'
-            if result['tx_type'] == 'P2PKH':
-                result['tx_type'] = 'P2MS'
-                
-        result['utxo_types'].append(utxo_type)
-    
-    return result
 
 
-async def process_single_transaction(tx, timestamp):
+async def process_single_transaction(conn, tx, timestamp, decode_tx=None):
     success_flags = {"utxos": False}
     
+    # 黑名单交易在解码前跳过
+    if tx in blacklist:
+        logging.info("跳过黑名单交易: %s", tx)
+        return False
+    
     try:
-        decode_tx = await syclic_call_rpc(method="getrawtransaction", params=[tx, 1])
+        if decode_tx is None:
+            decode_tx = await syclic_call_rpc(method="getrawtransaction", params=[tx, 1])
         tx_analysis = await analyze_transaction_data(decode_tx)
         
         # 无论交易记录是否成功，都尝试处理UTXO
         try:
-            await process_tx_utxos(decode_tx, timestamp, tx_analysis['utxo_types'])
+            await process_tx_utxos(conn, decode_tx, timestamp, tx_analysis['script_infos'])
             success_flags["utxos"] = True
         except Exception as e:
             logging.error("处理UTXO失败 %s: %s", tx, str(e))
@@ -124,17 +146,6 @@ async def process_single_transaction(tx, timestamp):
         return False
 
 
-def is_in_blacklist(txid):
-    """检查交易ID是否在黑名单中"""
-    try:
-        with open('black_list.txt', 'r', encoding='utf-8') as file:
-            black_list = [line.strip() for line in file]
-        return txid in black_list
-    except FileNotFoundError:
-        return False
-
-
-
 def determine_tx_type(decode_tx):
     """
     确定交易类型
@@ -145,82 +156,53 @@ def determine_tx_type(decode_tx):
     Returns:
         str: 交易类型，如 "P2PKH"、"TBC20"、"TBC721" 等
     """
-    tx_type = "P2PKH"  # 默认类型
-    
-    for output in decode_tx['vout']:
-        script_asm = output["scriptPubKey"]["asm"]
-        if script_asm.startswith("9 OP_PICK OP_TOALTSTACK"):
-            tx_type = "TBC20"
-            break
-        elif (script_asm.startswith("OP_RETURN") or 
-              script_asm.startswith("0 OP_RETURN") or 
-              script_asm.startswith("1 OP_PICK")):
-            tx_type = "TBC721"
-            break
-        elif script_asm.endswith("OP_CHECKMULTISIG"):
-            tx_type = "P2MS"
-            break
-            
-    return tx_type
+    return classify_transaction([classify_output(output) for output in decode_tx['vout']])
 
 
 
-async def process_tx_utxos(decode_tx, timestamp, utxo_types=None):
+async def process_tx_utxos(conn, decode_tx, timestamp, script_infos=None):
     """
     处理交易中的各种UTXO（FT/NFT等）
     
     Args:
+        conn: 当前区块事务使用的数据库连接
         decode_tx: 解码后的交易数据
         timestamp: 时间戳
-        utxo_types: 每个输出的类型列表，如果为None则实时判断
+        script_infos: 每个输出的脚本分类结果，如果为None则在此分类
     """
+    if script_infos is None:
+        script_infos = [classify_output(output) for output in decode_tx["vout"]]
     output_index = 0
     
     # 第一阶段：处理所有输出
     while output_index < len(decode_tx["vout"]):
-        if output_index >= len(decode_tx["vout"]):
-            break
-        
-        # 如果提供了UTXO类型，则使用它
-        if utxo_types and output_index < len(utxo_types):
-            utxo_type = utxo_types[output_index]
-        else:
-            # 否则实时判断UTXO类型
-            script_asm = decode_tx["vout"][output_index]["scriptPubKey"]["asm"]
-            if script_asm.startswith("0 OP_RETURN") or script_asm.startswith("OP_RETURN"):
-                utxo_type = 'NFT_COLLECTION'
-            elif script_asm.startswith("1 OP_PICK 3 OP_SPLIT") or script_asm.startswith("4 OP_PICK OP_BIN2NUM OP_TOALTSTACK 1 OP_PICK 3 OP_SPLIT"):
-                utxo_type = 'NFT'
-            elif script_asm.startswith("9 OP_PICK OP_TOALTSTACK"):
-                utxo_type = 'FT'
-            else:
-                utxo_type = 'NORMAL'
+        utxo_type = script_infos[output_index].utxo_type
         
         # 根据UTXO类型处理
         if utxo_type == 'NFT_COLLECTION':
-            new_output_index, _, should_break = await process_nft_collections(decode_tx, output_index, timestamp)
+            new_output_index, _, should_break = await process_nft_collections(conn, decode_tx, output_index, timestamp, script_infos)
             if should_break:
                 break
             output_index = new_output_index
         elif utxo_type == 'NFT':
-            new_output_index, _, should_break = await process_nft_utxo_set(decode_tx, output_index, timestamp)
+            new_output_index, _, should_break = await process_nft_utxo_set(conn, decode_tx, output_index, timestamp, script_infos)
             if should_break:
                 break
             output_index = new_output_index
         elif utxo_type == 'FT':
-            new_output_index, ft_contract_id, vout_combine_script, ft_balance, should_break = await process_ft_tokens(decode_tx, output_index, timestamp)
+            new_output_index, ft_contract_id, vout_combine_script, ft_balance, should_break = await process_ft_tokens(conn, decode_tx, output_index, timestamp, script_infos)
             if should_break:
                 break
             output_index = new_output_index
             
             # 处理FT代币的UTXO记录（仅输出）
-            should_break = await process_ft_txo_set(decode_tx, output_index, ft_contract_id, vout_combine_script, ft_balance)
+            should_break = await process_ft_txo_set(conn, decode_tx, output_index, ft_contract_id, vout_combine_script, ft_balance)
             if should_break:
                 break
             
             # 处理FT代币余额（仅输出增加）
             if ft_contract_id is not None and vout_combine_script is not None and ft_balance is not None:
-                should_break = await process_ft_balance(ft_contract_id, vout_combine_script, ft_balance)
+                should_break = await process_ft_balance(conn, ft_contract_id, vout_combine_script, ft_balance)
                 if should_break:
                     break
             else:
@@ -231,9 +213,9 @@ async def process_tx_utxos(decode_tx, timestamp, utxo_types=None):
     
     # 第二阶段：统一处理所有输入
     try:
-        spent_utxo_info_list = await process_ft_inputs(decode_tx)
+        spent_utxo_info_list = await process_ft_inputs(conn, decode_tx)
         if spent_utxo_info_list:
-            await process_spent_ft_balances(spent_utxo_info_list)
+            await process_spent_ft_balances(conn, spent_utxo_info_list)
     except Exception as e:
         logging.error("Error processing FT inputs for transaction %s: %s", decode_tx["txid"], e)
 
@@ -269,19 +251,26 @@ async def get_mempool_and_timestamp(if_catch_lastest):
         if_catch_lastest: 是否已追上最新区块
         
     Returns:
-        tuple: (current_mempool, timestamp)
+        tuple: (current_mempool, timestamp, decoded_txs, block)
+            decoded_txs 为预取区块中 txid -> 解码交易 的字典, block 为区块信息, 内存池模式下均为 None;
+            内存池自上次处理后无变化时 current_mempool 为 None
     """
     global index_height
     
     if if_catch_lastest:
-        current_mempool = await syclic_call_rpc(method="getrawmempool", params=[])
+        current_mempool = await chain_notifier.mempool_txids(mempool_tracker)
         timestamp = int(time.time())
+        decoded_txs = None
+        block = None
     else:
-        get_block_res = await syclic_call_rpc(method="getblockbyheight", params=[index_height, 1])
-        current_mempool = get_block_res["tx"]
-        timestamp = get_block_res["time"]
+        # 从预取队列获取区块, 后续区块在当前区块写入期间继续下载
+        prefetched = await block_prefetcher.get(index_height)
+        current_mempool = prefetched.block["tx"]
+        timestamp = prefetched.block["time"]
+        decoded_txs = prefetched.decoded_by_txid()
+        block = prefetched.block
     
-    return current_mempool, timestamp
+    return current_mempool, timestamp, decoded_txs, block
 
 
 def find_new_transactions(current_mempool):
@@ -294,15 +283,25 @@ def find_new_transactions(current_mempool):
     Returns:
         list: 新交易列表
     """
-    global mempool
-    global last_mempool
-    
-    nearly_mempool = mempool + last_mempool
-    new_txs = [tx for tx in current_mempool if tx not in nearly_mempool]
-    
-    return new_txs
+    return mempool_tracker.diff(current_mempool)
 
-async def process_transactions(new_txs, if_catch_lastest, timestamp):
+async def iter_decoded_transactions(new_txs, decoded_txs):
+    """
+    按顺序产出新交易的解码数据, 优先使用预取区块中已解码的交易
+    """
+    if decoded_txs is not None:
+        for tx in new_txs:
+            yield decoded_txs.get(tx)
+    else:
+        # 并发预取后续交易的解码数据, 同时按区块内顺序依次处理（同区块内的花费依赖保持有序）
+        # 黑名单交易不请求节点, 产出 None 由 process_single_transaction 跳过
+        skipped = {tx for tx in new_txs if tx in blacklist}
+        decoded = iter_rpc_batch([("getrawtransaction", [tx, 1]) for tx in new_txs if tx not in skipped])
+        for tx in new_txs:
+            yield None if tx in skipped else await anext(decoded)
+
+
+async def process_transactions(new_txs, if_catch_lastest, timestamp, decoded_txs=None, block_hash=None):
     """
     并发处理新交易和旧交易
     
@@ -310,30 +309,97 @@ async def process_transactions(new_txs, if_catch_lastest, timestamp):
         new_txs: 新交易列表
         if_catch_lastest: 是否已追上最新区块
         timestamp: 时间戳
+        decoded_txs: 预取区块中 txid -> 解码交易 的字典
+        block_hash: 当前区块哈希, 内存池模式下为 None
     """
-    for tx in new_txs:
-        try:
-            mempool.append(tx)
-            await process_single_transaction(tx, timestamp)
-        except Exception as e:
-            logging.error("处理新交易失败 %s: %s", tx, str(e))
-            continue
+    decode_txs = iter_decoded_transactions(new_txs, decoded_txs)
 
-def update_mempool_state(if_catch_lastest):
+    # 整个区块使用同一个连接和事务写入, 结束时统一提交
+    try:
+        async with DBManager.transaction() as conn:
+            tx_index = 0
+            async for decode_tx in decode_txs:
+                tx = new_txs[tx_index]
+                tx_index += 1
+                try:
+                    await process_single_transaction(conn, tx, timestamp, decode_tx)
+                except Exception as e:
+                    logging.error("处理新交易失败 %s: %s", tx, str(e))
+                    continue
+                # 在单笔交易的错误处理之外写入: 死锁等错误时 InnoDB 已回滚整个事务, 写入失败必须回滚整个区块
+                if ft_txo_set_buffer.is_full():
+                    await ft_txo_set_buffer.flush(conn)
+
+            # 区块结束时写入剩余的缓存行、已花费的 FT 输出和累积的余额变化
+            await ft_txo_set_buffer.flush(conn)
+            await ft_unspent_index.flush(conn)
+            await ft_balance_aggregator.flush(conn)
+
+            # 撤销日志记在当前高度下, 内存池模式的修改随后并入该高度的区块
+            await undo_journal.save_nocommit(conn, index_height)
+
+            # 检查点与区块数据在同一事务中提交, 重启后从下一个区块继续
+            if not if_catch_lastest:
+                await save_block_hash_nocommit(conn, index_height, block_hash)
+                await prune_undo_journal_nocommit(conn, index_height - REORG_UNDO_DEPTH)
+                # decoded_txs 按区块内顺序包含全部交易
+                await save_index_status_nocommit(conn, index_height + 1, *mempool_tracker.checkpoint(block_txids=list(decoded_txs)))
+            elif new_txs:
+                await save_index_status_nocommit(conn, index_height, *mempool_tracker.checkpoint(new_txs))
+    except Exception:
+        # 事务已回滚, 丢弃尚未写入的缓存
+        ft_txo_set_buffer.take()
+        ft_balance_aggregator.discard()
+        ft_contract_cache.discard()
+        ft_unspent_index.discard()
+        state.discard()
+        undo_journal.discard()
+        icon_upload_queue.discard()
+        raise
+
+    # 提交成功后才记录为已处理, 失败时下一轮重新处理整个区块
+    mempool_tracker.add(new_txs)
+    ft_contract_cache.commit()
+    state.commit()
+    # 图标上传在数据提交后才开始, 完成后回填占位值
+    await icon_upload_queue.release()
+
+def update_mempool_state(if_catch_lastest, block_txids=None):
     """
     更新内存池状态
     
     Args:
         if_catch_lastest: 是否已追上最新区块
+        block_txids: 已处理区块中的全部交易
     """
     global index_height
-    global mempool
-    global last_mempool
     
     if not if_catch_lastest:
         index_height += 1
-        last_mempool = mempool
-        mempool = []
+        mempool_tracker.confirm(block_txids)
+
+
+async def rollback_to_fork(fork_height):
+    """
+    链重组时撤销分叉点之后的全部修改, 并从分叉点的下一个区块重新索引
+    
+    Args:
+        fork_height: 分叉点高度（新旧链共同的最高区块）
+    """
+    global index_height
+    
+    logging.warning("回滚索引: 区块高度 %s -> %s", index_height - 1, fork_height)
+    async with DBManager.transaction() as conn:
+        await rollback_undo_journal_nocommit(conn, fork_height)
+        await delete_block_hashes_nocommit(conn, fork_height)
+        await save_index_status_nocommit(conn, fork_height + 1, [], [])
+    
+    # 回滚后的内存池交易需重新处理; 预取器在下次请求的高度不连续时自动从新高度重新预取
+    index_height = fork_height + 1
+    mempool_tracker.reset()
+    # 回滚可能删除了分叉点之后铸造的代币, 并恢复了其后花费的 FT 输出和 NFT 持有者
+    ft_contract_cache.invalidate()
+    await state.load()
 
 
 async def scan_chain_and_build_index():
@@ -345,16 +411,29 @@ async def scan_chain_and_build_index():
         if_catch_lastest, _ = await check_block_height()
         
         # 获取当前内存池和时间戳
-        current_mempool, timestamp = await get_mempool_and_timestamp(if_catch_lastest)
+        current_mempool, timestamp, decoded_txs, block = await get_mempool_and_timestamp(if_catch_lastest)
+        if current_mempool is None:
+            return True
+        
+        # 区块未接在已索引的链上时回滚到分叉点, 下一轮重新处理
+        if block is not None:
+            fork_height = await find_fork_height(index_height, block.get("previousblockhash"))
+            if fork_height is not None:
+                await rollback_to_fork(fork_height)
+                return True
         
         # 找出新交易
         new_txs = find_new_transactions(current_mempool)
+        if if_catch_lastest and not new_txs:
+            return True
         
         # 处理新交易
-        await process_transactions(new_txs, if_catch_lastest, timestamp)
+        await process_transactions(new_txs, if_catch_lastest, timestamp, decoded_txs, block["hash"] if block is not None else None)
         
         # 更新内存池状态
-        update_mempool_state(if_catch_lastest)
+        update_mempool_state(if_catch_lastest, current_mempool)
+        if new_txs or not if_catch_lastest:
+            chain_notifier.mark_activity()
         
         return True
     except Exception as e:
@@ -363,6 +442,10 @@ async def scan_chain_and_build_index():
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the FT/NFT index")
+    parser.add_argument("--rebuild", action="store_true", help="清空索引数据表并从初始高度全量重建")
+    args = parser.parse_args()
+
     async def task_wrapper():
         """
         Task wrapper.
@@ -370,4 +453,4 @@ if __name__ == "__main__":
         await scan_chain_and_build_index()
 
     # 每 15 秒调用一次 task_wrapper
-    schedule_task(task_wrapper)
\ No newline at end of file
+    schedule_task(task_wrapper, rebuild=args.rebuild)
\ No newline at end of file
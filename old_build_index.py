@@ -4,6 +4,7 @@ import logging
 from app.dependencies import call_node_rpc
 from app.dependencies import DBManager
 from app.utils import hex_to_json, convert_str_to_sha256
+from app.blacklist import blacklist
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -95,19 +96,14 @@ async def scan_chain_and_build_index():
     for tx in new_txs:
         mempool.append(tx)
 
+        # skip blacklisted transactions before decoding
+        if tx in blacklist:
+            continue
+
         # decode raw transaction
         decode_tx = await syclic_call_rpc(method="getrawtransaction", params=[tx, 1])
         decode_txid = decode_tx["txid"]
 
-        # Read black list from file
-        try:
-            with open('black_list.txt', 'r', encoding='utf-8') as file:
-                black_list = [line.strip() for line in file]
-        except FileNotFoundError:
-            black_list = []
-        if decode_txid in black_list:
-            continue
-
         # build index for new utxo and FT/Collection info.
         output_index = 0
         while output_index < len(decode_tx["vout"]):
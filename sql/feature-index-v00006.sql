@@ -0,0 +1,8 @@
+-- 索引检查点: 内存池交易列表可能超过 TEXT 上限
+ALTER TABLE TBC20721.t_index_build_status
+MODIFY `value` MEDIUMTEXT;
+
+-- 交易历史索引 (transactions_index.py) 的检查点
+INSERT IGNORE INTO TBC20721.t_index_build_status (id, name, value) VALUES (4, 'txindex_index_height', 0);
+INSERT IGNORE INTO TBC20721.t_index_build_status (id, name, value) VALUES (5, 'txindex_mempool', '[]');
+INSERT IGNORE INTO TBC20721.t_index_build_status (id, name, value) VALUES (6, 'txindex_last_mempool', '[]');
@@ -0,0 +1,16 @@
+-- 已索引区块的哈希, 用于检测链重组
+CREATE TABLE IF NOT EXISTS TBC20721.t_index_block_hash (
+  `indexer` varchar(16) NOT NULL COMMENT '索引程序, 与检查点名称前缀一致 (FT/NFT 索引为空字符串)',
+  `height` int NOT NULL COMMENT '区块高度',
+  `block_hash` char(64) NOT NULL COMMENT '区块哈希',
+  PRIMARY KEY (`indexer`, `height`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci COMMENT='已索引区块哈希';
+
+-- FT/NFT 索引每个区块的撤销日志, 链重组时逆序执行以回滚到分叉点
+CREATE TABLE IF NOT EXISTS TBC20721.t_index_undo_journal (
+  `Fid` bigint NOT NULL AUTO_INCREMENT COMMENT '主键ID, 回滚时按写入顺序逆序执行',
+  `height` int NOT NULL COMMENT '区块高度',
+  `journal` mediumtext NOT NULL COMMENT '行级修改的逆操作, JSON 格式',
+  PRIMARY KEY (`Fid`),
+  KEY `idx_height` (`height`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci COMMENT='区块撤销日志';
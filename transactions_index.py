@@ -1,17 +1,26 @@
+import argparse
 import asyncio
 import time
 import logging
 
-from app.dependencies import syclic_call_rpc
+from app.dependencies import syclic_call_rpc, syclic_call_rpc_batch
 from app.dependencies import DBManager
-from app.db.nft_collections import process_nft_collections
-from app.db.nft_utxo_set import process_nft_utxo_set
-from app.db.ft import process_ft_txo_set, process_ft_balance
-from app.db.ft import process_ft_inputs, process_spent_ft_balances
-from app.db.ft import process_ft_tokens
+from app.dependencies import RPCManager
+from app.block_prefetcher import block_prefetcher
+from app.mempool import mempool_tracker
+from app.notify import chain_notifier
+from app.blacklist import blacklist
 from app.db.transaction_history import process_transaction_record
 from app.db.transaction_history import get_unconfirmed_transactions
 from app.db.transaction_history import delete_transactions_below_height
+from app.db.transaction_history import delete_transactions_above_height_nocommit
+from app.db.transaction_history import history_writer
+from app.db.index_status import load_index_status, save_index_status_nocommit
+from app.db.index_status import save_block_hash_nocommit, delete_block_hashes_nocommit, find_fork_height
+from app.prevout_cache import prevout_cache
+from app.utxo_store import utxo_store
+from app.tx_parser import parse_transaction_hex
+from app.script_classifier import classify_transaction
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -19,8 +28,9 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 # 定义并初始化全局变量
 index_height = 0  # 将在初始化时设置
 index_interval = 0
-mempool = []
-last_mempool = []
+
+# t_index_build_status 中交易历史索引检查点的名称前缀
+INDEX_STATUS_PREFIX = "txindex_"
 
 async def get_initial_block_height():
     """
@@ -38,37 +48,69 @@ async def get_initial_block_height():
         logging.error(f"获取初始区块高度失败: {str(e)}")
         raise
 
-def schedule_task(task):
+def schedule_task(task, rebuild=False):
     """
     Schedule task.
+
+    Args:
+        task: 每轮执行的任务
+        rebuild: 是否清空数据表并从初始高度全量重建, 否则从检查点恢复
     """
     async def wrapper():
         await DBManager.init_pool(db="TBC20721")
+        await RPCManager.init_session()
+        await chain_notifier.start()
+        blacklist.install_sighup_handler()
 
-        # clear db
-        clear_db_query = """
-        SET FOREIGN_KEY_CHECKS = 0;
-        TRUNCATE TABLE `transactions`;
-        TRUNCATE TABLE `address_transactions`;
-        TRUNCATE TABLE `transaction_participants`;
-        SET FOREIGN_KEY_CHECKS = 1;
-        """
-        await DBManager.execute_update(clear_db_query)
+        # 打开本地 UTXO 存储, 输入解析优先查询本地
+        utxo_store.open()
+        prevout_cache.store = utxo_store
+
+        # 交易历史只需要金额/地址/脚本模板, 直接解析原始区块
+        block_prefetcher.fetch_mode = "raw"
 
-        # 设置初始区块高度
         global index_height
-        index_height = await get_initial_block_height()
-        logging.info(f"开始从区块高度 {index_height} 扫描交易记录")
+        checkpoint_height = None
+        if not rebuild:
+            checkpoint_height, checkpoint_mempool, checkpoint_last_mempool = await load_index_status(INDEX_STATUS_PREFIX)
+
+        if checkpoint_height is not None:
+            index_height = checkpoint_height
+            mempool_tracker.restore(checkpoint_mempool, checkpoint_last_mempool)
+            logging.info(f"从检查点恢复交易记录扫描, 区块高度: {index_height}")
+        else:
+            if rebuild:
+                # clear db
+                clear_db_query = """
+                SET FOREIGN_KEY_CHECKS = 0;
+                TRUNCATE TABLE `transactions`;
+                TRUNCATE TABLE `address_transactions`;
+                TRUNCATE TABLE `transaction_participants`;
+                DELETE FROM `t_index_block_hash` WHERE `indexer` = 'txindex_';
+                SET FOREIGN_KEY_CHECKS = 1;
+                """
+                await DBManager.execute_update(clear_db_query)
+
+            # 设置初始区块高度
+            index_height = await get_initial_block_height()
+            async with DBManager.transaction() as conn:
+                await save_index_status_nocommit(conn, index_height, [], [], INDEX_STATUS_PREFIX)
+            logging.info(f"开始从区块高度 {index_height} 扫描交易记录")
 
         while True:
             try:
                 global index_interval
                 await task()
-                await asyncio.sleep(index_interval)
+                # 订阅节点通知时新区块/新交易到达立即唤醒, 否则按自适应间隔轮询
+                await chain_notifier.wait(index_interval)
             except KeyboardInterrupt:
                 logging.info("Interrupted by user")
                 break
             
+        utxo_store.close()
+        await block_prefetcher.stop()
+        await chain_notifier.stop()
+        await RPCManager.close_session()
         await DBManager.close_pool()
     asyncio.run(wrapper())
 
@@ -76,60 +118,36 @@ def schedule_task(task):
 
 
 
-async def analyze_transaction_data(decode_tx):
+async def analyze_transaction_data(tx):
     """
     全面分析交易数据，返回交易类型和UTXO类型信息
     
     Args:
-        decode_tx: 解码后的交易数据
+        tx: 解析后的交易 (app.tx_parser.Transaction)
         
     Returns:
         dict: 包含交易分析结果的字典
     """
-    result = {
-        'tx_type': 'P2PKH',  # 默认类型
-        'utxo_types': []     # 每个输出的类型
+    # 每个输出在解析时已分类一次, 这里直接使用分类结果
+    script_infos = [output.info for output in tx.outputs]
+    return {
+        'tx_type': classify_transaction(script_infos),
+        'utxo_types': [info.utxo_type for info in script_infos]
     }
-    
-    # 分析每个输出，确定交易类型和每个UTXO的类型
-    for i, output in enumerate(decode_tx['vout']):
-        if 'scriptPubKey' not in output or 'asm' not in output['scriptPubKey']:
-            result['utxo_types'].append('UNKNOWN')
-            continue
-            
-        script_asm = output['scriptPubKey']['asm']
-        utxo_type = 'NORMAL'
-        
-        # 判断UTXO类型
-        if script_asm.startswith("9 OP_PICK OP_TOALTSTACK"):
-            utxo_type = 'FT'
-            if result['tx_type'] == 'P2PKH':  # 只有当前类型是默认值时才更新
-                result['tx_type'] = 'TBC20'
-        elif (script_asm.startswith("OP_RETURN") or 
-              script_asm.startswith("0 OP_RETURN")):
-            utxo_type = 'NFT_COLLECTION'
-            if result['tx_type'] == 'P2PKH':
-                result['tx_type'] = 'TBC721'
-        elif (script_asm.startswith("1 OP_PICK 3 OP_SPLIT") or 
-              script_asm.startswith("4 OP_PICK OP_BIN2NUM OP_TOALTSTACK 1 OP_PICK 3 OP_SPLIT")):
-            utxo_type = 'NFT'
-            if result['tx_type'] == 'P2PKH':
-                result['tx_type'] = 'TBC721'
-        elif script_asm.endswith("OP_CHECKMULTISIG"):
-            utxo_type = 'MULTISIG'
-            if result['tx_type'] == 'P2PKH':
-                result['tx_type'] = 'P2MS'
-                
-        result['utxo_types'].append(utxo_type)
-    
-    return result
 
 
-async def process_single_transaction(tx, block_height, timestamp):
+async def process_single_transaction(tx, block_height, timestamp, decode_tx=None):
     success_flags = {"transaction_record": False}
     
+    # 黑名单交易在解码前跳过
+    if tx in blacklist:
+        logging.info("跳过黑名单交易: %s", tx)
+        return False
+    
     try:
-        decode_tx = await syclic_call_rpc(method="getrawtransaction", params=[tx, 1])
+        if decode_tx is None:
+            tx_hex = await syclic_call_rpc(method="getrawtransaction", params=[tx, 0])
+            decode_tx = parse_transaction_hex(tx_hex, tx)
         tx_analysis = await analyze_transaction_data(decode_tx)
         
         # 尝试处理交易记录
@@ -146,120 +164,20 @@ async def process_single_transaction(tx, block_height, timestamp):
         return False
 
 
-def is_in_blacklist(txid):
-    """检查交易ID是否在黑名单中"""
-    try:
-        with open('black_list.txt', 'r', encoding='utf-8') as file:
-            black_list = [line.strip() for line in file]
-        return txid in black_list
-    except FileNotFoundError:
-        return False
-
-
-
-def determine_tx_type(decode_tx):
+def determine_tx_type(tx):
     """
     确定交易类型
     
     Args:
-        decode_tx: 解码后的交易数据
+        tx: 解析后的交易 (app.tx_parser.Transaction)
         
     Returns:
         str: 交易类型，如 "P2PKH"、"TBC20"、"TBC721" 等
     """
-    tx_type = "P2PKH"  # 默认类型
-    
-    for output in decode_tx['vout']:
-        script_asm = output["scriptPubKey"]["asm"]
-        if script_asm.startswith("9 OP_PICK OP_TOALTSTACK"):
-            tx_type = "TBC20"
-            break
-        elif (script_asm.startswith("OP_RETURN") or 
-              script_asm.startswith("0 OP_RETURN") or 
-              script_asm.startswith("1 OP_PICK")):
-            tx_type = "TBC721"
-            break
-        elif script_asm.endswith("OP_CHECKMULTISIG"):
-            tx_type = "P2MS"
-            break
-            
-    return tx_type
+    return classify_transaction([output.info for output in tx.outputs])
 
 
 
-async def process_tx_utxos(decode_tx, timestamp, utxo_types=None):
-    """
-    处理交易中的各种UTXO（FT/NFT等）
-    
-    Args:
-        decode_tx: 解码后的交易数据
-        timestamp: 时间戳
-        utxo_types: 每个输出的类型列表，如果为None则实时判断
-    """
-    output_index = 0
-    
-    # 第一阶段：处理所有输出
-    while output_index < len(decode_tx["vout"]):
-        if output_index >= len(decode_tx["vout"]):
-            break
-        
-        # 如果提供了UTXO类型，则使用它
-        if utxo_types and output_index < len(utxo_types):
-            utxo_type = utxo_types[output_index]
-        else:
-            # 否则实时判断UTXO类型
-            script_asm = decode_tx["vout"][output_index]["scriptPubKey"]["asm"]
-            if script_asm.startswith("0 OP_RETURN") or script_asm.startswith("OP_RETURN"):
-                utxo_type = 'NFT_COLLECTION'
-            elif script_asm.startswith("1 OP_PICK 3 OP_SPLIT") or script_asm.startswith("4 OP_PICK OP_BIN2NUM OP_TOALTSTACK 1 OP_PICK 3 OP_SPLIT"):
-                utxo_type = 'NFT'
-            elif script_asm.startswith("9 OP_PICK OP_TOALTSTACK"):
-                utxo_type = 'FT'
-            else:
-                utxo_type = 'NORMAL'
-        
-        # 根据UTXO类型处理
-        if utxo_type == 'NFT_COLLECTION':
-            new_output_index, _, should_break = await process_nft_collections(decode_tx, output_index, timestamp)
-            if should_break:
-                break
-            output_index = new_output_index
-        elif utxo_type == 'NFT':
-            new_output_index, _, should_break = await process_nft_utxo_set(decode_tx, output_index, timestamp)
-            if should_break:
-                break
-            output_index = new_output_index
-        elif utxo_type == 'FT':
-            new_output_index, ft_contract_id, vout_combine_script, ft_balance, should_break = await process_ft_tokens(decode_tx, output_index, timestamp)
-            if should_break:
-                break
-            output_index = new_output_index
-            
-            # 处理FT代币的UTXO记录（仅输出）
-            should_break = await process_ft_txo_set(decode_tx, output_index, ft_contract_id, vout_combine_script, ft_balance)
-            if should_break:
-                break
-            
-            # 处理FT代币余额（仅输出增加）
-            if ft_contract_id is not None and vout_combine_script is not None and ft_balance is not None:
-                should_break = await process_ft_balance(ft_contract_id, vout_combine_script, ft_balance)
-                if should_break:
-                    break
-            else:
-                logging.warning("Invalid FT data: contract_id=%s, script=%s, balance=%s", 
-                               ft_contract_id, vout_combine_script, ft_balance)
-        else:
-            output_index += 1
-    
-    # 第二阶段：统一处理所有输入
-    try:
-        spent_utxo_info_list = await process_ft_inputs(decode_tx)
-        if spent_utxo_info_list:
-            await process_spent_ft_balances(spent_utxo_info_list)
-    except Exception as e:
-        logging.error("Error processing FT inputs for transaction %s: %s", decode_tx["txid"], e)
-
-
 async def check_block_height():
     """
     检查当前区块高度并确定是否追上最新区块
@@ -297,47 +215,56 @@ async def get_mempool_and_timestamp(if_catch_lastest):
         if_catch_lastest: 是否已追上最新区块
         
     Returns:
-        tuple: (current_mempool, timestamp)
+        tuple: (current_mempool, timestamp, decoded_txs, block)
+            decoded_txs 为预取区块中 txid -> 解析后交易 的字典, block 为区块信息, 内存池模式下均为 None;
+            内存池自上次处理后无变化时 current_mempool 为 None
     """
     global index_height
     
     if if_catch_lastest:
-        current_mempool = await syclic_call_rpc(method="getrawmempool", params=[])
+        current_mempool = await chain_notifier.mempool_txids(mempool_tracker)
         timestamp = int(time.time())
+        decoded_txs = None
+        block = None
     else:
-        get_block_res = await syclic_call_rpc(method="getblockbyheight", params=[index_height, 1])
-        current_mempool = get_block_res["tx"]
-        timestamp = get_block_res["time"]
+        # 从预取队列获取区块, 后续区块在当前区块写入期间继续下载
+        prefetched = await block_prefetcher.get(index_height)
+        current_mempool = prefetched.block["tx"]
+        timestamp = prefetched.block["time"]
+        decoded_txs = prefetched.decoded_by_txid()
+        block = prefetched.block
     
-    return current_mempool, timestamp
+    return current_mempool, timestamp, decoded_txs, block
 
 
-def find_transactions(current_mempool):
+def find_transactions(current_mempool, if_catch_lastest):
     """
     找出新的交易
     
     Args:
-        current_mempool: 当前内存池
+        current_mempool: 当前内存池或区块中的交易
+        if_catch_lastest: 是否已追上最新区块
         
     Returns:
-        list: 新交易列表
+        tuple: (新交易列表, 本轮需要处理的交易列表)
+            区块模式下处理区块中的全部交易（更新之前以 -1 记录的内存池交易的区块高度）, 内存池模式下只处理新交易
     """
-    global mempool
-    global last_mempool
-    
-    nearly_mempool = mempool + last_mempool
-    new_txs = [tx for tx in current_mempool if tx not in nearly_mempool]
-    
+    new_txs = mempool_tracker.diff(current_mempool)
+    if if_catch_lastest:
+        return new_txs, new_txs
     return new_txs, current_mempool
 
-async def process_transactions(new_txs, current_mempool, if_catch_lastest, timestamp):
+async def process_transactions(new_txs, current_mempool, if_catch_lastest, timestamp, decoded_txs=None, block_hash=None):
     """
     并发处理新交易
     
     Args:
         new_txs: 新交易列表
+        current_mempool: 本轮需要处理的交易列表
         if_catch_lastest: 是否已追上最新区块
         timestamp: 时间戳
+        decoded_txs: 预取区块中 txid -> 解析后交易 的字典
+        block_hash: 当前区块哈希, 内存池模式下为 None
     """
     # 删除掉一万块以前的交易
     if not if_catch_lastest and index_height > 10000:
@@ -346,36 +273,89 @@ async def process_transactions(new_txs, current_mempool, if_catch_lastest, times
     # 创建信号量来限制并发数量
     semaphore = asyncio.Semaphore(50)  # 限制最大并发数为50
 
-    async def process_single_tx(tx):
+    # 批量获取所有交易的原始数据并在本地解析（预取区块中已包含时直接使用）
+    if decoded_txs is not None:
+        decode_txs = [decoded_txs.get(tx) for tx in current_mempool]
+    else:
+        # 黑名单交易不请求节点
+        fetch_txs = [tx for tx in current_mempool if tx not in blacklist]
+        tx_hexes = dict(zip(fetch_txs, await syclic_call_rpc_batch([("getrawtransaction", [tx, 0]) for tx in fetch_txs])))
+        decode_txs = [
+            parse_transaction_hex(tx_hexes[tx], tx) if tx_hexes.get(tx) is not None else None
+            for tx in current_mempool
+        ]
+
+    # 先缓存本批交易的输出, 同批次内花费这些输出的输入无需再请求节点
+    decode_txs_found = [decode_tx for decode_tx in decode_txs if decode_tx is not None]
+    for decode_tx in decode_txs_found:
+        prevout_cache.add_transaction(decode_tx)
+    # 本地 UTXO 存储只保存已确认的输出: 内存池交易可能永远不会确认, 其输出只进入内存缓存
+    if not if_catch_lastest:
+        utxo_store.add_transactions(decode_txs_found)
+
+    async def process_single_tx(tx, decode_tx):
         async with semaphore:
             try:
-                mempool.append(tx)
                 block_height = index_height if not if_catch_lastest else -1
-                await process_single_transaction(tx, block_height, timestamp)
+                await process_single_transaction(tx, block_height, timestamp, decode_tx)
             except Exception as e:
                 logging.error("处理新交易失败 %s: %s", tx, str(e))
 
     # 创建所有交易的任务
-    tasks = [process_single_tx(tx) for tx in current_mempool]
+    tasks = [process_single_tx(tx, decode_tx) for tx, decode_tx in zip(current_mempool, decode_txs)]
     
     # 并发执行所有任务
     await asyncio.gather(*tasks, return_exceptions=True)
+    prevout_cache.log_stats()
+
+    # 区块结束时批量写入交易历史, 检查点在同一事务中提交
+    async with DBManager.transaction() as conn:
+        await history_writer.flush(conn)
+        if not if_catch_lastest:
+            await save_block_hash_nocommit(conn, index_height, block_hash, INDEX_STATUS_PREFIX)
+            await save_index_status_nocommit(conn, index_height + 1, *mempool_tracker.checkpoint(block_txids=current_mempool), INDEX_STATUS_PREFIX)
+        else:
+            await save_index_status_nocommit(conn, index_height, *mempool_tracker.checkpoint(new_txs), INDEX_STATUS_PREFIX)
+    mempool_tracker.add(new_txs)
+
+    # 区块确认后才从本地 UTXO 存储中删除已花费的输出
+    if not if_catch_lastest:
+        utxo_store.spend_transactions(decode_txs_found)
+        utxo_store.commit(height=index_height)
 
-def update_mempool_state(if_catch_lastest):
+def update_mempool_state(if_catch_lastest, block_txids=None):
     """
     更新内存池状态
     
     Args:
         if_catch_lastest: 是否已追上最新区块
+        block_txids: 已处理区块中的全部交易
     """
     global index_height
-    global mempool
-    global last_mempool
     
     if not if_catch_lastest:
         index_height += 1
-        last_mempool = mempool
-        mempool = []
+        mempool_tracker.confirm(block_txids)
+
+
+async def rollback_to_fork(fork_height):
+    """
+    链重组时删除分叉点之后区块中的交易, 并从分叉点的下一个区块重新索引
+    
+    Args:
+        fork_height: 分叉点高度（新旧链共同的最高区块）
+    """
+    global index_height
+    
+    logging.warning("回滚交易记录: 区块高度 %s -> %s", index_height - 1, fork_height)
+    async with DBManager.transaction() as conn:
+        await delete_transactions_above_height_nocommit(conn, fork_height)
+        await delete_block_hashes_nocommit(conn, fork_height, INDEX_STATUS_PREFIX)
+        await save_index_status_nocommit(conn, fork_height + 1, [], [], INDEX_STATUS_PREFIX)
+    
+    # 本地 UTXO 存储中被旧链花费的输出由 prevout_cache 回退到节点查询; 预取器在高度不连续时自动重新预取
+    index_height = fork_height + 1
+    mempool_tracker.reset()
 
 
 async def scan_chain_and_build_index():
@@ -387,18 +367,31 @@ async def scan_chain_and_build_index():
         if_catch_lastest, block_count_res = await check_block_height()
         
         # 获取当前内存池和时间戳
-        current_mempool, timestamp = await get_mempool_and_timestamp(if_catch_lastest)
+        current_mempool, timestamp, decoded_txs, block = await get_mempool_and_timestamp(if_catch_lastest)
+        if current_mempool is None:
+            return True
+        
+        # 区块未接在已索引的链上时回滚到分叉点, 下一轮重新处理
+        if block is not None:
+            fork_height = await find_fork_height(index_height, block.get("previousblockhash"), INDEX_STATUS_PREFIX)
+            if fork_height is not None:
+                await rollback_to_fork(fork_height)
+                return True
         
         # 如果不是最新区块（即有新区块），处理之前未确认的交易
         
         # 找出新交易
-        new_txs, current_mempool = find_transactions(current_mempool)
+        new_txs, current_mempool = find_transactions(current_mempool, if_catch_lastest)
+        if if_catch_lastest and not new_txs:
+            return True
         
         # 处理新交易
-        await process_transactions(new_txs, current_mempool, if_catch_lastest, timestamp)
+        await process_transactions(new_txs, current_mempool, if_catch_lastest, timestamp, decoded_txs, block["hash"] if block is not None else None)
         
         # 更新内存池状态
-        update_mempool_state(if_catch_lastest)
+        update_mempool_state(if_catch_lastest, current_mempool)
+        if new_txs or not if_catch_lastest:
+            chain_notifier.mark_activity()
         
         return True
     except Exception as e:
@@ -407,6 +400,10 @@ async def scan_chain_and_build_index():
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the transaction history index")
+    parser.add_argument("--rebuild", action="store_true", help="清空交易历史数据表并从初始高度全量重建")
+    args = parser.parse_args()
+
     async def task_wrapper():
         """
         Task wrapper.
@@ -414,4 +411,4 @@ if __name__ == "__main__":
         await scan_chain_and_build_index()
 
     # 每 15 秒调用一次 task_wrapper
-    schedule_task(task_wrapper)
\ No newline at end of file
+    schedule_task(task_wrapper, rebuild=args.rebuild)
\ No newline at end of file